@@ -1,8 +1,9 @@
+import functools
+import json
 import math
-import time
-import openai
 # import tiktoken # Not actively used
 import random
+import numpy as np
 # import requests # Not used
 
 # import util # We'll get values from config passed to __init__
@@ -12,111 +13,185 @@ from prompt.agent_prompt import *
 from procoder.functional import format_prompt
 from procoder.prompt import *
 from secretary import Secretary # Secretary is passed in
+import llm_gateway
+from ledger import AgentLedger
+from loan_book import LoanBook
+from decision_backend import DecisionBackend, make_backend
+from conversation import Conversation
+from decision_cache import DecisionCache
+from decision_memo import DecisionMemo, fingerprint
 # from stock import Stock # Stock instances are passed in for plan_stock
 
 # random_init needs access to config values previously from util
 def random_init(stock_a_initial, stock_b_initial, config): # Added config
-    stock_a, stock_b, cash, debt_amount = 0.0, 0.0, 0.0, 0.0
-    # Use config values
+    # Single draw through the bulk sampler; seeded from `random` so random.seed() still controls it
+    rng = np.random.default_rng(random.getrandbits(64))
+    endowments = random_init_bulk(1, stock_a_initial, stock_b_initial, config, rng)
+    return endowment_at(endowments, 0)
+
+
+def _joined(*prompts):
+    return Collection(*prompts).set_indexing_method(sharp2_indexing).set_sep("\n")
+
+
+# Prompt templates of the per-agent calls, built once: they hold no per-call state (inputs are passed to format_prompt)
+FIRST_DAY_LOAN_TEMPLATE = _joined(BACKGROUND_PROMPT, LOAN_TYPE_PROMPT, DECIDE_IF_LOAN_PROMPT)
+LOAN_TEMPLATE = _joined(BACKGROUND_PROMPT, LASTDAY_FORUM_AND_STOCK_PROMPT, LOAN_TYPE_PROMPT, DECIDE_IF_LOAN_PROMPT)
+PREFIX_LOAN_TEMPLATE = _joined(LASTDAY_FORUM_AND_STOCK_PROMPT, LOAN_STATE_PROMPT)
+SEASON_TRADE_TEMPLATE = _joined(FIRST_DAY_FINANCIAL_REPORT, FIRST_DAY_BACKGROUND_KNOWLEDGE,
+                                SEASONAL_FINANCIAL_REPORT, DECIDE_BUY_STOCK_PROMPT)
+FIRST_SESSION_TRADE_TEMPLATE = _joined(FIRST_DAY_FINANCIAL_REPORT, FIRST_DAY_BACKGROUND_KNOWLEDGE, DECIDE_BUY_STOCK_PROMPT)
+PREFIX_SEASON_TRADE_TEMPLATE = _joined(SEASONAL_FINANCIAL_REPORT, TRADE_STATE_PROMPT)
+
+
+@functools.lru_cache(maxsize=None)
+def system_prefix(character):
+    """System message of the "prefix" prompt layout: the static background, reports and rules, identical
+    byte for byte across agents and calls so the provider's prefix cache can reuse it; only the closing
+    character line differs between the four variants."""
+    return format_prompt(_joined(
+        BACKGROUND_PROMPT, FIRST_DAY_BACKGROUND_KNOWLEDGE, FIRST_DAY_FINANCIAL_REPORT, TRADING_RULES_PROMPT, CHARACTER_PROMPT
+    ), {"character": character})
+
+
+def random_init_bulk(n, stock_a_initial, stock_b_initial, config, rng=None):
+    """Draws n agent endowments at once, directly inside the feasible region.
+
+    The old rejection loop drew stock_a, stock_b, cash and debt uniformly from a box and kept draws
+    with MIN_INITIAL_PROPERTY <= wealth <= MAX_INITIAL_PROPERTY and debt <= wealth. Inside that band
+    the box never binds (every component is <= wealth <= max), so accepted draws are: wealth with
+    density ~ W^3 (simplex slice area W^2 times debt acceptance W), its split over
+    (A value, B value, cash) Dirichlet(1, 1, 1), and debt uniform on [0, W]. Share counts are
+    floored and the remainder kept as cash.
+
+    Returns a dict of NumPy arrays: stock_a, stock_b, cash, debt_amount, loan_type, repayment_date.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
     min_initial_prop = config['MIN_INITIAL_PROPERTY']
     max_initial_prop = config['MAX_INITIAL_PROPERTY']
 
-    while stock_a * stock_a_initial + stock_b * stock_b_initial + cash < min_initial_prop \
-            or stock_a * stock_a_initial + stock_b * stock_b_initial + cash > max_initial_prop \
-            or debt_amount > stock_a * stock_a_initial + stock_b * stock_b_initial + cash:
-        stock_a = int(random.uniform(0, max_initial_prop / stock_a_initial if stock_a_initial > 0 else max_initial_prop))
-        stock_b = int(random.uniform(0, max_initial_prop / stock_b_initial if stock_b_initial > 0 else max_initial_prop))
-        cash = random.uniform(0, max_initial_prop)
-        debt_amount = random.uniform(0, max_initial_prop)
-    
+    # Inverse CDF of density proportional to W^3 on [min, max]
+    u = rng.random(n)
+    wealth = (min_initial_prop ** 4 + u * (max_initial_prop ** 4 - min_initial_prop ** 4)) ** 0.25
+    split = rng.dirichlet((1.0, 1.0, 1.0), size=n)
+    stock_a = np.floor(split[:, 0] * wealth / stock_a_initial).astype(np.int64) if stock_a_initial > 0 else np.zeros(n, dtype=np.int64)
+    stock_b = np.floor(split[:, 1] * wealth / stock_b_initial).astype(np.int64) if stock_b_initial > 0 else np.zeros(n, dtype=np.int64)
+    cash = wealth - stock_a * stock_a_initial - stock_b * stock_b_initial
+    debt_amount = rng.random(n) * wealth
+
+    return {
+        "stock_a": stock_a, "stock_b": stock_b, "cash": cash, "debt_amount": debt_amount,
+        "loan_type": rng.integers(0, len(config['LOAN_TYPE']), size=n), # Use config
+        "repayment_date": rng.choice(np.asarray(config['REPAYMENT_DAYS']), size=n), # Use config
+    }
+
+
+def endowment_at(endowments, i):
+    """One agent's (stock_a, stock_b, cash, debt) from a random_init_bulk result, as plain Python values."""
     debt = {
         "loan": "yes",
-        "amount": debt_amount,
-        "loan_type": random.randint(0, len(config['LOAN_TYPE']) - 1), # Use config
-        "repayment_date": random.choice(config['REPAYMENT_DAYS']) # Use config
+        "amount": float(endowments["debt_amount"][i]),
+        "loan_type": int(endowments["loan_type"][i]),
+        "repayment_date": int(endowments["repayment_date"][i])
     }
-    return stock_a, stock_b, cash, debt
+    return int(endowments["stock_a"][i]), int(endowments["stock_b"][i]), float(endowments["cash"][i]), debt
 
 
 class Agent:
-    def __init__(self, i, stock_a_price, stock_b_price, secretary: Secretary, model: str, config: dict): # Added config
+    def __init__(self, i, stock_a_price, stock_b_price, secretary: Secretary, model: str, config: dict, ledger: AgentLedger = None, loan_book: LoanBook = None, endowment=None, backend: DecisionBackend = None, decision_cache: DecisionCache = None): # Added config
         self.order = i
+        # Balance sheet lives in one row of a shared columnar ledger; a private one-row ledger if none given
+        self.ledger = ledger if ledger is not None else AgentLedger(capacity=1)
+        self.row = self.ledger.add_row(owner=self)
+        self._col_a, self._col_b = self.ledger.column("A"), self.ledger.column("B")
+        # Loans are indexed by repayment day in a (normally shared) loan book
+        self.loan_book = loan_book if loan_book is not None else LoanBook(self.ledger, capacity=1)
         self.secretary = secretary # Secretary now handles its own API key
         self.model = model # Passed from main, originally from config
         self.config = config # Store config for later use by methods
 
         self.character = random.choice(["Conservative", "Aggressive", "Balanced", "Growth-Oriented"])
 
-        # Pass config to random_init
-        self.stock_a_amount, self.stock_b_amount, self.cash, init_debt = random_init(stock_a_price, stock_b_price, config)
-        self.init_proper = self.get_total_proper(stock_a_price, stock_b_price)
+        # Pre-drawn endowment from random_init_bulk, otherwise pass config to random_init
+        if endowment is None: endowment = random_init(stock_a_price, stock_b_price, config)
+        self.stock_a_amount, self.stock_b_amount, self.cash, init_debt = endowment
+        self.ledger.init_proper[self.row] = self.get_total_proper(stock_a_price, stock_b_price)
 
         self.action_history = [[] for _ in range(config['TOTAL_DATE'])] # Use config
-        self.chat_history = []
-        self.loans = [init_debt]
-        self.is_bankrupt = False
-        self.quit = False
+        # "legacy" interleaves the background with per-agent numbers; "prefix" moves everything static into a shared system message
+        self.prompt_layout = config.get('PROMPT_LAYOUT', "legacy")
+        self.chat_history = Conversation(config.get('CONTEXT_MODE', "legacy"), config.get('CONTEXT_TOKEN_BUDGET', 6000),
+                                         system_prefix(self.character) if self.prompt_layout == "prefix" else None)
+        self.loan_book.add(self.row, init_debt)
         
         # Store current loan rates, can be updated by events
         self.current_loan_rates = list(self.config['LOAN_RATE'])
         self.api_key = config['DEEPSEEK_API_KEY'] # Store API key
+        self.backend = backend if backend is not None else make_backend(config) # Normally one shared instance from simulation()
+        self.decision_cache = decision_cache # Shared approximate cache of trade/loan decisions, None when disabled
+        self.trade_memo = DecisionMemo(config.get('TRADE_MEMO_POLICY', "off")) # Last trade decision of the day, for unchanged states
+
+    # --- Views onto this agent's ledger row ---
+    @property
+    def cash(self):
+        return float(self.ledger.cash[self.row])
+
+    @cash.setter
+    def cash(self, value):
+        self.ledger.cash[self.row] = value
+
+    @property
+    def stock_a_amount(self):
+        return int(self.ledger.holdings[self.row, self._col_a])
+
+    @stock_a_amount.setter
+    def stock_a_amount(self, value):
+        self.ledger.holdings[self.row, self._col_a] = value
+
+    @property
+    def stock_b_amount(self):
+        return int(self.ledger.holdings[self.row, self._col_b])
+
+    @stock_b_amount.setter
+    def stock_b_amount(self, value):
+        self.ledger.holdings[self.row, self._col_b] = value
+
+    @property
+    def loans(self):
+        return self.loan_book.loans_of(self.row)
+
+    @property
+    def init_proper(self):
+        return float(self.ledger.init_proper[self.row])
+
+    @property
+    def quit(self):
+        return bool(self.ledger.quit[self.row])
+
+    @quit.setter
+    def quit(self, value):
+        self.ledger.quit[self.row] = value
+
+    @property
+    def is_bankrupt(self):
+        return bool(self.ledger.is_bankrupt[self.row])
+
+    @is_bankrupt.setter
+    def is_bankrupt(self, value):
+        self.ledger.is_bankrupt[self.row] = value
 
     def update_loan_rates(self, new_rates):
         self.current_loan_rates = list(new_rates)
         log.logger.info(f"Agent {self.order}: Loan rates updated to {self.current_loan_rates}")
 
-    def run_api(self, prompt, temperature: float = 1):
-        return self.run_api_deepseek(prompt, temperature) # Changed name for clarity
-
-    def run_api_deepseek(self, prompt, temperature: float = 1):
-        if not self.api_key: # Use stored API key
-            log.logger.error("ERROR: DEEPSEEK_API_KEY not found in agent's config.")
-            return ""
+    def run_api(self, prompt, temperature: float = 1, call_type="chat", context=None):
+        # The backend (LLM endpoint or in-process rules, see decision_backend.py) produces the reply text
+        return self.backend.complete(self, prompt, temperature, call_type=call_type, context=context)
 
-        try:
-            client = openai.OpenAI(
-                api_key=self.api_key, # Use stored API key
-                base_url="https://api.deepseek.com/v1"
-            )
-        except Exception as e:
-            log.logger.error(f"Error initializing OpenAI client for DeepSeek: {e}")
-            return ""
-
-        self.chat_history.append({"role": "user", "content": prompt})
-        max_retry = 2
-        retry = 0
-
-        while retry < max_retry:
-            try:
-                response = client.chat.completions.create(
-                    model=self.model, # Use agent's model
-                    messages=self.chat_history,
-                    temperature=temperature,
-                )
-                msg = response.choices[0].message
-                if msg and msg.content is not None:
-                    self.chat_history.append({"role": msg.role, "content": msg.content})
-                    return msg.content
-                else:
-                    log.logger.warning(f"DeepSeek API returned an empty message or content for prompt: {prompt}")
-                    if msg is None: log.logger.warning("response.choices[0].message was None.")
-                    elif msg.content is None: log.logger.warning("response.choices[0].message.content was None.")
-                    raise openai.APIError("Received empty message content from DeepSeek.", response=response, body=None) # type: ignore
-            except openai.APIError as e:
-                log.logger.warning(f"DeepSeek API Error (APIError), retry {retry+1}/{max_retry}: {e}")
-                retry += 1
-                time.sleep(1)
-            except openai.OpenAIError as e:
-                log.logger.warning(f"DeepSeek API Error (OpenAIError), retry {retry+1}/{max_retry}: {e}")
-                retry += 1
-                time.sleep(1)
-            except Exception as e:
-                log.logger.error(f"Unexpected error during DeepSeek API call, retry {retry+1}/{max_retry}: {e}")
-                retry += 1
-                time.sleep(1)
-
-        log.logger.error(f"ERROR: DeepSeek API FAILED AFTER {max_retry} RETRIES. SKIP THIS INTERACTION.")
-        return ""
+    def ask(self, prompt_template, inputs, call_type, context=None, temperature: float = 1):
+        # Prompts are only rendered for backends that read them
+        prompt = format_prompt(prompt_template, inputs) if self.backend.needs_prompt else ""
+        return self.run_api(prompt, temperature, call_type=call_type, context=context)
 
     def get_total_proper(self, stock_a_price, stock_b_price):
         return (self.stock_a_amount * stock_a_price +
@@ -130,9 +205,13 @@ class Agent:
         return proper, self.cash, a_value, b_value
 
     def get_total_loan(self):
-        return sum(loan["amount"] for loan in self.loans)
+        return self.loan_book.total_for(self.row)
 
     def plan_loan(self, date, stock_a_price, stock_b_price, lastday_forum_message):
+        return self.apply_loan(date, self.decide_loan(date, stock_a_price, stock_b_price, lastday_forum_message))
+
+    def decide_loan(self, date, stock_a_price, stock_b_price, lastday_forum_message):
+        # LLM part of plan_loan: reads agent state but changes nothing, so agents can decide concurrently
         if self.quit:
             return {"loan": "no"}
 
@@ -142,9 +221,7 @@ class Agent:
         loan_rate3 = self.current_loan_rates[2] if len(self.current_loan_rates) > 2 else 0
         
         if date == 1:
-            prompt_template = Collection(
-                BACKGROUND_PROMPT, LOAN_TYPE_PROMPT, DECIDE_IF_LOAN_PROMPT
-            ).set_indexing_method(sharp2_indexing).set_sep("\n")
+            prompt_template = FIRST_DAY_LOAN_TEMPLATE
             max_loan = self.init_proper - self.get_total_loan() # Max loan could be a % of property
             inputs = {
                 'date': date, 'character': self.character,
@@ -155,10 +232,7 @@ class Agent:
                 'loan_type_durations': ", ".join(map(str, self.config['LOAN_TYPE_DATE'])) # And durations
             }
         else:
-            prompt_template = Collection(
-                BACKGROUND_PROMPT, LASTDAY_FORUM_AND_STOCK_PROMPT,
-                LOAN_TYPE_PROMPT, DECIDE_IF_LOAN_PROMPT
-            ).set_indexing_method(sharp2_indexing).set_sep("\n")
+            prompt_template = LOAN_TEMPLATE
             max_loan = self.get_total_proper(stock_a_price, stock_b_price) * 0.5 - self.get_total_loan() # Example: max loan 50% of current property minus existing debt
             inputs = {
                 "date": date, "character": self.character,
@@ -171,13 +245,28 @@ class Agent:
                 'loan_type_durations': ", ".join(map(str, self.config['LOAN_TYPE_DATE']))
             }
 
+        if self.prompt_layout == "prefix": # Same inputs, static text already in the system message
+            prompt_template = LOAN_STATE_PROMPT if date == 1 else PREFIX_LOAN_TEMPLATE
+
         if max_loan <= 0:
-            log.logger.info(f"Agent {self.order}: Max loan is {max_loan}, deciding not to loan without API call.")
+            log.logger.debug(f"Agent {self.order}: Max loan is {max_loan}, deciding not to loan without API call.")
             return {"loan": "no"}
 
+        cache = self.decision_cache if self.decision_cache is not None and self.decision_cache.enabled else None
+        if cache is not None:
+            cache_key = cache.loan_key(self, date, stock_a_price, stock_b_price, max_loan)
+            cached = cache.get(cache_key, date, 0)
+            if cached is not None:
+                loan_format_check, _, loan = self.secretary.check_loan(json.dumps(cache.rescale_loan(cached, max_loan)), max_loan, len(self.config['LOAN_TYPE']), repair=False)
+                if loan_format_check:
+                    log.logger.debug(f"Agent {self.order}: loan decision reused from a similar trader: {loan}")
+                    return loan
+                cache.reject()
+
         try_times = 0
         MAX_TRY_TIMES = 3
-        resp = self.run_api(format_prompt(prompt_template, inputs))
+        loan_context = {"date": date, "max_loan": max_loan, "num_loan_types": len(self.config['LOAN_TYPE'])}
+        resp = self.ask(prompt_template, inputs, "loan", loan_context)
         if resp == "": return {"loan": "no"}
 
         # Secretary's check_loan needs max_loan and number of loan types for validation
@@ -187,36 +276,39 @@ class Agent:
             if try_times > MAX_TRY_TIMES:
                 log.logger.warning(f"Agent {self.order}: Loan format try times > MAX_TRY_TIMES. Skip as no loan today.")
                 loan = {"loan": "no"}; break
-            resp = self.run_api(format_prompt(LOAN_RETRY_PROMPT, {"fail_response": fail_response}))
+            resp = self.ask(LOAN_RETRY_PROMPT, {"fail_response": fail_response}, "loan_retry", loan_context)
             if resp == "": loan = {"loan": "no"}; break
             loan_format_check, fail_response, loan = self.secretary.check_loan(resp, max_loan, len(self.config['LOAN_TYPE']))
+        self.chat_history.settle(loan)
+        if cache is not None and loan_format_check: cache.put(cache_key, date, 0, cache.normalize_loan(loan, max_loan))
+        return loan
 
+    def apply_loan(self, date, loan):
+        # Books a decided loan; called in agent order so logs and records stay deterministic
         if loan.get("loan") == "yes":
             loan_type_idx = loan.get("loan_type") # This is an index 0, 1, 2
             # Use config for LOAN_TYPE_DATE
             if loan_type_idx is not None and 0 <= loan_type_idx < len(self.config['LOAN_TYPE_DATE']):
                 loan["repayment_date"] = date + self.config['LOAN_TYPE_DATE'][loan_type_idx]
-                self.loans.append(loan)
+                self.loan_book.add(self.row, loan)
                 self.cash += loan["amount"]
-                log.logger.info(f"INFO: Agent {self.order} decide to loan: {loan}")
+                log.logger.debug(f"INFO: Agent {self.order} decide to loan: {loan}")
             else:
                 log.logger.warning(f"Agent {self.order}: Invalid loan_type index {loan_type_idx} in loan decision. Not taking loan.")
                 loan = {"loan": "no"}
         else:
-            log.logger.info(f"INFO: Agent {self.order} decide not to loan")
+            log.logger.debug(f"INFO: Agent {self.order} decide not to loan")
         return loan
 
     def plan_stock(self, date, time, stock_a, stock_b, stock_a_deals, stock_b_deals): # stock_a, stock_b are Stock objects
         if self.quit: return {"action_type": "no"}
+        self.chat_history.start_session(time)
 
         prompt_template = None
         # Use config for SEASON_REPORT_DAYS
         if date in self.config['SEASON_REPORT_DAYS'] and time == 1:
             index = self.config['SEASON_REPORT_DAYS'].index(date)
-            prompt_template = Collection(
-                FIRST_DAY_FINANCIAL_REPORT, FIRST_DAY_BACKGROUND_KNOWLEDGE,
-                SEASONAL_FINANCIAL_REPORT, DECIDE_BUY_STOCK_PROMPT
-            ).set_indexing_method(sharp2_indexing).set_sep("\n")
+            prompt_template = SEASON_TRADE_TEMPLATE
             inputs = {
                 "date": date, "time": time,
                 "stock_a": self.stock_a_amount, "stock_b": self.stock_b_amount,
@@ -228,9 +320,7 @@ class Agent:
                 "stock_b_report": stock_b.gen_financial_report(index)
             }
         elif time == 1:
-            prompt_template = Collection(
-                FIRST_DAY_FINANCIAL_REPORT, FIRST_DAY_BACKGROUND_KNOWLEDGE, DECIDE_BUY_STOCK_PROMPT
-            ).set_indexing_method(sharp2_indexing).set_sep("\n")
+            prompt_template = FIRST_SESSION_TRADE_TEMPLATE
             inputs = {
                 "date": date, "time": time,
                 "stock_a": self.stock_a_amount, "stock_b": self.stock_b_amount,
@@ -246,13 +336,39 @@ class Agent:
                 "stock_a_deals": stock_a_deals, "stock_b_deals": stock_b_deals, "cash": self.cash
             }
         
+        if self.prompt_layout == "prefix": # Only the season's report (if any) and the session numbers
+            prompt_template = PREFIX_SEASON_TRADE_TEMPLATE if "stock_a_report" in inputs else TRADE_STATE_PROMPT
+
         if prompt_template is None:
             log.logger.error("Error: prompt_template not set in plan_stock.")
             return {"action_type": "no"}
 
+        price_a, price_b = inputs["stock_a_price"], inputs["stock_b_price"]
+        digest, action = self.memo_lookup(date, time, price_a, price_b, stock_a_deals, stock_b_deals)
+        if action is not None: return action
+
+        cache = self.decision_cache if self.decision_cache is not None and self.decision_cache.enabled else None
+        if cache is not None:
+            cache_key = cache.trade_key(self, date, time, price_a, price_b, stock_a_deals, stock_b_deals)
+            cached = cache.get(cache_key, date, time)
+            if cached is not None:
+                action_format_check, _, action = self.secretary.check_action(
+                    json.dumps(cache.rescale_action(cached, self, price_a, price_b)), self.cash, self.stock_a_amount, self.stock_b_amount,
+                    price_a, price_b, repair=False
+                )
+                if action_format_check:
+                    if action.get("action_type") not in ("buy", "sell"): action = {"action_type": "no"}
+                    self.remember_trade(date, time, price_a, price_b, action, "reused from a similar trader")
+                    self.trade_memo.remember(date, digest, action)
+                    log.logger.debug(f"INFO: Agent {self.order} reuses a cached decision: {action}")
+                    return action
+                cache.reject()
+
         try_times = 0
         MAX_TRY_TIMES = 3
-        resp = self.run_api(format_prompt(prompt_template, inputs))
+        trade_context = {"date": date, "session": time, "stock_a_price": inputs["stock_a_price"], "stock_b_price": inputs["stock_b_price"],
+                         "stock_a_deals": stock_a_deals, "stock_b_deals": stock_b_deals}
+        resp = self.ask(prompt_template, inputs, "trade", trade_context)
         if resp == "": return {"action_type": "no"}
 
         action_format_check, fail_response, action = self.secretary.check_action(
@@ -264,20 +380,54 @@ class Agent:
             if try_times > MAX_TRY_TIMES:
                 log.logger.warning(f"Agent {self.order}: Action format try times > MAX_TRY_TIMES. Skip action.")
                 action = {"action_type": "no"}; break
-            resp = self.run_api(format_prompt(BUY_STOCK_RETRY_PROMPT, {"fail_response": fail_response}))
+            resp = self.ask(BUY_STOCK_RETRY_PROMPT, {"fail_response": fail_response}, "trade_retry", trade_context)
             if resp == "": action = {"action_type": "no"}; break
             action_format_check, fail_response, action = self.secretary.check_action(
                 resp, self.cash, self.stock_a_amount, self.stock_b_amount,
                 stock_a.get_price(), stock_b.get_price()
             )
+        self.chat_history.settle(action)
+        if cache is not None and action_format_check: cache.put(cache_key, date, time, cache.normalize_action(action, self, price_a, price_b))
+        if action_format_check: self.trade_memo.remember(date, digest, action)
 
         if action.get("action_type") in ("buy", "sell"):
-            log.logger.info(f"INFO: Agent {self.order} decide to action: {action}")
+            log.logger.debug(f"INFO: Agent {self.order} decide to action: {action}")
             return action
         else:
-            log.logger.info(f"INFO: Agent {self.order} decide not to action")
+            log.logger.debug(f"INFO: Agent {self.order} decide not to action")
             return {"action_type": "no"}
 
+    def memo_lookup(self, date, time, stock_a_price, stock_b_price, stock_a_deals, stock_b_deals):
+        # (fingerprint, decision) for this session's trade inputs; the decision is None unless they are
+        # unchanged since the agent's previous session today and TRADE_MEMO_POLICY short-circuits it
+        if self.trade_memo.policy == "off": return None, None # Nothing to match, so nothing to hash
+        digest = fingerprint(self.stock_a_amount, self.stock_b_amount, self.cash, stock_a_price, stock_b_price, stock_a_deals, stock_b_deals)
+        action = self.trade_memo.lookup(date, time, digest)
+        if action is not None:
+            self.remember_trade(date, time, stock_a_price, stock_b_price, action, "nothing changed since your last session")
+            log.logger.debug(f"INFO: Agent {self.order} state unchanged, {self.trade_memo.policy}: {action}")
+        return digest, action
+
+    def remember_trade(self, date, time, stock_a_price, stock_b_price, action, source):
+        # Keeps a decision made without this agent's own conversation (batched or cached) in its context
+        self.chat_history.record(
+            f"Trading session {time} on day {date}: A at {stock_a_price}, B at {stock_b_price}; you held "
+            f"{self.stock_a_amount} A, {self.stock_b_amount} B and {self.cash} in cash ({source}).", "trade", action)
+
+    def recheck_action(self, action, stock_a_price, stock_b_price):
+        # Re-validates an action decided on a snapshot against the agent's state at commit time
+        if self.quit or action.get("action_type") not in ("buy", "sell"):
+            return {"action_type": "no"}
+        fields = {k: action[k] for k in ("action_type", "stock", "amount", "price") if k in action}
+        action_format_check, fail_response, checked = self.secretary.check_action(
+            json.dumps(fields), self.cash, self.stock_a_amount, self.stock_b_amount,
+            stock_a_price, stock_b_price, repair=False # An order that no longer fits is dropped, not resized
+        )
+        if not action_format_check:
+            log.logger.info(f"INFO: Agent {self.order} action {fields} no longer valid at commit: {fail_response}")
+            return {"action_type": "no"}
+        return checked
+
     def buy_stock(self, stock_name, price, amount): # Price is passed, amount is passed
         if self.quit: return False
         if self.cash < price * amount or stock_name not in ['A', 'B']:
@@ -286,7 +436,7 @@ class Agent:
         self.cash -= price * amount
         if stock_name == 'A': self.stock_a_amount += amount
         else: self.stock_b_amount += amount
-        log.logger.info(f"Agent {self.order} BOUGHT {amount} of {stock_name} at {price}. New cash: {self.cash}")
+        log.logger.debug(f"Agent {self.order} BOUGHT {amount} of {stock_name} at {price}. New cash: {self.cash}")
         return True
 
     def sell_stock(self, stock_name, price, amount): # Price is passed, amount is passed
@@ -299,65 +449,18 @@ class Agent:
         if stock_name == 'A': self.stock_a_amount -= amount
         else: self.stock_b_amount -= amount
         self.cash += price * amount
-        log.logger.info(f"Agent {self.order} SOLD {amount} of {stock_name} at {price}. New cash: {self.cash}")
+        log.logger.debug(f"Agent {self.order} SOLD {amount} of {stock_name} at {price}. New cash: {self.cash}")
         return True
 
     def loan_repayment(self, date):
         if self.quit: return
-        for loan in list(self.loans):
-            if loan.get("repayment_date") == date:
-                loan_type_idx = loan.get("loan_type") # This is an index 0, 1, 2
-                # Use self.current_loan_rates (which reflects events)
-                if loan_type_idx is not None and 0 <= loan_type_idx < len(self.current_loan_rates):
-                    repayment_amount = loan["amount"] * (1 + self.current_loan_rates[loan_type_idx])
-                    self.cash -= repayment_amount
-                    if loan in self.loans: self.loans.remove(loan)
-                    log.logger.info(f"Agent {self.order}: Repaid loan {loan['amount']} with interest. New cash: {self.cash}. Loan details: {loan}")
-                else:
-                    log.logger.error(f"Agent {self.order}: Invalid loan_type index {loan_type_idx} during repayment for loan: {loan}")
-        
+        # Only this agent's loans due today; the simulation loop settles everyone at once via LoanBook.settle_due
+        self.loan_book.settle_due(date, self.current_loan_rates, rows=[self.row])
+
         if self.cash < 0 and not self.is_bankrupt: # check bankruptcy only if not already flagged
             log.logger.warning(f"Agent {self.order}: Cash became negative ({self.cash}) after loan repayment. Triggering bankruptcy check.")
             self.is_bankrupt = True
 
-    def interest_payment(self):
-        if self.quit: return
-        for loan in self.loans:
-            loan_type_idx = loan.get("loan_type")
-            # Use self.current_loan_rates
-            if loan_type_idx is not None and 0 <= loan_type_idx < len(self.current_loan_rates):
-                # Assuming interest is paid monthly and LOAN_RATE is annual.
-                # The original code divides by 12. This should be based on loan duration if it's not monthly payment.
-                # For simplicity, sticking to original logic: (annual rate / 12)
-                # If REPAYMENT_DAYS are actual payment days (not just interest check days), then interest logic might need adjustment.
-                # Based on REPAYMENT_DAYS being [22, 44, ...], these look like monthly equivalent ticks (22 days ~ 1 month)
-                interest_due = loan["amount"] * self.current_loan_rates[loan_type_idx] / (self.config['LOAN_TYPE_DATE'][loan_type_idx] / 22.0) # Pro-rata for the period
-                # A simpler interpretation: LOAN_RATE is per period defined by LOAN_TYPE_DATE.
-                # If Repayment_Days are monthly interest payment days for all loans:
-                # interest_due = loan["amount"] * (self.current_loan_rates[loan_type_idx] / (self.config['LOAN_TYPE_DATE'][loan_type_idx]/22) ) # Monthly portion of period rate
-                # The original code `util.LOAN_RATE[loan_type] / 12` suggests rates are annual and payments monthly.
-                # Let's assume LOAN_RATE from config is "per period" as defined by LOAN_TYPE_DATE
-                # And REPAYMENT_DAYS are when *some* interest might be due.
-                # For simplicity, if REPAYMENT_DAYS are monthly ticks, then this is monthly interest on all active loans.
-                # This part is tricky. Assuming self.current_loan_rates are *period rates* matching LOAN_TYPE_DATE.
-                # If REPAYMENT_DAYS are monthly, then we need to calculate monthly equivalent interest.
-                # Let's follow the original code's structure of dividing by 12, implying rates are annual.
-                # We need to ensure self.current_loan_rates is consistent (annual if dividing by 12).
-                # The prompt for plan_loan implies loan_rate1,2,3 are for the loan types. Let's assume these are period rates.
-                # So, if REPAYMENT_DAYS are monthly ticks, then no simple division by 12.
-                # This needs clarification. For now, let's assume LOAN_RATE in config is *annual* for consistency with original /12.
-                annual_rate = self.current_loan_rates[loan_type_idx] # Assuming this is now annual rate
-                interest_due = loan["amount"] * annual_rate / 12 
-                self.cash -= interest_due
-                log.logger.info(f"Agent {self.order}: Paid monthly interest {interest_due} for loan {loan['amount']}. New cash: {self.cash}")
-            else:
-                log.logger.error(f"Agent {self.order}: Invalid loan_type {loan_type_idx} during interest payment for loan: {loan}")
-
-            if self.cash < 0 and not self.is_bankrupt:
-                log.logger.warning(f"Agent {self.order}: Cash became negative ({self.cash}) after interest payment. Triggering bankruptcy check.")
-                self.is_bankrupt = True
-
-
     def bankrupt_process(self, stock_a_price, stock_b_price):
         # This method seems largely self-contained using agent's current state and passed prices.
         # No direct config access needed here unless bankruptcy rules change based on config.
@@ -409,13 +512,11 @@ class Agent:
 
     def post_message(self):
         if self.quit: return ""
-        prompt = format_prompt(POST_MESSAGE_PROMPT, inputs={}) # Assuming POST_MESSAGE_PROMPT doesn't need dynamic inputs from config
-        return self.run_api(prompt)
+        return self.ask(POST_MESSAGE_PROMPT, {}, "forum") # Assuming POST_MESSAGE_PROMPT doesn't need dynamic inputs from config
 
     def next_day_estimate(self):
         if self.quit: return {"buy_A": "no", "buy_B": "no", "sell_A": "no", "sell_B": "no", "loan": "no"}
-        prompt = format_prompt(NEXT_DAY_ESTIMATE_PROMPT, inputs={}) # Assuming this prompt doesn't need dynamic inputs from config
-        resp = self.run_api(prompt)
+        resp = self.ask(NEXT_DAY_ESTIMATE_PROMPT, {}, "estimate") # Assuming this prompt doesn't need dynamic inputs from config
         if resp == "": return {"buy_A": "no", "buy_B": "no", "sell_A": "no", "sell_B": "no", "loan": "no"}
         
         format_check, fail_response, estimate = self.secretary.check_estimate(resp)
@@ -425,9 +526,10 @@ class Agent:
             if try_times > MAX_TRY_TIMES:
                 log.logger.warning(f"Agent {self.order}: Estimation format try times > MAX_TRY_TIMES.")
                 estimate = {"buy_A": "no", "buy_B": "no", "sell_A": "no", "sell_B": "no", "loan": "no"}; break
-            resp = self.run_api(format_prompt(NEXT_DAY_ESTIMATE_RETRY, {"fail_response": fail_response})) # NEXT_DAY_ESTIMATE_RETRY from agent_prompt.py
+            resp = self.ask(NEXT_DAY_ESTIMATE_RETRY, {"fail_response": fail_response}, "estimate_retry") # NEXT_DAY_ESTIMATE_RETRY from agent_prompt.py
             if resp == "": estimate = {"buy_A": "no", "buy_B": "no", "sell_A": "no", "sell_B": "no", "loan": "no"}; break
             format_check, fail_response, estimate = self.secretary.check_estimate(resp)
+        self.chat_history.settle(estimate)
         return estimate
 
 
@@ -1,6 +1,15 @@
 # app.py
 from flask import Flask, render_template, request, redirect, url_for, jsonify, Response # Added Response
 import main as simulation_main
+import batch_planner
+import conversation
+import decision_cache
+import decision_memo
+import record
+import run_store
+import llm_gateway
+import model_router
+import secretary
 import util as default_util
 import threading
 import os
@@ -65,6 +74,7 @@ def run_simulation_task(form_data_dict, results_container_arg, sse_q):
         config['LOAN_RATE'] = [float(s.strip()) for s in loan_rates_str.split(',') if s.strip()] or list(default_util.LOAN_RATE)
         repayment_days_str = form_data_dict.get('repayment_days', ",".join(map(str,default_util.REPAYMENT_DAYS)) if default_util.REPAYMENT_DAYS else "22,44,66")
         config['REPAYMENT_DAYS'] = [int(s.strip()) for s in repayment_days_str.split(',') if s.strip()] if repayment_days_str else list(default_util.REPAYMENT_DAYS)
+        config['CHARGE_INTEREST'] = form_data_dict.get('charge_interest', str(default_util.CHARGE_INTEREST)).strip().lower() in ("on", "true", "1", "yes")
         config['SEASONAL_DAYS'] = int(form_data_dict.get('seasonal_days', default_util.SEASONAL_DAYS))
         season_report_days_str = form_data_dict.get('season_report_days', ",".join(map(str,default_util.SEASON_REPORT_DAYS)) if default_util.SEASON_REPORT_DAYS else "12,78,144")
         config['SEASON_REPORT_DAYS'] = [int(s.strip()) for s in season_report_days_str.split(',') if s.strip()] if season_report_days_str else list(default_util.SEASON_REPORT_DAYS)
@@ -88,6 +98,48 @@ def run_simulation_task(form_data_dict, results_container_arg, sse_q):
         config['EVENT_2_MESSAGE'] = form_data_dict.get('event_2_message', default_util.EVENT_2_MESSAGE)
         event_2_loan_rate_str = form_data_dict.get('event_2_loan_rate', ",".join(map(str,default_util.EVENT_2_LOAN_RATE)) if default_util.EVENT_2_LOAN_RATE else "0.0255,0.0285,0.0315")
         config['EVENT_2_LOAN_RATE'] = [float(s.strip()) for s in event_2_loan_rate_str.split(',') if s.strip()] if event_2_loan_rate_str else list(default_util.EVENT_2_LOAN_RATE)
+        config['SESSION_MODE'] = form_data_dict.get('session_mode', default_util.SESSION_MODE).strip() or default_util.SESSION_MODE
+        config['TRADE_BATCH_SIZE'] = int(form_data_dict.get('trade_batch_size', default_util.TRADE_BATCH_SIZE) or 0)
+        cache_str = form_data_dict.get('decision_cache', '').strip()
+        try: config['DECISION_CACHE'] = json.loads(cache_str) if cache_str else dict(default_util.DECISION_CACHE)
+        except json.JSONDecodeError: config['DECISION_CACHE'] = dict(default_util.DECISION_CACHE); print("Invalid decision_cache JSON, using defaults.")
+        config['TRADE_MEMO_POLICY'] = form_data_dict.get('trade_memo_policy', default_util.TRADE_MEMO_POLICY).strip() or default_util.TRADE_MEMO_POLICY
+        config['RECORD_FORMAT'] = form_data_dict.get('record_format', default_util.RECORD_FORMAT).strip() or default_util.RECORD_FORMAT
+        config['RECORD_FLUSH_ROWS'] = int(form_data_dict.get('record_flush_rows', default_util.RECORD_FLUSH_ROWS) or default_util.RECORD_FLUSH_ROWS)
+        config['RECORD_EXCEL_MAX_ROWS'] = int(form_data_dict.get('record_excel_max_rows', default_util.RECORD_EXCEL_MAX_ROWS) or 0)
+        config['RECORD_QUEUE_SIZE'] = int(form_data_dict.get('record_queue_size', default_util.RECORD_QUEUE_SIZE) or 0)
+        config['RECORD_QUEUE_POLICY'] = form_data_dict.get('record_queue_policy', default_util.RECORD_QUEUE_POLICY).strip() or default_util.RECORD_QUEUE_POLICY
+        # Server paths and the provider URL come from util.py only, never from the request
+        config['RECORD_STORE_PATH'] = default_util.RECORD_STORE_PATH
+        config['RECORD_PARQUET_DIR'] = default_util.RECORD_PARQUET_DIR
+        config['LOG_LEVEL'] = form_data_dict.get('log_level', default_util.LOG_LEVEL).strip() or default_util.LOG_LEVEL
+        random_seed_str = form_data_dict.get('random_seed', '').strip()
+        config['RANDOM_SEED'] = int(random_seed_str) if random_seed_str else default_util.RANDOM_SEED
+        config['LLM_POOL_SIZE'] = int(form_data_dict.get('llm_pool_size', default_util.LLM_POOL_SIZE))
+        config['LLM_TIMEOUT'] = float(form_data_dict.get('llm_timeout', default_util.LLM_TIMEOUT))
+        config['LLM_CONNECT_TIMEOUT'] = float(form_data_dict.get('llm_connect_timeout', default_util.LLM_CONNECT_TIMEOUT))
+        config['LLM_MAX_CONCURRENCY'] = int(form_data_dict.get('llm_max_concurrency', default_util.LLM_MAX_CONCURRENCY))
+        config['LLM_CASSETTE_MODE'] = form_data_dict.get('llm_cassette_mode', default_util.LLM_CASSETTE_MODE).strip() or default_util.LLM_CASSETTE_MODE
+        config['LLM_CASSETTE_PATH'] = default_util.LLM_CASSETTE_PATH
+        config['CONTEXT_MODE'] = form_data_dict.get('context_mode', default_util.CONTEXT_MODE).strip() or default_util.CONTEXT_MODE
+        config['CONTEXT_TOKEN_BUDGET'] = int(form_data_dict.get('context_token_budget', default_util.CONTEXT_TOKEN_BUDGET))
+        config['PROMPT_LAYOUT'] = form_data_dict.get('prompt_layout', default_util.PROMPT_LAYOUT).strip() or default_util.PROMPT_LAYOUT
+        config['LLM_TRACK_USAGE'] = form_data_dict.get('llm_track_usage', str(default_util.LLM_TRACK_USAGE)).strip().lower() in ("on", "true", "1", "yes")
+        config['DECISION_BACKEND'] = form_data_dict.get('decision_backend', default_util.DECISION_BACKEND).strip() or default_util.DECISION_BACKEND
+        config['LLM_BASE_URL'] = default_util.LLM_BASE_URL
+        config['LLM_RATE_LIMIT_RPS'] = float(form_data_dict.get('llm_rate_limit_rps', default_util.LLM_RATE_LIMIT_RPS) or 0)
+        config['LLM_MAX_RETRIES'] = int(form_data_dict.get('llm_max_retries', default_util.LLM_MAX_RETRIES))
+        config['LLM_BACKOFF_BASE'] = float(form_data_dict.get('llm_backoff_base', default_util.LLM_BACKOFF_BASE))
+        config['LLM_BACKOFF_MAX'] = float(form_data_dict.get('llm_backoff_max', default_util.LLM_BACKOFF_MAX))
+        config['LLM_BREAKER_ERROR_RATE'] = float(form_data_dict.get('llm_breaker_error_rate', default_util.LLM_BREAKER_ERROR_RATE))
+        config['LLM_BREAKER_COOLDOWN'] = float(form_data_dict.get('llm_breaker_cooldown', default_util.LLM_BREAKER_COOLDOWN))
+        profiles_str = form_data_dict.get('llm_generation_profiles', '').strip()
+        try: config['LLM_GENERATION_PROFILES'] = json.loads(profiles_str) if profiles_str else json.loads(json.dumps(default_util.LLM_GENERATION_PROFILES))
+        except json.JSONDecodeError: config['LLM_GENERATION_PROFILES'] = json.loads(json.dumps(default_util.LLM_GENERATION_PROFILES)); print("Invalid llm_generation_profiles JSON, using defaults.")
+        for key in ('LLM_ROUTES', 'LLM_MODEL_PRICES'):
+            value_str = form_data_dict.get(key.lower(), '').strip()
+            try: config[key] = json.loads(value_str) if value_str else json.loads(json.dumps(getattr(default_util, key)))
+            except json.JSONDecodeError: config[key] = json.loads(json.dumps(getattr(default_util, key))); print(f"Invalid {key.lower()} JSON, using defaults.")
         # --- End Populate config ---
 
         class Args: pass
@@ -118,6 +170,8 @@ def run_simulation_task(form_data_dict, results_container_arg, sse_q):
         sse_q.put({"type": "status_update", "payload": {"status": "error", "error_message": f"{type(e).__name__}: {str(e)}", "progress_message":"Simulation failed."}})
 
     finally:
+        try: record.close_record_writer("failed") # Drain queued record rows and export them after an error (no-op after a clean run)
+        except Exception as e: print(f"Error closing record writer: {e}")
         final_status_payload = {}
         with simulation_lock:
             if simulation_status == "running":
@@ -225,5 +279,68 @@ def stream_results():
     return Response(event_generator(), mimetype='text/event-stream')
 
 
+# --- Statistics, records and stored runs ---
+# Connection pool / request stats of the shared LLM gateway, plus re-prompts saved by Secretary's local repair
+@app.route('/llm_stats')
+def llm_stats():
+    stats = llm_gateway.get_stats()
+    stats["secretary_repairs"] = secretary.get_repair_stats()
+    stats["routes"] = model_router.get_route_stats()
+    stats["context"] = conversation.get_context_stats()
+    stats["trade_batches"] = batch_planner.get_batch_stats()
+    stats["decision_cache"] = decision_cache.get_cache_stats()
+    stats["trade_memo"] = decision_memo.get_memo_stats()
+    return jsonify(stats)
+
+@app.route('/export_records', methods=['POST'])
+def export_records():
+    # Writes the .xlsx files from the rows recorded so far (also while a simulation is running)
+    sink = record.get_sink()
+    return jsonify({"written": sink.export_excel(), "records": sink.report()})
+
+@app.route('/record_stats')
+def record_stats():
+    # Writer queue depth, spills, blocked puts and write latency of the current (or last) run
+    return jsonify({"writer": record.get_writer_stats(), "sink": record.get_sink().report()})
+
+def _run_store():
+    # The current run's store, or the default one when the run does not record to SQLite
+    return record.get_sink().store or run_store.open_store(default_util.RECORD_STORE_PATH, record.TABLES)
+
+def _unknown_run(run_id):
+    # 404 for a run id the store has never seen (also keeps ids like ".." out of file paths)
+    return None if _run_store().has_run(run_id) else (jsonify({"error": f"Unknown run: {run_id}"}), 404)
+
+@app.route('/runs')
+def list_runs():
+    return jsonify(_run_store().runs().to_dict(orient="records"))
+
+@app.route('/runs/<run_id>/agents/<int:agent>')
+def agent_history(run_id, agent):
+    # e.g. /runs/<id>/agents/7?first_day=50&last_day=80: assets per session and P&L over the range
+    unknown = _unknown_run(run_id)
+    if unknown: return unknown
+    history = _run_store().agent_history(run_id, agent, request.args.get('first_day', type=int), request.args.get('last_day', type=int))
+    pnl = float(history["pnl"].iloc[-1]) if len(history) else 0.0
+    return jsonify({"run_id": run_id, "agent": agent, "pnl": pnl, "sessions": history.to_dict(orient="records")})
+
+@app.route('/runs/<run_id>/export', methods=['POST'])
+def export_run(run_id):
+    # The run's records as .xlsx files under res/<run_id>/
+    unknown = _unknown_run(run_id)
+    if unknown: return unknown
+    return jsonify({"written": _run_store().export_excel(run_id, os.path.join("res", run_id))})
+
+@app.route('/runs/<run_id>/export_parquet', methods=['POST'])
+def export_run_parquet(run_id):
+    # The run's record tables from the store as Parquet under RECORD_PARQUET_DIR or res/parquet (the price tape is
+    # only exported at run end); the directory is not taken from the request
+    unknown = _unknown_run(run_id)
+    if unknown: return unknown
+    import columnar_export # Needs pyarrow
+    root = default_util.RECORD_PARQUET_DIR or os.path.join("res", "parquet")
+    return jsonify({"root": columnar_export.export_run(root, run_id, store=_run_store())})
+
+
 if __name__ == '__main__':
     app.run(debug=True, port=5001, threaded=True) # Use threaded for dev server with SSE
\ No newline at end of file
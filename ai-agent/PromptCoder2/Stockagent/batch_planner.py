@@ -0,0 +1,122 @@
+import json
+import threading
+
+from procoder.functional import format_prompt
+from procoder.prompt import *
+
+from fan_out import run_ordered
+from json_repair import balanced_objects, repair_json_object
+from log.custom_logger import log
+from prompt.agent_prompt import *
+
+_stats_lock = threading.Lock()
+_stats = {"batches": 0, "agents": 0, "accepted": 0, "retried": 0, "empty_replies": 0}
+
+
+def get_batch_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["accepted_ratio"] = stats["accepted"] / stats["agents"] if stats["agents"] else 0.0
+    return stats
+
+
+def reset_batch_stats():
+    with _stats_lock:
+        for key in _stats: _stats[key] = 0
+
+
+def _count(**amounts):
+    with _stats_lock:
+        for key, amount in amounts.items(): _stats[key] += amount
+
+
+def agent_table(agents):
+    return "\n".join(f"{a.order} | {a.character} | {a.cash:.2f} | {a.stock_a_amount} | {a.stock_b_amount}" for a in agents)
+
+
+def batch_prompt(agents, date, time, stock_a, stock_b, stock_a_deals, stock_b_deals):
+    """One prompt for a group of agents: the shared market context of plan_stock and a compact state table."""
+    inputs = {
+        "date": date, "time": time, "agent_table": agent_table(agents),
+        "stock_a_price": stock_a.get_price(), "stock_b_price": stock_b.get_price(),
+        "stock_a_deals": stock_a_deals, "stock_b_deals": stock_b_deals,
+    }
+    config = agents[0].config
+    if date in config['SEASON_REPORT_DAYS'] and time == 1:
+        index = config['SEASON_REPORT_DAYS'].index(date)
+        inputs.update(stock_a_report=stock_a.gen_financial_report(index), stock_b_report=stock_b.gen_financial_report(index))
+        blocks = (BACKGROUND_PROMPT, FIRST_DAY_BACKGROUND_KNOWLEDGE, FIRST_DAY_FINANCIAL_REPORT, SEASONAL_FINANCIAL_REPORT)
+    elif time == 1:
+        blocks = (BACKGROUND_PROMPT, FIRST_DAY_BACKGROUND_KNOWLEDGE, FIRST_DAY_FINANCIAL_REPORT)
+    else:
+        blocks = (BACKGROUND_PROMPT,)
+    template = Collection(*blocks, BATCH_TRADERS_PROMPT, BATCH_DECIDE_STOCK_PROMPT).set_indexing_method(sharp2_indexing).set_sep("\n")
+    return format_prompt(template, inputs)
+
+
+def parse_batch_reply(text):
+    """agent_id -> action dict from a reply holding a JSON array (or loose objects) of per-agent actions.
+
+    Each element is recovered on its own, so one broken element only costs that agent a retry.
+    """
+    entries = {}
+    for start, end in balanced_objects(text or ""):
+        entry, _ = repair_json_object(text[start:end])
+        if not isinstance(entry, dict): continue
+        agent_id = entry.pop("agent_id", entry.pop("agent", None))
+        try: agent_id = int(agent_id)
+        except (TypeError, ValueError): continue
+        entries.setdefault(agent_id, entry) # The first answer for an agent wins
+    return entries
+
+
+def _accept(agent, entry, date, time, stock_a, stock_b, digest):
+    """The agent's validated action from its batch entry, or None if it has to be asked on its own."""
+    if entry is None or agent.quit:
+        return None
+    ok, fail_response, action = agent.secretary.check_action(
+        json.dumps(entry), agent.cash, agent.stock_a_amount, agent.stock_b_amount, stock_a.get_price(), stock_b.get_price()
+    )
+    if not ok:
+        log.logger.info(f"Agent {agent.order}: batch entry {entry} rejected ({fail_response}), asking individually")
+        return None
+    if action.get("action_type") not in ("buy", "sell"): action = {"action_type": "no"}
+    agent.remember_trade(date, time, stock_a.get_price(), stock_b.get_price(), action, "decided in a batch")
+    agent.trade_memo.remember(date, digest, action)
+    return action
+
+
+def plan_stock_batched(agents, date, time, stock_a, stock_b, stock_a_deals, stock_b_deals, batch_size, max_in_flight=1):
+    """plan_stock for many agents deciding on the same frozen books, batch_size agents per request.
+
+    Each batch reply is a JSON array keyed by agent_id; every element goes through Secretary.check_action
+    with that agent's own cash and holdings. Only agents whose element is missing or invalid are asked
+    again with the regular per-agent plan_stock (and its retry loop). Results keep the order of agents.
+    """
+    agents = list(agents)
+    decided, digests = {}, {}
+    for agent in agents: # Agents whose state is unchanged since their previous session are answered by their memo
+        if agent.quit: continue
+        agent.chat_history.start_session(time)
+        digests[agent.order], action = agent.memo_lookup(date, time, stock_a.get_price(), stock_b.get_price(), stock_a_deals, stock_b_deals)
+        if action is not None: decided[agent.order] = action
+    active = [a for a in agents if not a.quit and a.order not in decided]
+    groups = [active[i:i + batch_size] for i in range(0, len(active), batch_size)]
+    trade_context = {"date": date, "session": time, "stock_a_price": stock_a.get_price(), "stock_b_price": stock_b.get_price(),
+                     "stock_a_deals": stock_a_deals, "stock_b_deals": stock_b_deals}
+
+    def decide_group(group):
+        backend = group[0].backend
+        prompt = batch_prompt(group, date, time, stock_a, stock_b, stock_a_deals, stock_b_deals) if backend.needs_prompt else ""
+        reply = backend.complete_batch(group, prompt, call_type="trade_batch", context=trade_context)
+        if not reply: _count(empty_replies=1)
+        entries = parse_batch_reply(reply)
+        return [_accept(agent, entries.get(agent.order), date, time, stock_a, stock_b, digests[agent.order]) for agent in group]
+
+    for group, actions in zip(groups, run_ordered(decide_group, groups, max_in_flight)):
+        for agent, action in zip(group, actions): decided[agent.order] = action
+    retry = [a for a in active if decided[a.order] is None]
+    _count(batches=len(groups), agents=len(active), accepted=len(active) - len(retry), retried=len(retry))
+    for agent, action in zip(retry, run_ordered(lambda ag: ag.plan_stock(date, time, stock_a, stock_b, stock_a_deals, stock_b_deals), retry, max_in_flight)):
+        decided[agent.order] = action
+    return [decided.get(a.order, {"action_type": "no"}) for a in agents]
@@ -0,0 +1,72 @@
+"""Reproducible timing of a whole simulation run with the rule-based backend (no network).
+
+    python bench_simulation.py --agents 1000 --days 10
+    python bench_simulation.py --agents 1000 --days 10 --profile 25
+
+Every setting comes from util.py except the ones given here: DECISION_BACKEND is "rule_based" and
+RANDOM_SEED is fixed, so two runs make the same decisions and only the timing differs. Records are
+written as in a normal run, under a temporary directory unless --workdir is given; the .xlsx export
+follows RECORD_EXCEL_MAX_ROWS unless --excel forces it. Prints the wall time, the part of it spent
+writing the .xlsx files, and seconds per day and agent-sessions per second without that part;
+--profile N adds the N most expensive functions (cumulative time) from cProfile.
+"""
+import argparse
+import copy
+import cProfile
+import os
+import pstats
+import tempfile
+import time
+
+import util as default_util
+
+
+def bench_config(agents, days, seed, session_mode):
+    config = {name: copy.deepcopy(getattr(default_util, name)) for name in dir(default_util) if name.isupper()}
+    config.update({'AGENTS_NUM': agents, 'TOTAL_DATE': days, 'RANDOM_SEED': seed, 'SESSION_MODE': session_mode,
+                   'DECISION_BACKEND': "rule_based", 'MODEL_NAME': "deepseek-reasoner", 'RUN_ID': None,
+                   'RECORD_PARQUET_DIR': ""})
+    return config
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time a rule-based simulation run")
+    parser.add_argument("--agents", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--session-mode", default="continuous", choices=["continuous", "snapshot", "call_auction"])
+    parser.add_argument("--workdir", default=None, help="where res/ is written (a temporary directory by default)")
+    parser.add_argument("--profile", type=int, default=0, metavar="N", help="print the N most expensive functions")
+    parser.add_argument("--log-level", default=default_util.LOG_LEVEL, help='LOG_LEVEL of the run, e.g. "DEBUG"')
+    parser.add_argument("--excel", action="store_true", help="write the .xlsx files whatever RECORD_EXCEL_MAX_ROWS says")
+    args = parser.parse_args()
+
+    import main as simulation_main # After parsing, so --help does not set up the logger
+    import record
+    config = bench_config(args.agents, args.days, args.seed, args.session_mode)
+    config['LOG_LEVEL'] = args.log_level
+    if args.excel: config['RECORD_EXCEL_MAX_ROWS'] = 0
+    workdir = args.workdir or tempfile.mkdtemp(prefix="stockagent-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+
+    profiler = cProfile.Profile() if args.profile else None
+    start = time.perf_counter()
+    if profiler: profiler.enable()
+    try:
+        simulation_main.simulation(None, config, {}, None)
+    finally:
+        if profiler: profiler.disable()
+        simulation_main.close_record_writer("failed")
+    elapsed = time.perf_counter() - start
+
+    sessions = args.agents * args.days * config['TOTAL_SESSION']
+    export = record.get_sink().report()["export_seconds"]
+    print(f"{args.agents} agents x {args.days} days ({args.session_mode}, seed {args.seed}): {elapsed:.2f} s, of which "
+          f"{export:.2f} s .xlsx export; {(elapsed - export) / args.days:.2f} s/day and "
+          f"{sessions / (elapsed - export):,.0f} agent-sessions/s without it; records in {workdir}")
+    if profiler: pstats.Stats(profiler).sort_stats("cumulative").print_stats(args.profile)
+
+
+if __name__ == "__main__":
+    main()
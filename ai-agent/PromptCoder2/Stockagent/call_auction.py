@@ -0,0 +1,73 @@
+import numpy as np
+
+
+def clear_call_auction(orders, reference_price=None):
+    """Uniform-price clearing of one session's batch of orders for a single stock.
+
+    orders: action dicts ({"action_type", "amount", "price", ...}) in submission order.
+    Returns (clearing_price, fills) where fills is a list of (buy_index, sell_index, amount)
+    indexing into orders. clearing_price is None when the curves do not cross.
+
+    The clearing price maximises executable volume min(demand(p), supply(p)); ties are broken
+    by smallest |demand - supply|, then by distance to reference_price, then by lower price.
+    Allocation is price priority then submission order on both sides.
+    """
+    if not orders:
+        return None, []
+
+    is_buy = np.array([o["action_type"] == "buy" for o in orders], dtype=bool)
+    prices = np.array([o["price"] for o in orders], dtype=float)
+    amounts = np.array([o["amount"] for o in orders], dtype=np.int64)
+    index = np.arange(len(orders))
+
+    bid_idx, ask_idx = index[is_buy], index[~is_buy]
+    if len(bid_idx) == 0 or len(ask_idx) == 0:
+        return None, []
+    bid_p, bid_q = prices[bid_idx], amounts[bid_idx]
+    ask_p, ask_q = prices[ask_idx], amounts[ask_idx]
+
+    # Cumulative curves evaluated at every submitted price
+    candidates = np.unique(prices)
+    bid_order = np.argsort(bid_p, kind="stable")
+    bid_cum = np.concatenate(([0], np.cumsum(bid_q[bid_order])))
+    demand = bid_cum[-1] - bid_cum[np.searchsorted(bid_p[bid_order], candidates, side="left")]
+    ask_order = np.argsort(ask_p, kind="stable")
+    ask_cum = np.concatenate(([0], np.cumsum(ask_q[ask_order])))
+    supply = ask_cum[np.searchsorted(ask_p[ask_order], candidates, side="right")]
+
+    volume = np.minimum(demand, supply)
+    max_volume = volume.max()
+    if max_volume <= 0:
+        return None, []
+
+    imbalance = np.abs(demand - supply).astype(float)
+    distance = np.abs(candidates - reference_price) if reference_price is not None else np.zeros_like(candidates)
+    # lexsort: last key is primary
+    best = np.lexsort((candidates, distance, imbalance, -volume))[0]
+    clearing_price = float(candidates[best])
+
+    # Price-time priority allocation of max_volume on each side
+    buy_fill_idx, buy_fill_q = _allocate(bid_idx, -bid_p, bid_q, bid_p >= clearing_price, max_volume)
+    sell_fill_idx, sell_fill_q = _allocate(ask_idx, ask_p, ask_q, ask_p <= clearing_price, max_volume)
+
+    # Pair the two cumulative fill ladders: every breakpoint on either side starts a new fill
+    buy_bounds = np.cumsum(buy_fill_q)
+    sell_bounds = np.cumsum(sell_fill_q)
+    bounds = np.union1d(buy_bounds, sell_bounds)
+    starts = np.concatenate(([0], bounds[:-1]))
+    pair_amounts = bounds - starts
+    buyers = buy_fill_idx[np.searchsorted(buy_bounds, starts, side="right")]
+    sellers = sell_fill_idx[np.searchsorted(sell_bounds, starts, side="right")]
+
+    fills = [(int(b), int(s), int(q)) for b, s, q in zip(buyers, sellers, pair_amounts) if q > 0]
+    return clearing_price, fills
+
+
+def _allocate(order_idx, priority_key, quantity, eligible, total):
+    order_idx, priority_key, quantity = order_idx[eligible], priority_key[eligible], quantity[eligible]
+    ranked = np.lexsort((order_idx, priority_key))
+    order_idx, quantity = order_idx[ranked], quantity[ranked]
+    filled_before = np.cumsum(quantity) - quantity
+    fill = np.clip(total - filled_before, 0, quantity)
+    keep = fill > 0
+    return order_idx[keep], fill[keep]
@@ -0,0 +1,282 @@
+import email.utils
+import random
+import threading
+import time
+from collections import deque
+
+import httpx
+import openai
+
+from log.custom_logger import log
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the provider while the circuit breaker is open."""
+
+
+class TokenBucket:
+    """Requests-per-second limit with a burst of one second's worth of requests."""
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.capacity = max(self.rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+                self.waited += wait
+            time.sleep(wait)
+
+
+class AIMDLimiter:
+    """Concurrency limit that halves on a 429 and grows back by one slot per limit's worth of successes.
+
+    Decreases are applied at most once per decrease_interval, since one burst of throttling
+    usually rejects several calls that were already in flight.
+    """
+
+    def __init__(self, max_limit, min_limit=1, decrease_factor=0.5, decrease_interval=1.0):
+        self.max_limit = max(int(max_limit), 1)
+        self.min_limit = max(min(int(min_limit), self.max_limit), 1)
+        self.limit = float(self.max_limit)
+        self.decrease_factor = decrease_factor
+        self.decrease_interval = decrease_interval
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False, counted=True):
+        """Frees a slot. Returns True if the limit was cut. counted=False leaves the limit as it is."""
+        with self._cond:
+            self.in_flight -= 1
+            decreased = False
+            if counted and throttled:
+                now = time.monotonic()
+                if now - self._last_decrease >= self.decrease_interval:
+                    self.limit = max(float(self.min_limit), self.limit * self.decrease_factor)
+                    self._last_decrease = now
+                    decreased = True
+            elif counted:
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+            return decreased
+
+
+class CircuitBreaker:
+    """Opens when the error rate over the last `window` calls reaches error_rate.
+
+    While open every call fails fast. After cooldown seconds one probe call is let through
+    (half-open): success closes the breaker, failure opens it again.
+    """
+
+    def __init__(self, error_rate=0.5, window=20, min_calls=10, cooldown=30.0):
+        self.error_rate = error_rate
+        self.min_calls = min(min_calls, window)
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.outcomes = deque(maxlen=window)
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Returns (allowed, transition) where transition is the new state name or None."""
+        with self._lock:
+            if self.state == "closed":
+                return True, None
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state, self._probing = "half_open", True
+                return True, "half_open"
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True, None
+            return False, None
+
+    def record(self, success):
+        """Records one call outcome. Returns the new state name if it changed, else None."""
+        with self._lock:
+            if self.state == "half_open":
+                self._probing = False
+                if success:
+                    self.state = "closed"
+                    self.outcomes.clear()
+                    return "closed"
+                self.state, self.opened_at = "open", time.monotonic()
+                return "open"
+            self.outcomes.append(success)
+            if self.state == "closed" and len(self.outcomes) >= self.min_calls:
+                failures = self.outcomes.count(False)
+                if failures / len(self.outcomes) >= self.error_rate:
+                    self.state, self.opened_at = "open", time.monotonic()
+                    return "open"
+            return None
+
+    def abandon(self):
+        """A call ended without telling whether the provider is healthy: records nothing, and lets
+        another probe through if it was the half-open probe."""
+        with self._lock:
+            if self.state == "half_open": self._probing = False
+
+    def current_error_rate(self):
+        with self._lock:
+            return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+
+def retry_after_seconds(error):
+    """Retry-After (or retry-after-ms) of an API error response, in seconds, or None."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try: return float(value) / 1000
+        except ValueError: pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        parsed = email.utils.parsedate_to_datetime(value) if value else None
+        return max(0.0, parsed.timestamp() - time.time()) if parsed else None
+
+
+def classify_error(error):
+    """(retryable, throttled) for an exception raised by the provider call."""
+    if isinstance(error, openai.RateLimitError): return True, True
+    if isinstance(error, openai.APIStatusError): return error.status_code >= 500 or error.status_code in (408, 409), False
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError, httpx.TransportError)): return True, False
+    return False, False
+
+
+class CallGovernor:
+    """Shared admission control for every provider call: rate limit, concurrency, retries, breaker.
+
+    call(model, fn) waits for the model's token bucket and a concurrency slot, runs fn, and retries
+    retryable failures with full-jitter exponential backoff (at least the server's Retry-After).
+    429s shrink the concurrency limit (AIMD). A call given a deadline that times out is the caller's
+    budget running out, not a provider failure: it is not retried and neither the limit nor the
+    breaker counts it. Once the breaker opens, call raises CircuitOpenError
+    without touching the network, and agents fall back to their "no action" defaults.
+    """
+
+    def __init__(self, max_concurrency=20, rate_limit_rps=0, max_retries=2, backoff_base=0.5, backoff_max=30.0,
+                 breaker_error_rate=0.5, breaker_window=20, breaker_cooldown=30.0):
+        self.rate_limit_rps = rate_limit_rps or 0
+        self.max_retries = max(int(max_retries), 0)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.limiter = AIMDLimiter(max_concurrency)
+        self.breaker = CircuitBreaker(error_rate=breaker_error_rate, window=breaker_window,
+                                      min_calls=max(breaker_window // 2, 1), cooldown=breaker_cooldown)
+        self._buckets = {} # model -> TokenBucket
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "attempts": 0, "retries": 0, "throttled": 0, "failures": 0, "fast_failed": 0,
+                       "backoff_seconds": 0.0, "limit_decreases": 0, "breaker_opened": 0, "deadline_expired": 0}
+        self.listener = None # Called with state() on breaker transitions and concurrency cuts
+
+    def _bucket(self, model):
+        if not self.rate_limit_rps:
+            return None
+        with self._lock:
+            bucket = self._buckets.get(model)
+            if bucket is None:
+                bucket = self._buckets[model] = TokenBucket(self.rate_limit_rps)
+            return bucket
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def _notify(self, reason):
+        listener = self.listener
+        if listener is None:
+            return
+        try: listener(dict(self.state(), reason=reason))
+        except Exception as e: log.logger.warning(f"Call governor: state listener failed: {e}")
+
+    def backoff(self, attempt, retry_after=None):
+        """Full-jitter exponential delay for a retry, never shorter than the server's Retry-After."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+    def call(self, model, fn, max_retries=None, deadline=None):
+        """Runs fn under admission control. max_retries overrides the governor's for this call; deadline
+        (seconds) is the timeout the caller gave fn, whose expiry is re-raised without being counted."""
+        max_retries = 0 if deadline else self.max_retries if max_retries is None else max(int(max_retries), 0)
+        self._count("calls")
+        for attempt in range(max_retries + 1):
+            allowed, transition = self.breaker.allow()
+            if transition: self._notify(f"breaker_{transition}")
+            if not allowed:
+                self._count("fast_failed")
+                raise CircuitOpenError(f"Circuit open for LLM calls (error rate {self.breaker.current_error_rate():.0%}), failing fast")
+            bucket = self._bucket(model)
+            if bucket is not None: bucket.acquire()
+            self.limiter.acquire()
+            self._count("attempts")
+            throttled = False
+            try:
+                result = fn()
+            except Exception as e:
+                if deadline and isinstance(e, (openai.APITimeoutError, httpx.TimeoutException)):
+                    self._count("deadline_expired")
+                    self.limiter.release(counted=False)
+                    self.breaker.abandon()
+                    raise
+                retryable, throttled = classify_error(e)
+                self._count("failures")
+                if throttled: self._count("throttled")
+                if self.limiter.release(throttled):
+                    self._count("limit_decreases")
+                    self._notify("concurrency_decreased")
+                transition = self.breaker.record(False)
+                if transition == "open":
+                    self._count("breaker_opened")
+                    log.logger.warning(f"Call governor: circuit breaker opened after {e.__class__.__name__}")
+                if transition: self._notify(f"breaker_{transition}")
+                if not retryable or attempt >= max_retries or self.breaker.state != "closed":
+                    raise
+                delay = self.backoff(attempt, retry_after_seconds(e))
+                self._count("retries"); self._count("backoff_seconds", delay)
+                log.logger.warning(f"Call governor: {e.__class__.__name__} on {model}, retry {attempt + 1}/{max_retries} in {delay:.2f}s")
+                time.sleep(delay)
+                continue
+            self.limiter.release(False)
+            transition = self.breaker.record(True)
+            if transition: self._notify(f"breaker_{transition}")
+            return result
+
+    def state(self):
+        with self._lock:
+            state = dict(self._stats)
+            state["rate_wait_seconds"] = sum(b.waited for b in self._buckets.values())
+        state.update({
+            "breaker_state": self.breaker.state,
+            "error_rate": self.breaker.current_error_rate(),
+            "concurrency_limit": int(self.limiter.limit),
+            "max_concurrency": self.limiter.max_limit,
+            "in_flight": self.limiter.in_flight,
+            "rate_limit_rps": self.rate_limit_rps,
+        })
+        return state
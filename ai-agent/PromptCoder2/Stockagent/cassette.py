@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+from log.custom_logger import log
+
+MODES = ("off", "record", "replay", "auto")
+
+
+class CassetteMiss(Exception):
+    """Raised in replay mode when a request was never recorded."""
+
+
+class Cassette:
+    """On-disk record/replay store for chat completions.
+
+    Requests are keyed by a hash of (model, temperature, messages). The same request can legitimately
+    be made several times in a run (temperature > 0), so each key holds a sequence of responses and
+    replay serves them in recorded order, repeating the last one if a run asks more often.
+
+    Modes: "record" always calls the provider and stores the response, "replay" serves only from the
+    store (a miss raises CassetteMiss), "auto" replays hits and records misses.
+    """
+
+    def __init__(self, path, mode="replay"):
+        if mode not in MODES or mode == "off":
+            raise ValueError(f"Unsupported cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        directory = os.path.dirname(path)
+        if directory: os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT NOT NULL, seq INTEGER NOT NULL, model TEXT, temperature REAL,"
+            " messages TEXT, response TEXT NOT NULL, PRIMARY KEY (key, seq))"
+        )
+        self._conn.commit()
+        self._served = {}    # key -> responses served so far this run
+        self._recorded = {}  # key -> next seq to write
+        self.stats = {"hits": 0, "misses": 0, "recorded": 0}
+
+    @property
+    def replays(self):
+        return self.mode in ("replay", "auto")
+
+    @property
+    def records(self):
+        return self.mode in ("record", "auto")
+
+    @staticmethod
+    def request_key(model, temperature, messages):
+        canonical = json.dumps({"model": model, "temperature": temperature, "messages": messages},
+                               sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def lookup(self, model, temperature, messages):
+        """Next recorded response JSON for this request, or None."""
+        key = self.request_key(model, temperature, messages)
+        with self._lock:
+            seq = self._served.get(key, 0)
+            row = self._conn.execute(
+                "SELECT response FROM responses WHERE key = ? AND seq <= ? ORDER BY seq DESC LIMIT 1", (key, seq)
+            ).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self._served[key] = seq + 1
+            self.stats["hits"] += 1
+            return row[0]
+
+    def store(self, model, temperature, messages, response_json):
+        key = self.request_key(model, temperature, messages)
+        with self._lock:
+            seq = self._recorded.get(key)
+            if seq is None and self.mode == "record":
+                # A fresh recording replaces the key, including the later seqs of an older, longer recording
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                seq = 0
+            elif seq is None: # Auto mode appends after what exists
+                seq = self._conn.execute("SELECT COALESCE(MAX(seq) + 1, 0) FROM responses WHERE key = ?", (key,)).fetchone()[0]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, seq, model, temperature, messages, response) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, seq, model, temperature, json.dumps(messages, ensure_ascii=False), response_json)
+            )
+            self._conn.commit()
+            self._recorded[key] = seq + 1
+            self.stats["recorded"] += 1
+
+    def close(self):
+        with self._lock:
+            try: self._conn.close()
+            except Exception as e: log.logger.warning(f"Cassette: error closing {self.path}: {e}")
@@ -0,0 +1,88 @@
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+from record import TABLES
+from run_store import COLUMNS
+
+# Directory layout: <root>/<table>/run_id=<run id>/day=<day>/part-0.parquet (hive partitioning)
+PARTITIONING = ds.partitioning(pa.schema([("run_id", pa.string()), ("day", pa.int64())]), flavor="hive")
+_ARROW_TYPES = {"int64": pa.int64(), "Int64": pa.int64(), "float64": pa.float64(), "str": pa.string()}
+
+# The price tape of both stocks (Stock.ticks), one row per trade
+TICKS_SCHEMA = pa.schema([("stock", pa.string()), ("session", pa.int16()), ("price", pa.float64()), ("quantity", pa.int64())])
+
+
+def schema(table):
+    """Arrow schema of a record table's files: SQL column names, record dtypes, without the partition columns."""
+    fields = [(name, _ARROW_TYPES.get(dtype, pa.string())) for name, (_, dtype) in zip(COLUMNS[table], TABLES[table][1])]
+    return pa.schema([field for field in fields if field[0] != "day"])
+
+
+def _write_day(root, table, run_id, day, data):
+    directory = os.path.join(root, table, f"run_id={run_id}", f"day={int(day)}")
+    os.makedirs(directory, exist_ok=True)
+    pq.write_table(data, os.path.join(directory, "part-0.parquet"))
+
+
+def export_frame(root, table, run_id, frame):
+    """Writes a run's rows of a record table (SQL column names) as one Parquet file per day."""
+    table_schema = schema(table)
+    for day, rows in frame.groupby("day", sort=True):
+        data = pa.Table.from_pandas(rows.drop(columns="day"), schema=table_schema, preserve_index=False)
+        _write_day(root, table, run_id, day, data)
+
+
+def export_ticks(root, run_id, stocks):
+    """Writes the stocks' trade tapes (TickStore columns, no copy) as one Parquet file per day."""
+    days = sorted(set().union(*(np.unique(stock.ticks.day).tolist() for stock in stocks))) if stocks else []
+    for day in days:
+        parts = []
+        for stock in stocks:
+            _, session, price, quantity = stock.ticks.slice_days(day)
+            if not len(price): continue
+            parts.append(pa.Table.from_arrays([pa.array([stock.name] * len(price), pa.string()), pa.array(session, pa.int16()),
+                                               pa.array(price, pa.float64()), pa.array(quantity, pa.int64())], schema=TICKS_SCHEMA))
+        _write_day(root, "ticks", run_id, day, pa.concat_tables(parts))
+
+
+def export_run(root, run_id, sink=None, store=None, stocks=()):
+    """Exports a run's record tables (from the run's RecordSink, or from a RunStore) and price tape to root."""
+    for table in TABLES:
+        if store is not None: frame = store.frame(table, run_id, headers=False)
+        else:
+            sink.flush(table)
+            frame = sink.read(table)
+            frame.columns = COLUMNS[table]
+        export_frame(root, table, run_id, frame)
+    if stocks: export_ticks(root, run_id, stocks)
+    return root
+
+
+def runs(root, table="stocks"):
+    """Run ids exported under root."""
+    directory = os.path.join(root, table)
+    if not os.path.isdir(directory): return []
+    return sorted(name.split("=", 1)[1] for name in os.listdir(directory) if name.startswith("run_id="))
+
+
+def load(root, table, runs=None, columns=None, first_day=None, last_day=None, as_pandas=False):
+    """A table's rows for the given runs and days as a memory-mapped Arrow table (or a pandas frame).
+
+    Only the partitions of the chosen runs/days and the chosen columns are read; run_id and day
+    come from the directory names and can be selected like any other column.
+    """
+    path = os.path.abspath(os.path.join(root, table))
+    if not os.path.isdir(path): raise FileNotFoundError(f"No {table} export under {root}")
+    dataset = ds.dataset(path, format="parquet", partitioning=PARTITIONING, filesystem=pafs.LocalFileSystem(use_mmap=True))
+    condition = None
+    for part in (ds.field("run_id").isin(list(runs)) if runs else None,
+                 ds.field("day") >= first_day if first_day is not None else None,
+                 ds.field("day") <= last_day if last_day is not None else None):
+        if part is not None: condition = part if condition is None else condition & part
+    data = dataset.to_table(columns=list(columns) if columns else None, filter=condition)
+    return data.to_pandas() if as_pandas else data
@@ -0,0 +1,160 @@
+import json
+import threading
+
+from model_router import estimate_tokens
+
+MODES = ("legacy", "managed")
+
+_stats_lock = threading.Lock()
+_stats = {} # call type -> {"calls", "sent_tokens", "full_tokens"}
+
+
+def get_context_stats():
+    """Estimated input tokens per call type: sent by the managed context vs. the full day's history."""
+    with _stats_lock:
+        stats = {call: dict(counts) for call, counts in _stats.items()}
+    for counts in stats.values():
+        counts["saved_tokens"] = counts["full_tokens"] - counts["sent_tokens"]
+        counts["avg_sent_tokens"] = counts["sent_tokens"] / counts["calls"] if counts["calls"] else 0.0
+        counts["avg_full_tokens"] = counts["full_tokens"] / counts["calls"] if counts["calls"] else 0.0
+    return stats
+
+
+def reset_context_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def _chars(messages):
+    return sum(len(m["content"] or "") for m in messages)
+
+
+class Conversation:
+    """An agent's chat history for one day, bounded to a token budget.
+
+    Replaces the plain list the backend used to append to and resend in full. Every message belongs
+    to a decision (a loan, trade, estimate or forum call plus its "<type>_retry" re-asks):
+
+    - settle(decision) drops the failed replies and retry prompts once Secretary accepted an answer
+      (or the agent gave up), leaving the original prompt and the accepted answer as JSON;
+    - the day's first loan and first trade exchange carry the background text and reports and are
+      kept verbatim at the head, as a stable prefix;
+    - settled exchanges from earlier trading sessions are collapsed into a one-line-per-session recap
+      in front of the newest prompt;
+    - if the result is still over token_budget, the oldest kept exchanges are dropped, then the
+      prefix, never the current decision.
+
+    mode "legacy" (the default) keeps the old behaviour, everything resent, still counting tokens for
+    comparison; "full" is accepted as its earlier name.
+    A system message (PROMPT_LAYOUT "prefix") is sent first on every call and survives clear().
+    """
+
+    def __init__(self, mode="legacy", token_budget=6000, system=None):
+        if mode == "full": mode = "legacy"
+        self.mode = mode if mode in MODES else "legacy"
+        self.token_budget = token_budget or 0
+        self.system = system
+        self.clear()
+
+    def clear(self):
+        self.entries = [] # {"role", "content", "call", "decision", "session", "pinned"}
+        self.session = 0
+        self._decision = 0
+        self._call = None
+        self._settled = {} # decision -> (call, session, accepted decision dict)
+        self._seen_calls = set()
+        self._full_chars = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def start_session(self, session):
+        self.session = session
+
+    def ask(self, prompt, call_type):
+        """Adds a prompt and returns the messages to send for it."""
+        call = call_type[:-len("_retry")] if call_type.endswith("_retry") else call_type
+        if call == call_type or call != self._call: # A first ask starts a new decision
+            if self.mode != "legacy" and self.entries and self.entries[-1]["role"] == "user" and self._decision not in self._settled:
+                self.entries = [e for e in self.entries if e["decision"] != self._decision] # Abandoned: the call got no reply
+            self._decision += 1
+            self._call = call
+        pinned = call == call_type and call in ("loan", "trade") and call not in self._seen_calls
+        self._seen_calls.add(call)
+        self.entries.append({"role": "user", "content": prompt, "call": call, "decision": self._decision,
+                             "session": self.session, "pinned": pinned})
+        self._full_chars += len(prompt or "")
+        messages = self.messages()
+        with _stats_lock:
+            counts = _stats.setdefault(call_type, {"calls": 0, "sent_tokens": 0, "full_tokens": 0})
+            counts["calls"] += 1
+            counts["sent_tokens"] += estimate_tokens(_chars(messages))
+            counts["full_tokens"] += estimate_tokens(self._full_chars + len(self.system or ""))
+        return messages
+
+    def answer(self, content):
+        last = self.entries[-1] if self.entries else {}
+        self.entries.append(dict(last, role="assistant", content=content))
+        self._full_chars += len(content or "")
+
+    def record(self, prompt, call_type, decision):
+        """Adds a decision made outside this conversation (a batched request) as a settled exchange."""
+        self._decision += 1
+        self._call = None
+        self.entries.append({"role": "user", "content": prompt, "call": call_type, "decision": self._decision,
+                             "session": self.session, "pinned": False})
+        self.entries.append(dict(self.entries[-1], role="assistant", content=json.dumps(decision)))
+        self._settled[self._decision] = (call_type, self.session, decision)
+        self._full_chars += len(prompt) + len(self.entries[-1]["content"])
+
+    def settle(self, decision):
+        """Marks the current decision as done with the accepted (or fallback) answer."""
+        if self.mode == "legacy" or not self.entries or self.entries[-1]["decision"] != self._decision:
+            return
+        current = [e for e in self.entries if e["decision"] == self._decision]
+        first = current[0]
+        self._settled[self._decision] = (first["call"], first["session"], decision)
+        if len(current) == 2 and current[1]["role"] == "assistant":
+            return # Answered right away: keep the reply as it was
+        self.entries = [e for e in self.entries if e["decision"] != self._decision]
+        if first["role"] == "user":
+            self.entries.append(first)
+            self.entries.append(dict(first, role="assistant", content=json.dumps(decision)))
+
+    def _recap(self, decisions):
+        lines = []
+        for decision in decisions:
+            call, session, accepted = self._settled[decision]
+            lines.append(f"- {call}{f' in session {session}' if session else ''}: {json.dumps(accepted)}")
+        return "Your earlier decisions today (full prompts omitted):\n" + "\n".join(lines) + "\n\n"
+
+    def messages(self):
+        system = [{"role": "system", "content": self.system}] if self.system else []
+        if self.mode == "legacy":
+            return system + [{"role": e["role"], "content": e["content"]} for e in self.entries]
+        # Group into decisions, keeping their order
+        groups, order = {}, []
+        for e in self.entries:
+            if e["decision"] not in groups: groups[e["decision"]] = []; order.append(e["decision"])
+            groups[e["decision"]].append(e)
+        current = order[-1] if order else None
+        prefix = [d for d in order if groups[d][0]["pinned"] and d != current]
+        collapsed = [d for d in order if d not in prefix and d != current and d in self._settled
+                     and groups[d][0]["session"] < self.session]
+        kept = [d for d in order if d not in prefix and d not in collapsed and d != current]
+
+        def build(prefix, collapsed, kept):
+            messages = [{"role": e["role"], "content": e["content"]} for d in prefix + kept + [current] if d is not None for e in groups[d]]
+            if collapsed:
+                first_user = next(i for i, m in enumerate(messages) if i >= sum(len(groups[d]) for d in prefix) and m["role"] == "user")
+                messages[first_user] = dict(messages[first_user], content=self._recap(collapsed) + messages[first_user]["content"])
+            return messages
+
+        messages = build(prefix, collapsed, kept)
+        budget = self.token_budget - estimate_tokens(len(self.system or "")) if self.token_budget else 0
+        while budget and estimate_tokens(_chars(messages)) > budget and (collapsed or kept or prefix):
+            if collapsed: collapsed = collapsed[1:]
+            elif kept: kept = kept[1:]
+            else: prefix = prefix[1:]
+            messages = build(prefix, collapsed, kept)
+        return system + messages
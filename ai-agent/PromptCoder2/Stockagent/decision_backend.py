@@ -0,0 +1,308 @@
+import json
+import math
+import random
+import time
+
+import httpx
+import openai
+
+import llm_gateway
+import model_router
+from call_governor import CircuitOpenError
+from log.custom_logger import log
+
+NO_ESTIMATE = {"buy_A": "no", "buy_B": "no", "sell_A": "no", "sell_B": "no", "loan": "no"}
+
+
+class DecisionBackend:
+    """Produces the raw reply for one agent prompt.
+
+    Agent.run_api hands every call to its backend with a call_type ("loan", "trade", "estimate",
+    "forum", or "<type>_retry") and a small context dict of the values the prompt was built from.
+    The reply is validated by Secretary exactly like a model reply, so backends are interchangeable.
+    """
+    name = "base"
+    needs_prompt = True # False lets Agent skip rendering prompts the backend never reads
+    waits_on_io = True # False for in-process backends: threads only add overhead, so calls run one by one
+
+    def complete(self, agent, prompt, temperature=1, call_type="chat", context=None):
+        raise NotImplementedError
+
+    def complete_batch(self, agents, prompt, temperature=1, call_type="trade_batch", context=None):
+        """Reply to one prompt deciding for several agents (a JSON array keyed by agent_id). The default
+        returns "", which makes every agent of the batch decide on its own."""
+        return ""
+
+
+def profile_for(profiles, call_type):
+    """Generation profile of a call type; "<type>_retry" calls share the "retry" profile."""
+    if call_type in profiles: return profiles[call_type]
+    if call_type.endswith("_retry"): return profiles.get("retry", {})
+    return profiles.get("default", {})
+
+
+# Keys Secretary requires in each reply, so a streamed reply is only cut at an object that can be the answer
+REPLY_KEYS = {"loan": ("loan",), "trade": ("action_type",), "estimate": ("buy_A", "buy_B", "sell_A", "sell_B", "loan")}
+
+
+def reply_keys(call_type):
+    return REPLY_KEYS.get(call_type[:-len("_retry")] if call_type.endswith("_retry") else call_type, ())
+
+
+def is_reasoning_model(model):
+    # For reasoning models max_tokens may also bound the hidden chain of thought, so a small cap can leave no answer
+    return "reasoner" in (model or "") or (model or "").startswith(("o1", "o3", "o4"))
+
+
+class OpenAICompatibleBackend(DecisionBackend):
+    """Chat completions against DeepSeek or any OpenAI-compatible server, through the shared gateway.
+
+    Each call type has a generation profile (LLM_GENERATION_PROFILES): max_tokens, stop strings,
+    temperature (None keeps the caller's) and stream, which streams the reply and stops reading
+    once its JSON object is complete. The model comes from the router (LLM_ROUTES), which can move
+    a call type to a faster model when it runs over its latency budget. With track_usage nothing is
+    streamed, since only replies read to the end carry usage (and the pinned openai client cannot
+    ask for it in a stream).
+    """
+    name = "deepseek"
+
+    def __init__(self, base_url=llm_gateway.DEEPSEEK_BASE_URL, profiles=None, router=None, track_usage=False):
+        self.base_url = base_url or llm_gateway.DEEPSEEK_BASE_URL
+        self.profiles = profiles or {}
+        self.router = router or model_router.ModelRouter()
+        self.track_usage = track_usage
+
+    def request_for(self, model, call_type, temperature):
+        profile = profile_for(self.profiles, call_type)
+        request = {"model": model, "temperature": profile["temperature"] if profile.get("temperature") is not None else temperature}
+        if profile.get("max_tokens") and not is_reasoning_model(model): request["max_tokens"] = int(profile["max_tokens"])
+        if profile.get("stop"): request["stop"] = list(profile["stop"])
+        return request, bool(profile.get("stream")) and not self.track_usage
+
+    def complete(self, agent, prompt, temperature=1, call_type="chat", context=None):
+        if not agent.api_key and not llm_gateway.replaying(): # Use stored API key; replay needs none
+            log.logger.error("ERROR: DEEPSEEK_API_KEY not found in agent's config.")
+            return ""
+
+        try:
+            if not llm_gateway.replaying(): llm_gateway.get_client(agent.api_key, self.base_url) # Shared pooled client
+        except Exception as e:
+            log.logger.error(f"Error initializing OpenAI client for {self.base_url}: {e}")
+            return ""
+
+        messages = agent.chat_history.ask(prompt, call_type) # Bounded by the agent's context manager
+        route, model, fallback, deadline = self.router.plan(call_type, agent.model)
+        primary, deadline_fallback = self.router.primary(call_type, agent.model), False
+        request, stop_at_json = self.request_for(model, call_type, temperature)
+        prompt_chars = sum(len(m["content"] or "") for m in messages)
+        # Transient errors (429, 5xx, timeouts) are retried with backoff by the gateway's call governor;
+        # only an empty reply is asked again here
+        max_retry = 2
+        retry = 0
+
+        while retry < max_retry:
+            start = time.time()
+            try:
+                response = llm_gateway.chat_completion(
+                    agent.api_key, self.base_url, stop_at_json=stop_at_json, deadline=deadline, json_keys=reply_keys(call_type),
+                    messages=messages, **request, # Routed model with the call type's generation profile
+                )
+            except CircuitOpenError as e:
+                log.logger.warning(f"Agent {agent.order}: {e}. Using the no-action default.")
+                return ""
+            except (openai.APITimeoutError, httpx.TimeoutException) as e:
+                self.router.record(route, model, time.time() - start, fallback=model != primary, error=not deadline, expired=bool(deadline))
+                if not deadline:
+                    log.logger.error(f"DeepSeek API Error ({e.__class__.__name__}) after governor retries: {e}. SKIP THIS INTERACTION.")
+                    return ""
+                log.logger.warning(f"Agent {agent.order}: {model} ran over the {deadline:g}s budget of the {route} route, asking {fallback}")
+                model, deadline, deadline_fallback = fallback, None, True
+                request, stop_at_json = self.request_for(model, call_type, temperature)
+                continue
+            except openai.OpenAIError as e:
+                self.router.record(route, model, time.time() - start, fallback=model != primary, error=True)
+                log.logger.error(f"DeepSeek API Error ({e.__class__.__name__}) after governor retries: {e}. SKIP THIS INTERACTION.")
+                return ""
+            except Exception as e:
+                log.logger.error(f"Unexpected error during DeepSeek API call: {e}. SKIP THIS INTERACTION.")
+                return ""
+            msg = response.choices[0].message
+            self.router.record(route, model, time.time() - start, response.usage, prompt_chars, msg.content if msg else "",
+                               fallback=model != primary, deadline_fallback=deadline_fallback)
+            if msg and msg.content is not None:
+                agent.chat_history.answer(msg.content)
+                return msg.content
+            log.logger.warning(f"DeepSeek API returned an empty message or content for prompt: {prompt}, retry {retry+1}/{max_retry}")
+            retry += 1
+            time.sleep(llm_gateway.governor().backoff(retry))
+
+        log.logger.error(f"ERROR: DeepSeek API FAILED AFTER {max_retry} RETRIES. SKIP THIS INTERACTION.")
+        return ""
+
+    def complete_batch(self, agents, prompt, temperature=1, call_type="trade_batch", context=None):
+        # One stateless request for the group, on the trade route and profile; no per-agent chat history
+        lead = agents[0]
+        if not lead.api_key and not llm_gateway.replaying():
+            return ""
+        call = call_type[:-len("_batch")] if call_type.endswith("_batch") else call_type
+        route, model, _, _ = self.router.plan(call, lead.model)
+        request, _ = self.request_for(model, call, temperature)
+        if "max_tokens" in request: request["max_tokens"] *= len(agents) # One action per agent
+        messages = [{"role": "user", "content": prompt}]
+        start = time.time()
+        try:
+            # Not stopped at the first closing brace: the reply is an array of objects
+            response = llm_gateway.chat_completion(lead.api_key, self.base_url, messages=messages, **request)
+        except CircuitOpenError as e:
+            log.logger.warning(f"Batch of {len(agents)} agents: {e}. Agents will decide individually.")
+            return ""
+        except Exception as e:
+            self.router.record(route, model, time.time() - start, error=True)
+            log.logger.error(f"Batch of {len(agents)} agents: API error ({e.__class__.__name__}): {e}. Agents will decide individually.")
+            return ""
+        msg = response.choices[0].message
+        self.router.record(route, model, time.time() - start, response.usage, len(prompt), msg.content if msg else "")
+        return (msg.content if msg else None) or ""
+
+
+# character -> (chance to trade in a session, share of cash/holdings per order, price ticks of 1% it will move, chance to borrow)
+_PROFILES = {
+    "Conservative": (0.3, 0.05, 0, 0.1),
+    "Balanced": (0.5, 0.10, 1, 0.2),
+    "Growth-Oriented": (0.6, 0.15, 1, 0.3),
+    "Aggressive": (0.8, 0.25, 2, 0.5),
+}
+
+_CALL_IDS = {"loan": 1, "trade": 2, "estimate": 3, "forum": 4, "loan_retry": 5, "trade_retry": 6, "estimate_retry": 7}
+
+
+class RuleBasedBackend(DecisionBackend):
+    """In-process policy that answers from agent state and the order book, with no network call.
+
+    Meant for load tests and long/large runs (e.g. 180 days x 1,000 agents). Replies are JSON in the
+    same shape the prompts ask for and always pass Secretary's checks. Each reply draws from its own
+    RNG seeded by (RANDOM_SEED, agent, call, date, session), so results do not depend on the order in
+    which concurrent calls finish.
+    """
+    name = "rule_based"
+    needs_prompt = False
+    waits_on_io = False
+
+    def __init__(self, seed=None):
+        self.seed = seed
+        self._prices = {} # agent order -> (A price, B price) last seen in a trade call, for estimates
+
+    def _rng(self, agent, call_type, context):
+        key = (self.seed or 0, agent.order, _CALL_IDS.get(call_type, 0), context.get("date") or 0, context.get("session") or 0)
+        seed = 0
+        for part in key: seed = seed * 1000003 + int(part)
+        return random.Random(seed)
+
+    def complete(self, agent, prompt, temperature=1, call_type="chat", context=None):
+        context = context or {}
+        rng = self._rng(agent, call_type, context)
+        profile = _PROFILES.get(agent.character, _PROFILES["Balanced"])
+        if call_type == "loan": return json.dumps(self.decide_loan(agent, context, rng, profile))
+        if call_type == "trade": return json.dumps(self.decide_trade(agent, context, rng, profile))
+        if call_type == "estimate": return json.dumps(self.estimate(agent, rng, profile))
+        if call_type == "forum": return self.forum_message(agent, profile)
+        # The first answers always validate, so a retry only happens after a caller-side change; back off
+        if call_type == "loan_retry": return json.dumps({"loan": "no"})
+        if call_type == "trade_retry": return json.dumps({"action_type": "no"})
+        if call_type == "estimate_retry": return json.dumps(NO_ESTIMATE)
+        return ""
+
+    def decide_loan(self, agent, context, rng, profile):
+        max_loan = context.get("max_loan", 0)
+        num_loan_types = context.get("num_loan_types", len(agent.config['LOAN_TYPE']))
+        if max_loan <= 0 or num_loan_types <= 0 or rng.random() >= profile[3]:
+            return {"loan": "no"}
+        amount = math.floor(max_loan * rng.uniform(0.1, 0.5) * 100) / 100 # Rounded down so it never exceeds max_loan
+        if amount <= 0:
+            return {"loan": "no"}
+        return {"loan": "yes", "loan_type": rng.randrange(num_loan_types), "amount": amount}
+
+    def decide_trade(self, agent, context, rng, profile):
+        trade_chance, share, ticks, _ = profile
+        self._prices[agent.order] = (context.get("stock_a_price"), context.get("stock_b_price"))
+        if rng.random() >= trade_chance:
+            return {"action_type": "no"}
+        stock = rng.choice("AB")
+        price = context.get(f"stock_{stock.lower()}_price")
+        if not price or price <= 0:
+            return {"action_type": "no"}
+        book = context.get(f"stock_{stock.lower()}_deals") or {}
+        holding = agent.stock_a_amount if stock == "A" else agent.stock_b_amount
+        cash = agent.cash
+
+        # Lean towards buying when the position is small relative to cash, and vice versa
+        position_value = holding * price
+        buy_weight = cash / (cash + position_value) if cash + position_value > 0 else 0.0
+        side = "buy" if rng.random() < buy_weight else "sell"
+        if side == "sell" and holding <= 0: side = "buy"
+        if side == "buy" and cash < price: side = "sell" if holding > 0 else None
+        if side is None:
+            return {"action_type": "no"}
+
+        # Take the best resting counter-order if it is within this character's price tolerance (one pass, no copies)
+        limit = price * (1 + 0.01 * ticks) if side == "buy" else price * (1 - 0.01 * ticks)
+        resting, me = book.get("sell" if side == "buy" else "buy") or (), agent.order
+        if side == "buy":
+            best = min((o["price"] for o in resting if o["price"] <= limit and o.get("agent") != me), default=None)
+            quote = best if best is not None else round(price * (1 - 0.01 * rng.randint(0, ticks)), 2)
+        else:
+            best = max((o["price"] for o in resting if o["price"] >= limit and o.get("agent") != me), default=None)
+            quote = best if best is not None else round(price * (1 + 0.01 * rng.randint(0, ticks)), 2)
+        if quote <= 0:
+            return {"action_type": "no"}
+
+        if side == "buy":
+            amount = int(cash * share // quote) or (1 if quote <= cash else 0)
+            while amount > 0 and amount * quote > cash: amount -= 1 # Guard against float rounding at the edge
+        else:
+            amount = min(holding, max(1, int(holding * share)))
+        if amount <= 0:
+            return {"action_type": "no"}
+        return {"action_type": side, "stock": stock, "amount": amount, "price": quote}
+
+    def estimate(self, agent, rng, profile):
+        prices = self._prices.get(agent.order) or (agent.config['STOCK_A_INITIAL_PRICE'], agent.config['STOCK_B_INITIAL_PRICE'])
+        values = (agent.stock_a_amount * prices[0], agent.stock_b_amount * prices[1])
+        total = agent.cash + sum(values)
+        cash_share = agent.cash / total if total > 0 else 0.0
+        estimate = dict(NO_ESTIMATE)
+        for stock, value in zip("AB", values):
+            if cash_share > 0.3 and rng.random() < profile[0]: estimate[f"buy_{stock}"] = "yes"
+            elif value > 0 and rng.random() < profile[0] / 2: estimate[f"sell_{stock}"] = "yes"
+        if cash_share < 0.1 and rng.random() < profile[3]: estimate["loan"] = "yes"
+        return estimate
+
+    def complete_batch(self, agents, prompt, temperature=1, call_type="trade_batch", context=None):
+        # Same per-agent RNG streams as individual trade calls, so batching does not change decisions
+        context = context or {}
+        return json.dumps([
+            dict(agent_id=agent.order, **self.decide_trade(agent, context, self._rng(agent, "trade", context),
+                                                          _PROFILES.get(agent.character, _PROFILES["Balanced"])))
+            for agent in agents
+        ])
+
+    def forum_message(self, agent, profile):
+        view = "adding to my positions" if profile[0] >= 0.5 else "holding steady"
+        return (f"As a {agent.character.lower()} investor I hold {agent.stock_a_amount} shares of A and "
+                f"{agent.stock_b_amount} shares of B with {agent.cash:.2f} in cash, and I am {view}.")
+
+
+BACKENDS = {"deepseek": OpenAICompatibleBackend, "rule_based": RuleBasedBackend}
+
+
+def make_backend(config):
+    """Backend named by config['DECISION_BACKEND'] ("deepseek" by default)."""
+    name = config.get('DECISION_BACKEND', "deepseek")
+    if name == "rule_based":
+        return RuleBasedBackend(seed=config.get('RANDOM_SEED'))
+    if name not in BACKENDS:
+        log.logger.warning(f"Unknown DECISION_BACKEND {name!r}, using deepseek")
+    # The prefix layout exists to raise cache hits, so measure them
+    track_usage = bool(config.get('LLM_TRACK_USAGE', False)) or config.get('PROMPT_LAYOUT', "legacy") == "prefix"
+    return OpenAICompatibleBackend(config.get('LLM_BASE_URL', llm_gateway.DEEPSEEK_BASE_URL), config.get('LLM_GENERATION_PROFILES'),
+                                   model_router.make_router(config), track_usage)
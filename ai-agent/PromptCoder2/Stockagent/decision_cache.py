@@ -0,0 +1,178 @@
+import math
+import threading
+from collections import OrderedDict
+
+from log.custom_logger import log
+
+DEFAULTS = {"enabled": False, "ttl_sessions": 3, "max_entries": 10000,
+            "wealth_step": 0.25, "ratio_step": 0.1, "price_step": 0.02, "book_step": 0.02}
+
+
+def _bucket(value, step):
+    return math.floor(value / step) if step > 0 else value
+
+
+def _log_bucket(value, step):
+    # Relative buckets: prices step (1 + step) apart share a bucket
+    return math.floor(math.log(value) / math.log1p(step)) if value > 0 and step > 0 else 0
+
+
+class DecisionCache:
+    """Approximate cache of trade and loan decisions, keyed by a quantized agent/market state.
+
+    Agents with the same character, a similar wealth (log10 buckets of wealth_step), similar holdings
+    ratios (ratio_step), the same price levels (relative buckets of price_step) and the same top of book
+    (best bid/ask relative to the price, book_step) share one decision. Decisions are stored normalized
+    (shares of cash or holdings, prices relative to the market) and rescaled to each agent before
+    Secretary validates them; a rescaled decision that fails validation is treated as a miss.
+
+    Entries expire after ttl_sessions trading sessions of simulated time and the least recently used
+    entry is evicted beyond max_entries. With concurrent decisions (snapshot/call auction) which agent
+    fills an entry depends on completion order, so runs are not bit-for-bit reproducible.
+    """
+
+    def __init__(self, sessions_per_day, ttl_sessions=3, max_entries=10000, wealth_step=0.25, ratio_step=0.1,
+                 price_step=0.02, book_step=0.02, enabled=True):
+        self.sessions_per_day = max(int(sessions_per_day), 1)
+        self.ttl_sessions = ttl_sessions
+        self.max_entries = max(int(max_entries), 1)
+        self.wealth_step, self.ratio_step, self.price_step, self.book_step = wealth_step, ratio_step, price_step, book_step
+        self.enabled = enabled
+        self._entries = OrderedDict() # key -> (tick, normalized decision)
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0, "rejected": 0, "stored": 0}
+
+    def _tick(self, date, session):
+        return (date - 1) * self.sessions_per_day + session
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    # --- Keys ---
+    def _wealth(self, agent, price_a, price_b):
+        value_a, value_b = agent.stock_a_amount * price_a, agent.stock_b_amount * price_b
+        total = agent.cash + value_a + value_b
+        ratios = (value_a / total, value_b / total) if total > 0 else (0.0, 0.0)
+        return total, ratios
+
+    def _top_of_book(self, deals, price):
+        bids = [o["price"] for o in (deals or {}).get("buy", [])]
+        asks = [o["price"] for o in (deals or {}).get("sell", [])]
+        rel = lambda p: _bucket(p / price - 1, self.book_step) if p is not None and price > 0 else None
+        return rel(max(bids) if bids else None), rel(min(asks) if asks else None)
+
+    def trade_key(self, agent, date, session, price_a, price_b, deals_a, deals_b):
+        total, (ratio_a, ratio_b) = self._wealth(agent, price_a, price_b)
+        reports = date in agent.config['SEASON_REPORT_DAYS'] and session == 1 # Prompt carries a new report
+        return ("trade", agent.character, _log_bucket(total, 10 ** self.wealth_step - 1),
+                _bucket(ratio_a, self.ratio_step), _bucket(ratio_b, self.ratio_step),
+                _log_bucket(price_a, self.price_step), _log_bucket(price_b, self.price_step),
+                self._top_of_book(deals_a, price_a), self._top_of_book(deals_b, price_b), session == 1, reports)
+
+    def loan_key(self, agent, date, price_a, price_b, max_loan):
+        total, (ratio_a, ratio_b) = self._wealth(agent, price_a, price_b)
+        debt = agent.get_total_loan() / total if total > 0 else 0.0
+        return ("loan", agent.character, _log_bucket(total, 10 ** self.wealth_step - 1),
+                _bucket(ratio_a, self.ratio_step), _bucket(ratio_b, self.ratio_step), _bucket(debt, self.ratio_step),
+                _bucket(max_loan / total if total > 0 else 0.0, self.ratio_step),
+                _log_bucket(price_a, self.price_step), _log_bucket(price_b, self.price_step),
+                tuple(agent.current_loan_rates), date == 1)
+
+    # --- Lookup and store ---
+    def get(self, key, date, session):
+        """Normalized decision for key, or None (miss or expired)."""
+        if not self.enabled: return None
+        now = self._tick(date, session)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            if now - entry[0] > self.ttl_sessions:
+                del self._entries[key]
+                self.stats["expired"] += 1; self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[1]
+
+    def put(self, key, date, session, normalized):
+        if not self.enabled or normalized is None: return
+        with self._lock:
+            self._entries[key] = (self._tick(date, session), normalized)
+            self._entries.move_to_end(key)
+            self.stats["stored"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evicted"] += 1
+
+    def reject(self):
+        """A hit whose rescaled decision failed validation; the caller asks the model instead."""
+        with self._lock:
+            self.stats["hits"] -= 1; self.stats["misses"] += 1; self.stats["rejected"] += 1
+
+    # --- Normalizing and rescaling ---
+    @staticmethod
+    def normalize_action(action, agent, price_a, price_b):
+        if action.get("action_type") not in ("buy", "sell"): return {"action_type": "no"}
+        price = price_a if action["stock"] == "A" else price_b
+        if price <= 0: return None
+        if action["action_type"] == "buy":
+            share = action["amount"] * action["price"] / agent.cash if agent.cash > 0 else 0.0
+        else:
+            holding = agent.stock_a_amount if action["stock"] == "A" else agent.stock_b_amount
+            share = action["amount"] / holding if holding > 0 else 0.0
+        return {"action_type": action["action_type"], "stock": action["stock"], "share": share, "price_ratio": action["price"] / price}
+
+    @staticmethod
+    def rescale_action(normalized, agent, price_a, price_b):
+        if normalized["action_type"] == "no": return {"action_type": "no"}
+        stock = normalized["stock"]
+        price = round((price_a if stock == "A" else price_b) * normalized["price_ratio"], 2)
+        if price <= 0: return {"action_type": "no"}
+        if normalized["action_type"] == "buy":
+            amount = int(agent.cash * normalized["share"] // price)
+        else:
+            holding = agent.stock_a_amount if stock == "A" else agent.stock_b_amount
+            amount = min(holding, max(1, int(holding * normalized["share"]))) if holding > 0 else 0
+        if amount <= 0: return {"action_type": "no"}
+        return {"action_type": normalized["action_type"], "stock": stock, "amount": amount, "price": price}
+
+    @staticmethod
+    def normalize_loan(loan, max_loan):
+        if loan.get("loan") != "yes": return {"loan": "no"}
+        if max_loan <= 0: return None
+        return {"loan": "yes", "loan_type": loan["loan_type"], "share": loan["amount"] / max_loan}
+
+    @staticmethod
+    def rescale_loan(normalized, max_loan):
+        if normalized["loan"] != "yes": return {"loan": "no"}
+        amount = math.floor(max_loan * normalized["share"] * 100) / 100 # Rounded down so it stays within max_loan
+        if amount <= 0: return {"loan": "no"}
+        return {"loan": "yes", "loan_type": normalized["loan_type"], "amount": amount}
+
+    def report(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+_cache = DecisionCache(1, enabled=False)
+
+
+def get_cache_stats():
+    return _cache.report()
+
+
+def make_decision_cache(config):
+    """The run's decision cache from config['DECISION_CACHE'] (disabled unless "enabled" is set)."""
+    global _cache
+    settings = dict(DEFAULTS, **(config.get('DECISION_CACHE') or {}))
+    unknown = set(settings) - set(DEFAULTS)
+    if unknown: log.logger.warning(f"DECISION_CACHE: unknown settings {sorted(unknown)} are ignored")
+    _cache = DecisionCache(config['TOTAL_SESSION'], **{k: settings[k] for k in DEFAULTS})
+    return _cache
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import threading
+
+POLICIES = ("off", "reissue", "skip")
+
+_stats_lock = threading.Lock()
+_stats = {} # "day-session" -> {"lookups", "hits", "reissued", "skipped"}
+
+
+def get_memo_stats():
+    """plan_stock memo hits per trading session ("day-session"), plus totals."""
+    with _stats_lock:
+        stats = {session: dict(counts) for session, counts in _stats.items()}
+    totals = {"lookups": 0, "hits": 0, "reissued": 0, "skipped": 0}
+    for counts in stats.values():
+        for key in totals: totals[key] += counts[key]
+    totals["hit_rate"] = totals["hits"] / totals["lookups"] if totals["lookups"] else 0.0
+    return {"sessions": stats, "total": totals}
+
+
+def reset_memo_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def _count(date, session, **amounts):
+    with _stats_lock:
+        counts = _stats.setdefault(f"{date}-{session}", {"lookups": 0, "hits": 0, "reissued": 0, "skipped": 0})
+        for key, amount in amounts.items(): counts[key] += amount
+
+
+def book_summary(deals):
+    """(order count, best price, total amount) per side of an order book ({"buy": [...], "sell": [...]})."""
+    summary = []
+    for side, best in (("buy", max), ("sell", min)):
+        orders = (deals or {}).get(side) or ()
+        summary.append((len(orders), best((o["price"] for o in orders), default=None), sum(o["amount"] for o in orders)))
+    return summary
+
+
+def fingerprint(stock_a, stock_b, cash, stock_a_price, stock_b_price, stock_a_deals, stock_b_deals):
+    """Digest of the DECIDE_BUY_STOCK_PROMPT inputs that can change between sessions of a day.
+
+    The books enter as a summary (book_summary), not order by order: hashing both full books for
+    every agent every session cost more than the rest of a rule-based session.
+    """
+    state = [stock_a, stock_b, round(cash, 6), stock_a_price, stock_b_price, book_summary(stock_a_deals), book_summary(stock_b_deals)]
+    return hashlib.sha1(json.dumps(state, default=str).encode()).hexdigest()
+
+
+class DecisionMemo:
+    """An agent's last trade decision of the day, with the fingerprint of the inputs it was made on.
+
+    If the agent's holdings and cash, both prices and both books (order count, best price and total
+    amount per side) are the same as at its previous
+    session that day, lookup() answers without asking the model: "reissue" returns the previous
+    decision again, "skip" returns no action. "off" never matches. A new day always misses (the
+    day's first session carries the reports and is never short-circuited).
+    """
+
+    def __init__(self, policy="off"):
+        self.policy = policy if policy in POLICIES else "off"
+        self.date, self.digest, self.action = None, None, None
+        self._looked_up = None # (date, session) already counted, so a batch retry is not counted twice
+
+    def lookup(self, date, session, digest):
+        """The decision for an unchanged state, or None if the model has to be asked."""
+        if self.policy == "off": return None
+        first = self._looked_up != (date, session)
+        self._looked_up = (date, session)
+        if not (self.date == date and self.digest == digest and self.action is not None):
+            if first: _count(date, session, lookups=1)
+            return None
+        if self.policy == "skip" or self.action.get("action_type") not in ("buy", "sell"):
+            _count(date, session, lookups=1, hits=1, skipped=1)
+            return {"action_type": "no"}
+        _count(date, session, lookups=1, hits=1, reissued=1)
+        return dict(self.action)
+
+    def remember(self, date, digest, action):
+        if self.policy == "off": return
+        self.date, self.digest, self.action = date, digest, dict(action)
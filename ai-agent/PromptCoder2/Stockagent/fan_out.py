@@ -0,0 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
+
+
+def run_ordered(fn, items, max_workers=1):
+    """Calls fn(item) for every item with at most max_workers in flight; results keep the order of items.
+
+    Used for the per-agent LLM phases whose calls do not depend on each other. Callers apply the
+    results afterwards in the same order as the sequential loop did.
+    """
+    items = list(items)
+    if max_workers is None or max_workers <= 1 or len(items) <= 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items)), thread_name_prefix="llm-fan-out") as executor:
+        return list(executor.map(fn, items))
@@ -0,0 +1,140 @@
+import json
+import re
+
+_FENCE = re.compile(r"```(?:json)?\s*(.*?)```", re.S)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_UNQUOTED_KEY = re.compile(r'([{,]\s*)([A-Za-z_][A-Za-z0-9_]*)(\s*:)')
+_PY_LITERALS = (("True", "true"), ("False", "false"), ("None", "null"))
+
+
+def balanced_objects(text):
+    """Top-level {...} spans in text, skipping braces inside string literals. Unclosed objects are ignored."""
+    spans, depth, start, quote, escaped = [], 0, None, None, False
+    for i, ch in enumerate(text):
+        if quote:
+            if escaped: escaped = False
+            elif ch == "\\": escaped = True
+            elif ch == quote: quote = None
+            continue
+        if ch in "\"'" and depth > 0:
+            quote = ch
+        elif ch == "{":
+            if depth == 0: start = i
+            depth += 1
+        elif ch == "}" and depth > 0:
+            depth -= 1
+            if depth == 0: spans.append((start, i + 1))
+    return spans
+
+
+class JsonObjectWatcher:
+    """Incremental version of balanced_objects for streamed text: feed() returns True once a top-level
+    object has closed that holds every one of keys (any object when keys is empty).
+
+    Objects missing a key, such as a draft or an example the model writes before its answer, or a
+    brace in a reasoning model's prose, are skipped and watching goes on.
+    """
+
+    def __init__(self, keys=()):
+        self.keys = tuple(keys)
+        self.depth, self.quote, self.escaped, self.closed = 0, None, False, False
+        self._object = [] # Characters of the object being read
+
+    def _answers(self, text):
+        if not self.keys: return True
+        parsed, _ = repair_json_object(text)
+        return isinstance(parsed, dict) and all(key in parsed for key in self.keys)
+
+    def feed(self, text):
+        for ch in text:
+            if self.closed: break
+            if self.depth > 0 or ch == "{": self._object.append(ch)
+            if self.quote:
+                if self.escaped: self.escaped = False
+                elif ch == "\\": self.escaped = True
+                elif ch == self.quote: self.quote = None
+            elif ch in "\"'" and self.depth > 0: self.quote = ch
+            elif ch == "{": self.depth += 1
+            elif ch == "}" and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.closed = self._answers("".join(self._object))
+                    self._object = []
+        return self.closed
+
+
+def repair_json_object(text):
+    """Deterministically recovers one JSON object from a model reply.
+
+    Takes the last balanced object (models often think aloud or repeat a draft before the final
+    answer), then fixes common slips in order: trailing commas, single quotes, unquoted keys and
+    Python literals. Returns (dict, [rule, ...]) naming every rule that changed something, or
+    (None, rules) if no object could be recovered.
+    """
+    rules = []
+    if not isinstance(text, str):
+        return None, rules
+    fenced = _FENCE.findall(text)
+    if fenced:
+        text = fenced[-1]
+        rules.append("code_fence")
+    spans = balanced_objects(text)
+    if not spans:
+        return None, rules
+    if len(spans) > 1 or text.count("{") != 1 or text.count("}") != 1:
+        rules.append("last_object")
+    candidate = text[spans[-1][0]:spans[-1][1]].replace("\n", " ")
+
+    fixes = (
+        ("trailing_comma", lambda s: _TRAILING_COMMA.sub(r"\1", s)),
+        ("single_quotes", lambda s: s.replace("'", '"') if '"' not in s else s),
+        ("unquoted_keys", lambda s: _UNQUOTED_KEY.sub(r'\1"\2"\3', s)),
+        ("python_literals", _replace_python_literals),
+    )
+    for name, fix in fixes:
+        try:
+            parsed = json.loads(candidate)
+            return (parsed, rules) if isinstance(parsed, dict) else (None, rules)
+        except json.JSONDecodeError:
+            pass
+        fixed = fix(candidate)
+        if fixed != candidate:
+            candidate = fixed
+            rules.append(name)
+    try:
+        parsed = json.loads(candidate)
+    except json.JSONDecodeError:
+        return None, rules
+    return (parsed, rules) if isinstance(parsed, dict) else (None, rules)
+
+
+def _replace_python_literals(text):
+    for python_value, json_value in _PY_LITERALS:
+        text = re.sub(rf"(?<![\"\w]){python_value}(?![\"\w])", json_value, text)
+    return text
+
+
+def as_number(value):
+    """Number from an int/float or a numeric string like "1,000" or "$30.5"; None otherwise. bool is not a number."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        cleaned = value.strip().replace(",", "").lstrip("$").strip()
+        try:
+            number = float(cleaned)
+        except ValueError:
+            return None
+        return int(number) if number.is_integer() and re.fullmatch(r"-?\d+", cleaned) else number
+    return None
+
+
+def as_yes_no(value):
+    """ "yes"/"no" from booleans and common spellings; None if it is neither."""
+    if isinstance(value, bool):
+        return "yes" if value else "no"
+    text = str(value).strip().lower()
+    if text in ("yes", "y", "true", "1"): return "yes"
+    if text in ("no", "n", "false", "0", "none"): return "no"
+    return None
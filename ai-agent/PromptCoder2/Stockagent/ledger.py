@@ -0,0 +1,87 @@
+import numpy as np
+
+
+class AgentLedger:
+    """Struct-of-arrays storage for every agent's balance sheet.
+
+    One row per agent: cash, holdings per instrument, and quit/bankrupt flags. Agent
+    objects only keep their row index and read/write through properties, so whole-population
+    passes (valuation, interest charges, bankruptcy screening) run as NumPy operations
+    instead of Python loops over Agent objects.
+    """
+
+    def __init__(self, instruments=("A", "B"), capacity=16):
+        self.instruments = tuple(instruments)
+        self._col = {name: i for i, name in enumerate(self.instruments)}
+        self.size = 0
+        capacity = max(int(capacity), 1)
+        self.cash = np.zeros(capacity, dtype=np.float64)
+        self.holdings = np.zeros((capacity, len(self.instruments)), dtype=np.int64)
+        self.init_proper = np.zeros(capacity, dtype=np.float64)
+        self.quit = np.zeros(capacity, dtype=bool)
+        self.is_bankrupt = np.zeros(capacity, dtype=bool)
+        self.owners = [] # row -> Agent
+
+    def __len__(self):
+        return self.size
+
+    def _grow(self, min_capacity):
+        capacity = len(self.cash)
+        while capacity < min_capacity:
+            capacity *= 2
+        for name in ("cash", "init_proper", "quit", "is_bankrupt"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+        holdings = np.zeros((capacity, len(self.instruments)), dtype=np.int64)
+        holdings[:self.size] = self.holdings[:self.size]
+        self.holdings = holdings
+
+    def add_row(self, owner=None, cash=0.0, holdings=None):
+        if self.size >= len(self.cash):
+            self._grow(self.size + 1)
+        row = self.size
+        self.cash[row] = cash
+        if holdings is not None:
+            for name, amount in holdings.items():
+                self.holdings[row, self._col[name]] = amount
+        self.size += 1
+        self.owners.append(owner)
+        return row
+
+    def column(self, instrument):
+        return self._col[instrument]
+
+    # --- Vectorized passes (all operate on the live prefix [:size]) ---
+    def price_vector(self, prices):
+        """prices: {"A": price, "B": price} -> array aligned with holdings columns."""
+        return np.array([prices[name] for name in self.instruments], dtype=np.float64)
+
+    def portfolio_values(self, prices):
+        """Returns (total_property, cash, value_per_instrument) for every row."""
+        n = self.size
+        values = self.holdings[:n] * self.price_vector(prices)
+        return values.sum(axis=1) + self.cash[:n], self.cash[:n], values
+
+    def active_rows(self):
+        return np.flatnonzero(~self.quit[:self.size])
+
+    def charge(self, amounts, rows=None):
+        """Subtract cash (e.g. interest) from rows in one pass; flags rows that go negative."""
+        if rows is None:
+            rows = np.arange(self.size)
+        rows = np.asarray(rows, dtype=np.int64)
+        amounts = np.asarray(amounts, dtype=np.float64)
+        live = ~self.quit[rows]
+        rows = rows[live]
+        if amounts.ndim:
+            amounts = amounts[live]
+        self.cash[rows] -= amounts
+        self.is_bankrupt[rows] |= self.cash[rows] < 0
+        return rows
+
+    def bankruptcy_candidates(self):
+        """Rows that need Agent.bankrupt_process: active and flagged or cash-negative."""
+        n = self.size
+        return np.flatnonzero(~self.quit[:n] & (self.is_bankrupt[:n] | (self.cash[:n] < 0)))
@@ -0,0 +1,245 @@
+import json
+import threading
+import time
+
+import httpx
+import openai
+from openai.types.chat import ChatCompletion, ChatCompletionMessage
+from openai.types.chat.chat_completion import Choice
+
+from call_governor import CallGovernor
+from cassette import Cassette, CassetteMiss
+from json_repair import JsonObjectWatcher
+from log.custom_logger import log
+
+DEEPSEEK_BASE_URL = "https://api.deepseek.com/v1"
+
+# Process-wide pool settings; simulation() calls configure() from its config before any call is made
+_settings = {
+    "pool_size": 20,        # max pooled connections per (base_url, api_key)
+    "timeout": 120.0,       # read/write/pool timeout in seconds
+    "connect_timeout": 10.0,
+    "max_retries": 0,       # openai client's own retries; off, the call governor retries instead
+}
+_clients = {}               # (base_url, api_key) -> openai.OpenAI
+_lock = threading.Lock()
+_stats = {"clients_created": 0, "requests": 0, "errors": 0, "connections_opened": 0, "total_latency": 0.0, "replayed": 0,
+          "streamed": 0, "stopped_at_json": 0, "completion_tokens": 0, "prompt_tokens": 0, "cache_hit_tokens": 0, "usage_reported": 0}
+_cassette = None            # Optional record/replay store, see use_cassette()
+_governor = CallGovernor()  # Rate limit, AIMD concurrency, backoff and circuit breaker for every live call
+
+
+def configure(pool_size=None, timeout=None, connect_timeout=None, max_retries=None):
+    """Updates pool settings. Clients built with different settings are closed and rebuilt on next use."""
+    new_settings = dict(_settings)
+    for key, value in (("pool_size", pool_size), ("timeout", timeout), ("connect_timeout", connect_timeout), ("max_retries", max_retries)):
+        if value is not None:
+            new_settings[key] = value
+    if new_settings != _settings:
+        close_all()
+        _settings.update(new_settings)
+
+
+def configure_from(config):
+    configure(pool_size=config.get('LLM_POOL_SIZE'), timeout=config.get('LLM_TIMEOUT'),
+              connect_timeout=config.get('LLM_CONNECT_TIMEOUT'))
+    use_governor(CallGovernor(
+        max_concurrency=config.get('LLM_MAX_CONCURRENCY', 1), rate_limit_rps=config.get('LLM_RATE_LIMIT_RPS', 0),
+        max_retries=config.get('LLM_MAX_RETRIES', 2), backoff_base=config.get('LLM_BACKOFF_BASE', 0.5),
+        backoff_max=config.get('LLM_BACKOFF_MAX', 30.0), breaker_error_rate=config.get('LLM_BREAKER_ERROR_RATE', 0.5),
+        breaker_cooldown=config.get('LLM_BREAKER_COOLDOWN', 30.0),
+    ))
+    use_cassette(config.get('LLM_CASSETTE_PATH', "res/llm_cassette.sqlite"), config.get('LLM_CASSETTE_MODE', "off"))
+
+
+def use_cassette(path, mode="off"):
+    """Installs (or with mode "off" removes) the process-wide record/replay cassette."""
+    global _cassette
+    if _cassette is not None:
+        _cassette.close()
+        _cassette = None
+    if mode and mode != "off":
+        _cassette = Cassette(path, mode)
+        log.logger.info(f"LLM gateway: cassette {path} in {mode} mode")
+
+
+def use_governor(governor):
+    """Replaces the process-wide call governor (a fresh one per simulation run)."""
+    global _governor
+    _governor = governor
+
+
+def governor():
+    return _governor
+
+
+def replaying():
+    """True when responses come from the cassette only, so no API key or client is needed."""
+    return _cassette is not None and _cassette.mode == "replay"
+
+
+def _trace(event_name, info):
+    # httpcore trace hook: a completed TCP connect means the pool had no idle connection to reuse
+    if event_name == "connection.connect_tcp.complete":
+        with _lock:
+            _stats["connections_opened"] += 1
+
+
+def _attach_trace(request):
+    request.extensions["trace"] = _trace
+
+
+def get_client(api_key, base_url=DEEPSEEK_BASE_URL):
+    """Shared keep-alive client for (base_url, api_key), created on first use."""
+    key = (base_url, api_key)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            http_client = httpx.Client(
+                limits=httpx.Limits(max_connections=_settings["pool_size"], max_keepalive_connections=_settings["pool_size"]),
+                timeout=httpx.Timeout(_settings["timeout"], connect=_settings["connect_timeout"]),
+                event_hooks={"request": [_attach_trace]},
+            )
+            client = openai.OpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=_settings["max_retries"])
+            _clients[key] = client
+            _stats["clients_created"] += 1
+            log.logger.info(f"LLM gateway: created pooled client for {base_url} (pool size {_settings['pool_size']})")
+    return client
+
+
+def cache_hit_tokens(usage):
+    """Prompt tokens served from the provider's prefix cache: DeepSeek's prompt_cache_hit_tokens or
+    OpenAI's prompt_tokens_details.cached_tokens; 0 when the usage carries neither."""
+    if usage is None:
+        return 0
+    hit = getattr(usage, "prompt_cache_hit_tokens", None)
+    if hit is None:
+        details = getattr(usage, "prompt_tokens_details", None)
+        hit = details.get("cached_tokens") if isinstance(details, dict) else getattr(details, "cached_tokens", None)
+    return int(hit or 0)
+
+
+def _stream_until_json(client, kwargs, deadline=None, json_keys=()):
+    """Streams a completion and closes the stream as soon as the reply holds a complete JSON object
+    with every one of json_keys (any object when empty; see JsonObjectWatcher).
+
+    Closing the HTTP response makes the provider stop generating, so nothing after the object is paid
+    for or waited on. Returns a regular ChatCompletion assembled from the chunks. With a deadline
+    (seconds) the stream is abandoned with httpx.ReadTimeout once the whole reply takes longer.
+    """
+    started = time.monotonic()
+    stream = client.chat.completions.create(stream=True, **kwargs)
+    watcher, parts = JsonObjectWatcher(json_keys), []
+    completion_id, model, role, finish_reason, usage = None, kwargs.get("model"), "assistant", None, None
+    try:
+        for chunk in stream:
+            if deadline and time.monotonic() - started > deadline:
+                raise httpx.ReadTimeout(f"Reply took longer than its {deadline:g}s latency budget")
+            completion_id = completion_id or chunk.id
+            model = chunk.model or model
+            usage = getattr(chunk, "usage", None) or usage # Sent last by providers that honour include_usage
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            if choice.delta.role: role = choice.delta.role
+            if choice.finish_reason: finish_reason = choice.finish_reason
+            if choice.delta.content:
+                parts.append(choice.delta.content)
+                if watcher.feed(choice.delta.content):
+                    finish_reason = "stop"
+                    with _lock:
+                        _stats["stopped_at_json"] += 1
+                    break
+    finally:
+        stream.close()
+    with _lock:
+        _stats["streamed"] += 1
+    content = "".join(parts)
+    if watcher.closed: # Drop whatever arrived in the same chunk after the closing brace
+        end = len(content)
+        while end > 0 and content[end - 1] != "}": end -= 1
+        content = content[:end]
+    return ChatCompletion(
+        id=completion_id or "stream", created=int(time.time()), model=model or "", object="chat.completion",
+        choices=[Choice(index=0, finish_reason=finish_reason or "stop", message=ChatCompletionMessage(role=role, content=content))],
+        usage=usage.model_dump() if hasattr(usage, "model_dump") else usage,
+    )
+
+
+def chat_completion(api_key, base_url=DEEPSEEK_BASE_URL, stop_at_json=False, deadline=None, json_keys=(), **kwargs):
+    """client.chat.completions.create through the shared pool, with request/latency accounting.
+
+    With a cassette installed, recorded responses are served without touching the network and
+    live responses are recorded, keyed by (model, temperature, messages). With stop_at_json the
+    response is streamed and cut off once its JSON object (holding json_keys) is complete (see _stream_until_json).
+    With a deadline (seconds) the call times out after it and is not retried, so the caller can
+    ask a faster model instead (see model_router).
+    """
+    cassette = _cassette
+    request = (kwargs.get("model"), kwargs.get("temperature"), kwargs.get("messages"))
+    if cassette is not None and cassette.replays:
+        recorded = cassette.lookup(*request)
+        if recorded is not None:
+            with _lock:
+                _stats["replayed"] += 1
+            return ChatCompletion(**json.loads(recorded))
+        if cassette.mode == "replay":
+            raise CassetteMiss(f"No recorded response for model {request[0]} with {len(request[2] or [])} messages")
+
+    client = get_client(api_key, base_url)
+    if deadline: kwargs["timeout"] = deadline
+    start = time.time()
+    try:
+        if stop_at_json:
+            response = _governor.call(kwargs.get("model"), lambda: _stream_until_json(client, kwargs, deadline, json_keys), deadline=deadline)
+        else:
+            response = _governor.call(kwargs.get("model"), lambda: client.chat.completions.create(**kwargs), deadline=deadline)
+        if response.usage is not None: # Streamed replies cut at the JSON object carry none
+            with _lock:
+                _stats["usage_reported"] += 1
+                _stats["completion_tokens"] += response.usage.completion_tokens or 0
+                _stats["prompt_tokens"] += response.usage.prompt_tokens or 0
+                _stats["cache_hit_tokens"] += cache_hit_tokens(response.usage)
+        if cassette is not None and cassette.records:
+            cassette.store(*request, response.model_dump_json())
+        return response
+    except Exception:
+        with _lock:
+            _stats["errors"] += 1
+        raise
+    finally:
+        with _lock:
+            _stats["requests"] += 1
+            _stats["total_latency"] += time.time() - start
+
+
+def get_stats():
+    with _lock:
+        stats = dict(_stats)
+        stats["pooled_clients"] = len(_clients)
+    requests = stats["requests"]
+    stats["avg_latency"] = stats["total_latency"] / requests if requests else 0.0
+    # Share of requests served on an already-open connection
+    stats["connection_reuse_ratio"] = max(0.0, 1 - stats["connections_opened"] / requests) if requests else 0.0
+    # Share of reported prompt tokens the provider served from its prefix cache
+    # Unmeasured, not 0, when no reply carried usage (streamed replies stopped at the JSON object)
+    stats["cache_hit_ratio"] = stats["cache_hit_tokens"] / stats["prompt_tokens"] if stats["prompt_tokens"] else "unmeasured"
+    if not stats["usage_reported"]: stats["cache_hit_tokens"] = "unmeasured"
+    stats.update({f"setting_{k}": v for k, v in _settings.items()})
+    stats.update({f"governor_{k}": v for k, v in _governor.state().items()})
+    if _cassette is not None:
+        stats.update({f"cassette_{k}": v for k, v in _cassette.stats.items()})
+        stats["cassette_mode"] = _cassette.mode
+    return stats
+
+
+def close_all():
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        try: client.close()
+        except Exception as e: log.logger.warning(f"LLM gateway: error closing client: {e}")
@@ -0,0 +1,137 @@
+from collections import defaultdict
+
+import numpy as np
+
+from log.custom_logger import log
+
+
+class LoanBook:
+    """All open loans, indexed by repayment day.
+
+    Loans are stored column-wise (ledger row, amount, loan type, repayment date, active) with a
+    calendar bucket {repayment_date: [loan_id]}, so a day's repayment pass only touches the loans
+    that fall due. Per-row outstanding totals are kept up to date on every add/repay, making
+    Agent.get_total_loan an O(1) read, and interest on REPAYMENT_DAYS is one vectorized charge.
+
+    Each agent's loans are also kept as the same dicts as before (Agent.loans), since they are
+    shown to the model in the loan prompt.
+    """
+
+    def __init__(self, ledger, capacity=16):
+        self.ledger = ledger
+        capacity = max(int(capacity), 1)
+        self.size = 0
+        self.row = np.zeros(capacity, dtype=np.int64)
+        self.amount = np.zeros(capacity, dtype=np.float64)
+        self.loan_type = np.zeros(capacity, dtype=np.int64)
+        self.repayment_date = np.zeros(capacity, dtype=np.int64)
+        self.active = np.zeros(capacity, dtype=bool)
+        self.outstanding = np.zeros(max(len(ledger), 1), dtype=np.float64) # per ledger row
+        self._records = []                 # loan_id -> loan dict
+        self._due = defaultdict(list)      # repayment_date -> [loan_id]
+        self._by_row = defaultdict(list)   # ledger row -> [loan dict]
+
+    def __len__(self):
+        return int(self.active[:self.size].sum())
+
+    def _grow(self):
+        capacity = len(self.amount) * 2
+        for name in ("row", "amount", "loan_type", "repayment_date", "active"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def _ensure_row(self, row):
+        if row >= len(self.outstanding):
+            grown = np.zeros(max(row + 1, len(self.outstanding) * 2), dtype=np.float64)
+            grown[:len(self.outstanding)] = self.outstanding
+            self.outstanding = grown
+
+    def add(self, row, loan):
+        if self.size >= len(self.amount):
+            self._grow()
+        self._ensure_row(row)
+        loan_id = self.size
+        loan_type = loan.get("loan_type")
+        repayment_date = loan.get("repayment_date")
+        self.row[loan_id] = row
+        self.amount[loan_id] = loan["amount"]
+        # -1 marks a loan type that cannot be priced; it is kept but never charged, as before
+        self.loan_type[loan_id] = loan_type if isinstance(loan_type, int) else -1
+        self.repayment_date[loan_id] = repayment_date if repayment_date is not None else -1
+        self.active[loan_id] = True
+        self.size += 1
+        self._records.append(loan)
+        if repayment_date is not None:
+            self._due[repayment_date].append(loan_id)
+        self._by_row[row].append(loan)
+        self.outstanding[row] += loan["amount"]
+        return loan_id
+
+    def loans_of(self, row):
+        return self._by_row[row]
+
+    def total_for(self, row):
+        return float(self.outstanding[row]) if row < len(self.outstanding) else 0.0
+
+    def _close(self, loan_id):
+        row = int(self.row[loan_id])
+        loan = self._records[loan_id]
+        self.active[loan_id] = False
+        self.outstanding[row] -= self.amount[loan_id]
+        self._by_row[row].remove(loan)
+        return row, loan
+
+    def settle_due(self, date, rates, rows=None):
+        """Repays every active loan due on date at amount * (1 + rate). Returns [(row, loan, repayment)].
+
+        rows restricts the pass to some ledger rows; loans of quit rows are left untouched.
+        """
+        candidates = self._due.get(date)
+        if not candidates:
+            return []
+        ids = np.array(candidates, dtype=np.int64)
+        ids = ids[self.active[ids] & ~self.ledger.quit[self.row[ids]]]
+        if rows is not None:
+            ids = ids[np.isin(self.row[ids], rows)]
+        types = self.loan_type[ids]
+        priced = (types >= 0) & (types < len(rates))
+        for loan_id in ids[~priced]:
+            log.logger.error(f"Agent row {self.row[loan_id]}: Invalid loan_type index {self.loan_type[loan_id]} during repayment for loan: {self._records[loan_id]}")
+        ids, types = ids[priced], types[priced]
+        if len(ids) == 0:
+            return []
+
+        repayments = self.amount[ids] * (1 + np.asarray(rates, dtype=np.float64)[types])
+        loan_rows = self.row[ids]
+        np.subtract.at(self.ledger.cash, loan_rows, repayments)
+        settled = []
+        for loan_id, repayment in zip(ids, repayments):
+            row, loan = self._close(int(loan_id))
+            settled.append((row, loan, float(repayment)))
+            log.logger.info(f"Agent {self._owner_order(row)}: Repaid loan {loan['amount']} with interest. New cash: {self.ledger.cash[row]}. Loan details: {loan}")
+        remaining = self._due[date]
+        remaining[:] = [i for i in remaining if self.active[i]]
+        if not remaining:
+            del self._due[date]
+        self.ledger.is_bankrupt[loan_rows] |= self.ledger.cash[loan_rows] < 0
+        return settled
+
+    def interest_by_row(self, rates):
+        """Monthly interest (rate / 12) on every open, priceable loan, summed per ledger row."""
+        n = self.size
+        types = self.loan_type[:n]
+        live = self.active[:n] & (types >= 0) & (types < len(rates))
+        interest = self.amount[:n][live] * np.asarray(rates, dtype=np.float64)[types[live]] / 12
+        return np.bincount(self.row[:n][live], weights=interest, minlength=len(self.ledger))
+
+    def accrue_interest(self, rates):
+        """Charges interest_by_row through the ledger in one pass. Returns the per-row charge."""
+        per_row = self.interest_by_row(rates)
+        self.ledger.charge(per_row)
+        return per_row
+
+    def _owner_order(self, row):
+        owner = self.ledger.owners[row] if row < len(self.ledger.owners) else None
+        return owner.order if owner is not None else row
@@ -1,81 +1,82 @@
 # main.py
 import argparse
 import random # Ensure this is imported
-from agent import Agent
-from secretary import Secretary
+from agent import Agent, random_init_bulk, endowment_at
+from secretary import Secretary, get_repair_stats
 from stock import Stock
+from ledger import AgentLedger
+from loan_book import LoanBook
 from log.custom_logger import log
-from record import create_stock_record, create_trade_record, AgentRecordDaily, create_agentses_record
+import llm_gateway
+import model_router
+from call_auction import clear_call_auction
+from fan_out import run_ordered
+from decision_backend import make_backend
+from conversation import get_context_stats, reset_context_stats
+from batch_planner import plan_stock_batched, get_batch_stats, reset_batch_stats
+from decision_cache import make_decision_cache, get_cache_stats
+from decision_memo import POLICIES as MEMO_POLICIES, get_memo_stats, reset_memo_stats
+from record import create_stock_record, create_trade_record, AgentRecordDaily, create_agentses_record, create_forum_record, make_record_writer, close_record_writer, get_writer_stats, get_sink
+from run_store import new_run_id
+import numpy as np
 import queue # For type hinting and usage
 import json
+import copy
 import traceback
 
 # --- Function Definition ---
 def get_agent(all_agents, order):
     """Finds an agent object in a list by its order ID."""
+    # all_agents is built in order and only ever has agents removed, so binary search first
+    lo, hi = 0, len(all_agents)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if all_agents[mid].order < order: lo = mid + 1
+        else: hi = mid
+    if lo < len(all_agents) and all_agents[lo].order == order:
+        return all_agents[lo]
     for agent_obj in all_agents:
         if agent_obj.order == order:
             return agent_obj
     return None # Return None if agent not found
 # --- End Function Definition ---
 
-# Modified handle_action to accept sse_q
-def handle_action(action, stock_deals, all_agents, stock, session, config, sse_q: queue.Queue = None):
+def settle_trade(stock, session, date, buyer_agent_id, seller_agent_id, price, close_amount, all_agents, sse_q: queue.Queue = None, buyer_first=True):
+    """Applies one fill to both agents and emits the trade record, log line and trade_executed event."""
+    buyer_obj = get_agent(all_agents, buyer_agent_id)
+    seller_obj = get_agent(all_agents, seller_agent_id) if seller_agent_id != -1 else None
+    if buyer_first:
+        if buyer_obj: buyer_obj.buy_stock(stock.name, price, close_amount)
+        if seller_obj: seller_obj.sell_stock(stock.name, price, close_amount)
+    else:
+        if seller_obj: seller_obj.sell_stock(stock.name, price, close_amount)
+        if buyer_obj: buyer_obj.buy_stock(stock.name, price, close_amount)
+    stock.add_session_deal({"price": price, "amount": close_amount}, date, session)
+    create_trade_record(date, session, stock.name, buyer_agent_id, seller_agent_id, close_amount, price)
+    log_msg = f"ACTION - BUY:{buyer_agent_id}, SELL:{seller_agent_id}, STOCK:{stock.name}, PRICE:{price}, AMOUNT:{close_amount}"
+    log.logger.debug(log_msg)
+    # --- Send trade execution event ---
+    if sse_q:
+        try: sse_q.put({"type": "trade_executed", "payload": {"date": date, "session": session, "stock": stock.name,"buyer": buyer_agent_id, "seller": seller_agent_id, "amount": close_amount, "price": price,"description": log_msg}})
+        except Exception as e: log.logger.error(f"Error putting message in SSE queue: {e}")
+    # --- End Send ---
+
+# Modified handle_action to accept sse_q; matching is delegated to the stock's OrderBook
+def handle_action(action, order_book, all_agents, stock, session, config, sse_q: queue.Queue = None):
     try:
         agent_order = action["agent"]
         agent_obj = get_agent(all_agents, agent_order)
 
-        def send_sse_event(event_type, payload): # Helper
-            if sse_q:
-                try: sse_q.put({"type": event_type, "payload": payload})
-                except Exception as e: log.logger.error(f"Error putting message in SSE queue: {e}")
-
-        if action["action_type"] == "buy":
-            for sell_action in stock_deals["sell"][:]:
-                if action["price"] == sell_action["price"]:
-                    close_amount = min(action["amount"], sell_action["amount"])
-                    buyer_agent_id = action["agent"]; seller_agent_id = sell_action["agent"]
-                    if agent_obj: agent_obj.buy_stock(stock.name, action["price"], close_amount)
-                    if seller_agent_id != -1:
-                        agent_selling_obj = get_agent(all_agents, seller_agent_id)
-                        if agent_selling_obj: agent_selling_obj.sell_stock(stock.name, action["price"], close_amount)
-                    stock.add_session_deal({"price": action["price"], "amount": close_amount})
-                    create_trade_record(action["date"], session, stock.name, buyer_agent_id, seller_agent_id, close_amount, action["price"])
-                    log_msg = f"ACTION - BUY:{buyer_agent_id}, SELL:{seller_agent_id}, STOCK:{stock.name}, PRICE:{action['price']}, AMOUNT:{close_amount}"
-                    log.logger.info(log_msg)
-                    # --- Send trade execution event ---
-                    send_sse_event("trade_executed", {"date": action["date"], "session": session, "stock": stock.name,"buyer": buyer_agent_id, "seller": seller_agent_id, "amount": close_amount, "price": action['price'],"description": log_msg})
-                    # --- End Send ---
-                    if action["amount"] > close_amount:
-                        stock_deals["sell"].remove(sell_action); action["amount"] -= close_amount
-                    else:
-                        sell_action["amount"] -= close_amount
-                        if sell_action["amount"] <= 0: stock_deals["sell"].remove(sell_action)
-                        return
-            if action["amount"] > 0: stock_deals["buy"].append(action)
-        else: # sell
-            if not agent_obj: log.logger.warning(f"Attempted sell by non-existent agent {agent_order}"); return
-            for buy_action in stock_deals["buy"][:]:
-                if action["price"] == buy_action["price"]:
-                    close_amount = min(action["amount"], buy_action["amount"])
-                    buyer_agent_id = buy_action["agent"]; seller_agent_id = action["agent"]
-                    agent_obj.sell_stock(stock.name, action["price"], close_amount)
-                    agent_buying_match_obj = get_agent(all_agents, buyer_agent_id)
-                    if agent_buying_match_obj: agent_buying_match_obj.buy_stock(stock.name, action["price"], close_amount)
-                    stock.add_session_deal({"price": action["price"], "amount": close_amount})
-                    create_trade_record(action["date"], session, stock.name, buyer_agent_id, seller_agent_id, close_amount, action["price"])
-                    log_msg = f"ACTION - BUY:{buyer_agent_id}, SELL:{seller_agent_id}, STOCK:{stock.name}, PRICE:{action['price']}, AMOUNT:{close_amount}"
-                    log.logger.info(log_msg)
-                     # --- Send trade execution event ---
-                    send_sse_event("trade_executed", {"date": action["date"], "session": session, "stock": stock.name,"buyer": buyer_agent_id, "seller": seller_agent_id, "amount": close_amount, "price": action['price'], "description": log_msg})
-                     # --- End Send ---
-                    if action["amount"] > close_amount:
-                        stock_deals["buy"].remove(buy_action); action["amount"] -= close_amount
-                    else:
-                        buy_action["amount"] -= close_amount
-                        if buy_action["amount"] <= 0: stock_deals["buy"].remove(buy_action)
-                        return
-            if action["amount"] > 0: stock_deals["sell"].append(action)
+        if action["action_type"] != "buy" and not agent_obj:
+            log.logger.warning(f"Attempted sell by non-existent agent {agent_order}"); return
+
+        def on_fill(incoming, resting, close_amount):
+            if incoming["action_type"] == "buy":
+                settle_trade(stock, session, incoming["date"], incoming["agent"], resting["agent"], incoming["price"], close_amount, all_agents, sse_q, buyer_first=True)
+            else:
+                settle_trade(stock, session, incoming["date"], resting["agent"], incoming["agent"], incoming["price"], close_amount, all_agents, sse_q, buyer_first=False)
+
+        order_book.submit(action, on_fill)
     except Exception as e:
         log.logger.error(f"handle_action error: {e}, action: {action}")
         log.logger.error(traceback.format_exc())
@@ -84,25 +85,68 @@ def handle_action(action, stock_deals, all_agents, stock, session, config, sse_q
         return
 
 
+def handle_call_auction(orders, all_agents, stock, session, config, sse_q: queue.Queue = None):
+    """Clears one session's collected orders for a stock at a single price. Returns the clearing price or None."""
+    try:
+        clearing_price, fills = clear_call_auction(orders, reference_price=stock.get_price())
+        if clearing_price is None:
+            log.logger.info(f"CALL AUCTION - STOCK:{stock.name}, SESSION:{session}, no crossing orders ({len(orders)} submitted)")
+            return None
+        log.logger.info(f"CALL AUCTION - STOCK:{stock.name}, SESSION:{session}, CLEARING PRICE:{clearing_price}, FILLS:{len(fills)}")
+        for buy_i, sell_i, amount in fills:
+            buy_order, sell_order = orders[buy_i], orders[sell_i]
+            settle_trade(stock, session, buy_order["date"], buy_order["agent"], sell_order["agent"], clearing_price, amount, all_agents, sse_q)
+        return clearing_price
+    except Exception as e:
+        log.logger.error(f"handle_call_auction error: {e}, stock: {stock.name}, orders: {len(orders)}")
+        log.logger.error(traceback.format_exc())
+        return None
+
+
 # Added sse_q parameter, results_accumulator for polling data
 def simulation(args, config, results_accumulator, sse_q: queue.Queue = None):
     # ... (Initialization is the same) ...
+    log.logger.setLevel(str(config.get('LOG_LEVEL') or "INFO").upper()) # Per-agent decisions and fills are DEBUG lines
     log.logger.info(f"Simulation starting with config keys: {list(config.keys())}")
-    secretary = Secretary(model=config['MODEL_NAME'], api_key=config['DEEPSEEK_API_KEY'])
+    llm_gateway.configure_from(config)
+    secretary = Secretary(model=config['MODEL_NAME'], api_key=config['DEEPSEEK_API_KEY'], base_url=config.get('LLM_BASE_URL', llm_gateway.DEEPSEEK_BASE_URL))
+    backend = make_backend(config) # Shared by all agents: OpenAI-compatible endpoint or in-process rules
+    reset_context_stats(); reset_batch_stats(); reset_memo_stats()
+    decision_cache = make_decision_cache(config) # Shared by all agents; inert unless DECISION_CACHE["enabled"]
+    run_id = config.get('RUN_ID') or new_run_id() # Key of this run's rows in the SQLite run store
+    if isinstance(results_accumulator, dict): results_accumulator["run_id"] = run_id
+    record_writer = make_record_writer(config, run_id) # Record rows are written on a background thread; .xlsx files once at the end
+    log.logger.info(f"Run id: {run_id}, records: {config.get('RECORD_FORMAT', 'csv')}")
+    log.logger.info(f"Decision backend: {backend.name}")
     stock_a = Stock("A", config['STOCK_A_INITIAL_PRICE'], 0, is_new=False, config=config)
     stock_b = Stock("B", config['STOCK_B_INITIAL_PRICE'], 0, is_new=False, config=config)
     all_agents = []
+    ledger = AgentLedger(instruments=(stock_a.name, stock_b.name), capacity=config['AGENTS_NUM'])
+    loan_book = LoanBook(ledger, capacity=config['AGENTS_NUM'])
     log.logger.debug("Agents initial...")
+    seed = config.get('RANDOM_SEED')
+    if seed is not None: random.seed(seed)
+    endowments = random_init_bulk(config['AGENTS_NUM'], stock_a.get_price(), stock_b.get_price(), config, np.random.default_rng(seed))
     for i in range(0, config['AGENTS_NUM']):
-        agent_obj = Agent(i, stock_a.get_price(), stock_b.get_price(), secretary, model=config['MODEL_NAME'], config=config)
+        agent_obj = Agent(i, stock_a.get_price(), stock_b.get_price(), secretary, model=config['MODEL_NAME'], config=config, ledger=ledger, loan_book=loan_book, endowment=endowment_at(endowments, i), backend=backend, decision_cache=decision_cache)
         all_agents.append(agent_obj)
     last_day_forum_message = []
-    stock_a_deals = {"sell": [], "buy": []}; stock_b_deals = {"sell": [], "buy": []}
     current_loan_rates = list(config['LOAN_RATE'])
+    call_auction_mode = config.get('SESSION_MODE', 'continuous') == 'call_auction'
+    snapshot_mode = config.get('SESSION_MODE', 'continuous') == 'snapshot'
+    # Concurrent LLM calls for the independent per-agent phases; an in-process backend has nothing to wait on
+    max_in_flight = config.get('LLM_MAX_CONCURRENCY', 1) if backend.waits_on_io else 1
+    batch_size = int(config.get('TRADE_BATCH_SIZE') or 0) # Agents per plan_stock request, snapshot/call auction sessions only
+    if batch_size > 1 and not (call_auction_mode or snapshot_mode):
+        log.logger.warning(f"TRADE_BATCH_SIZE={batch_size} ignored: continuous sessions decide one agent at a time on the live book")
+    memo_policy = config.get('TRADE_MEMO_POLICY', "off")
+    if memo_policy not in MEMO_POLICIES:
+        log.logger.warning(f"TRADE_MEMO_POLICY={memo_policy!r} unknown (policies: {', '.join(MEMO_POLICIES)}), memo is off")
     def send_sse(event_type, payload): # Helper
         if sse_q:
             try: sse_q.put({"type": event_type, "payload": payload})
             except Exception as e: log.logger.error(f"Error putting message in SSE queue: {e}")
+    llm_gateway.governor().listener = lambda state: send_sse("llm_governor", state) # Breaker transitions and concurrency cuts
     log.logger.debug("--------Simulation Start!--------")
 
     # --- Main Daily Loop ---
@@ -116,23 +160,25 @@ def simulation(args, config, results_accumulator, sse_q: queue.Queue = None):
         send_sse("progress_update", {"status": "running", "progress_message": progress_message})
 
         # --- Daily Logic (Repayments, Interest, Bankruptcy - unchanged) ---
-        stock_a_deals["sell"].clear(); stock_a_deals["buy"].clear()
-        stock_b_deals["buy"].clear(); stock_b_deals["sell"].clear()
+        stock_a.order_book.clear(); stock_b.order_book.clear()
         for agent_obj in all_agents[:]:
             if agent_obj.quit: continue
-            agent_obj.chat_history.clear(); agent_obj.loan_repayment(date)
-        if date in config['REPAYMENT_DAYS']:
-            for agent_obj in all_agents:
-                if agent_obj.quit: continue; agent_obj.interest_payment()
-        for i in range(len(all_agents) - 1, -1, -1):
-            agent_obj = all_agents[i]
-            if agent_obj.quit: continue
-            if agent_obj.is_bankrupt or agent_obj.cash < 0:
-                quit_sig = agent_obj.bankrupt_process(stock_a.get_price(), stock_b.get_price())
-                if quit_sig:
-                    log.logger.info(f"Agent {agent_obj.order} quit due to bankruptcy on day {date}.")
-                    send_sse("agent_status", {"agent": agent_obj.order, "status": "bankrupt", "date": date})
-                    all_agents.pop(i)
+            agent_obj.chat_history.clear()
+        # Only loans due today are touched; cash-negative rows are picked up by the bankruptcy screen below
+        repaid = loan_book.settle_due(date, current_loan_rates)
+        if repaid: log.logger.info(f"{len(repaid)} loans repaid on day {date}")
+        if config.get('CHARGE_INTEREST', False) and date in config['REPAYMENT_DAYS']:
+            # One vectorized charge over all open loans instead of a loop over the agents
+            interest_due = loan_book.accrue_interest(current_loan_rates)
+            log.logger.info(f"Interest charged on {len(loan_book)} open loans on day {date}, total {interest_due.sum():.2f}")
+        # Only agents flagged by the ledger screen go through bankrupt_process
+        for row in ledger.bankruptcy_candidates()[::-1]:
+            agent_obj = ledger.owners[row]
+            quit_sig = agent_obj.bankrupt_process(stock_a.get_price(), stock_b.get_price())
+            if quit_sig:
+                log.logger.info(f"Agent {agent_obj.order} quit due to bankruptcy on day {date}.")
+                send_sse("agent_status", {"agent": agent_obj.order, "status": "bankrupt", "date": date})
+                if agent_obj in all_agents: all_agents.remove(agent_obj)
 
         # --- Events (unchanged, keep SSE send) ---
         active_agents_for_events = [ag for ag in all_agents if not ag.quit]
@@ -150,8 +196,10 @@ def simulation(args, config, results_accumulator, sse_q: queue.Queue = None):
         # --- Loan Decisions (keep SSE send) ---
         temp_daily_agent_records_objects = []
         active_agents_for_loan = [ag for ag in all_agents if not ag.quit]
-        for agent_obj in active_agents_for_loan:
-            loan_decision = agent_obj.plan_loan(date, stock_a.get_price(), stock_b.get_price(), last_day_forum_message)
+        # Decisions are requested concurrently, then booked in agent order
+        loan_decisions = run_ordered(lambda ag: ag.decide_loan(date, stock_a.get_price(), stock_b.get_price(), last_day_forum_message), active_agents_for_loan, max_in_flight)
+        for agent_obj, loan_decision in zip(active_agents_for_loan, loan_decisions):
+            loan_decision = agent_obj.apply_loan(date, loan_decision)
             send_sse("loan_decision", {"date": date, "agent": agent_obj.order, "decision": loan_decision})
             record_obj = AgentRecordDaily(agent_obj.order, date, loan_decision)
             temp_daily_agent_records_objects.append(record_obj)
@@ -163,34 +211,65 @@ def simulation(args, config, results_accumulator, sse_q: queue.Queue = None):
             active_agents_for_session = [ag for ag in all_agents if not ag.quit]
             if not active_agents_for_session: break
             sequence = list(range(len(active_agents_for_session))); random.shuffle(sequence)
-            for i_seq in sequence:
+            session_orders = {"A": [], "B": []} # Only used in call auction mode
+            if call_auction_mode:
+                # Holdings are frozen until the auction clears, so value every agent in one pass
+                session_proper, session_cash, session_values = ledger.portfolio_values({stock_a.name: stock_a.get_price(), stock_b.name: stock_b.get_price()})
+            if call_auction_mode or snapshot_mode:
+                # Nobody's state changes until the commit loop below, so every agent decides on the same
+                # frozen books and holdings and the plan_stock calls can run concurrently
+                frozen_a, frozen_b = copy.deepcopy(stock_a.order_book.snapshot()), copy.deepcopy(stock_b.order_book.snapshot())
+                sequenced_agents = [active_agents_for_session[i_seq] for i_seq in sequence]
+                if batch_size > 1: decisions = plan_stock_batched(sequenced_agents, date, session, stock_a, stock_b, frozen_a, frozen_b, batch_size, max_in_flight)
+                else: decisions = run_ordered(lambda ag: ag.plan_stock(date, session, stock_a, stock_b, frozen_a, frozen_b), sequenced_agents, max_in_flight)
+            for pos, i_seq in enumerate(sequence):
                 agent_obj = active_agents_for_session[i_seq]
                 # Get action decision
-                action = agent_obj.plan_stock(date, session, stock_a, stock_b, stock_a_deals, stock_b_deals)
+                if call_auction_mode:
+                    action = decisions[pos]
+                elif snapshot_mode:
+                    # Earlier commits in this session may have spent the cash/shares this order relies on
+                    action = agent_obj.recheck_action(decisions[pos], stock_a.get_price(), stock_b.get_price())
+                else:
+                    action = agent_obj.plan_stock(date, session, stock_a, stock_b, stock_a.order_book.snapshot(), stock_b.order_book.snapshot())
                 # Send action decision event
                 if action.get("action_type") != "no":
-                    log.logger.info(f"INFO: Agent {agent_obj.order} decide to action: {action}")
+                    log.logger.debug(f"INFO: Agent {agent_obj.order} decide to action: {action}")
                     send_sse("session_action_decision", {"date": date, "session": session, "agent": agent_obj.order, "action_details": action})
                 # Record session state (Excel only)
-                proper, cash, val_a, val_b = agent_obj.get_proper_cash_value(stock_a.get_price(), stock_b.get_price())
+                if call_auction_mode:
+                    row = agent_obj.row
+                    proper, cash = float(session_proper[row]), float(session_cash[row])
+                    val_a, val_b = float(session_values[row, ledger.column(stock_a.name)]), float(session_values[row, ledger.column(stock_b.name)])
+                else:
+                    proper, cash, val_a, val_b = agent_obj.get_proper_cash_value(stock_a.get_price(), stock_b.get_price())
                 create_agentses_record(agent_obj.order, date, session, proper, cash, val_a, val_b, action)
                 # Execute action (handle_action will send trade_executed events via sse_q)
                 action["agent"] = agent_obj.order; action["date"] = date
                 if not action["action_type"] == "no":
-                    if action["stock"] == 'A': handle_action(action, stock_a_deals, all_agents, stock_a, session, config, sse_q)
-                    else: handle_action(action, stock_b_deals, all_agents, stock_b, session, config, sse_q)
+                    if call_auction_mode: session_orders[action["stock"]].append(action)
+                    elif action["stock"] == 'A': handle_action(action, stock_a.order_book, all_agents, stock_a, session, config, sse_q)
+                    else: handle_action(action, stock_b.order_book, all_agents, stock_b, session, config, sse_q)
             # End of Session Updates
-            stock_a.update_price(date); stock_b.update_price(date)
+            if call_auction_mode:
+                clearing_a = handle_call_auction(session_orders["A"], all_agents, stock_a, session, config, sse_q)
+                clearing_b = handle_call_auction(session_orders["B"], all_agents, stock_b, session, config, sse_q)
+                stock_a.update_price(date, clearing_a); stock_b.update_price(date, clearing_b)
+            else:
+                stock_a.update_price(date); stock_b.update_price(date)
             create_stock_record(date, session, stock_a.get_price(), stock_b.get_price())
             send_sse("stock_price_update", {"date": date, "session": session, "stock_a": stock_a.get_price(), "stock_b": stock_b.get_price()})
 
         # --- Agent Predictions (Simplified - Add SSE Send) & Forum Posts (SSE) ---
         active_agents_for_estimate = [ag for ag in all_agents if not ag.quit]
+        estimate_pairs = [] # (record, agent) for records whose agent is still active
         for record_obj_for_day in temp_daily_agent_records_objects: # Use records created earlier
             agent_obj = get_agent(active_agents_for_estimate, record_obj_for_day.agent)
+            if agent_obj: estimate_pairs.append((record_obj_for_day, agent_obj))
+        estimations = run_ordered(lambda pair: pair[1].next_day_estimate(), estimate_pairs, max_in_flight)
+        for (record_obj_for_day, agent_obj), estimation in zip(estimate_pairs, estimations):
             if agent_obj:
-                estimation = agent_obj.next_day_estimate() # Gets simple yes/no dict
-                log.logger.info(f"Agent {agent_obj.order} tomorrow estimation: {estimation}")
+                log.logger.debug(f"Agent {agent_obj.order} tomorrow estimation: {estimation}")
                 record_obj_for_day.add_estimate(estimation) # Add simple estimate to record obj
 
                 # +++ THIS BLOCK WAS MISSING +++
@@ -214,20 +293,102 @@ def simulation(args, config, results_accumulator, sse_q: queue.Queue = None):
         last_day_forum_message.clear()
         log.logger.debug(f"DAY {date} ends, collecting forum messages...")
         active_agents_for_forum = [ag for ag in all_agents if not ag.quit]
-        for agent_obj in active_agents_for_forum:
-            message = agent_obj.post_message()
-            log.logger.info(f"Agent {agent_obj.order} says: {message}")
+        forum_messages = run_ordered(lambda ag: ag.post_message(), active_agents_for_forum, max_in_flight)
+        for agent_obj, message in zip(active_agents_for_forum, forum_messages):
+            log.logger.debug(f"Agent {agent_obj.order} says: {message}")
             forum_payload = {"date": date, "agent": agent_obj.order, "message": message}
             last_day_forum_message.append(forum_payload)
+            create_forum_record(date, agent_obj.order, message)
             send_sse("forum_post", forum_payload)
+        send_sse("llm_governor", dict(llm_gateway.governor().state(), reason="day_end", date=date))
+        if record_writer is not None: # The day's records are on disk before the next day starts
+            record_writer.barrier()
+            send_sse("record_writer", dict(record_writer.report(), date=date))
 
+    llm_gateway.governor().listener = None
     log.logger.debug("--------Simulation finished!--------")
+    log.logger.info(f"Records exported to {close_record_writer()}: {get_writer_stats()}")
+    parquet_dir = config.get('RECORD_PARQUET_DIR')
+    if parquet_dir:
+        import columnar_export # Needs pyarrow, so it is only loaded when the Parquet export is on
+        columnar_export.export_run(parquet_dir, run_id, sink=get_sink(), stocks=(stock_a, stock_b))
+        log.logger.info(f"Records and price tape of run {run_id} exported to Parquet under {parquet_dir}")
+    log.logger.info(f"LLM gateway stats: {llm_gateway.get_stats()}")
+    log.logger.info(f"LLM routes: {model_router.get_route_stats()}")
+    log.logger.info(f"Agent context tokens: {get_context_stats()}")
+    if batch_size > 1: log.logger.info(f"Batched trade decisions: {get_batch_stats()}")
+    if decision_cache.enabled: log.logger.info(f"Decision cache: {get_cache_stats()}")
+    if memo_policy in MEMO_POLICIES and memo_policy != "off": log.logger.info(f"Unchanged-state trade memo ({memo_policy}): {get_memo_stats()}")
+    log.logger.info(f"Secretary local repairs (re-prompts saved per rule): {get_repair_stats()}")
     log.logger.debug(f"Final number of active agents: {len([ag for ag in all_agents if not ag.quit])}")
 
 
 if __name__ == "__main__":
     # ... (CLI execution part remains the same) ...
-    parser = argparse.ArgumentParser(); parser.add_argument("--model", type=str, default="deepseek-reasoner", help="model name"); cli_args = parser.parse_args()
+    parser = argparse.ArgumentParser(); parser.add_argument("--model", type=str, default="deepseek-reasoner", help="model name"); parser.add_argument("--base-url", type=str, default=None, help="OpenAI-compatible endpoint, e.g. a local stub_llm_server.py"); cli_args = parser.parse_args()
     import util as default_util_for_cli
-    default_config = { 'DEEPSEEK_API_KEY': default_util_for_cli.DEEPSEEK_API_KEY,'MODEL_NAME': cli_args.model,'AGENTS_NUM': default_util_for_cli.AGENTS_NUM, 'TOTAL_DATE': default_util_for_cli.TOTAL_DATE,'TOTAL_SESSION': default_util_for_cli.TOTAL_SESSION,'STOCK_A_INITIAL_PRICE': default_util_for_cli.STOCK_A_INITIAL_PRICE, 'STOCK_B_INITIAL_PRICE': default_util_for_cli.STOCK_B_INITIAL_PRICE,'MAX_INITIAL_PROPERTY': default_util_for_cli.MAX_INITIAL_PROPERTY, 'MIN_INITIAL_PROPERTY': default_util_for_cli.MIN_INITIAL_PROPERTY,'LOAN_TYPE': list(default_util_for_cli.LOAN_TYPE), 'LOAN_TYPE_DATE': list(default_util_for_cli.LOAN_TYPE_DATE),'LOAN_RATE': list(default_util_for_cli.LOAN_RATE), 'REPAYMENT_DAYS': list(default_util_for_cli.REPAYMENT_DAYS),'SEASONAL_DAYS': default_util_for_cli.SEASONAL_DAYS, 'SEASON_REPORT_DAYS': list(default_util_for_cli.SEASON_REPORT_DAYS),'FINANCIAL_REPORT_A': list(default_util_for_cli.FINANCIAL_REPORT_A), 'FINANCIAL_REPORT_B': list(default_util_for_cli.FINANCIAL_REPORT_B),'EVENT_1_DAY': default_util_for_cli.EVENT_1_DAY, 'EVENT_1_MESSAGE': default_util_for_cli.EVENT_1_MESSAGE,'EVENT_1_LOAN_RATE': list(default_util_for_cli.EVENT_1_LOAN_RATE), 'EVENT_2_DAY': default_util_for_cli.EVENT_2_DAY,'EVENT_2_MESSAGE': default_util_for_cli.EVENT_2_MESSAGE, 'EVENT_2_LOAN_RATE': list(default_util_for_cli.EVENT_2_LOAN_RATE), }
-    dummy_results_accumulator = {"daily_agent_records": [], "error_message": "", "progress_message": ""}; simulation(cli_args, default_config, dummy_results_accumulator, None)
\ No newline at end of file
+    default_config = {
+        'DEEPSEEK_API_KEY': default_util_for_cli.DEEPSEEK_API_KEY,
+        'MODEL_NAME': cli_args.model,
+        'AGENTS_NUM': default_util_for_cli.AGENTS_NUM,
+        'TOTAL_DATE': default_util_for_cli.TOTAL_DATE,
+        'TOTAL_SESSION': default_util_for_cli.TOTAL_SESSION,
+        'STOCK_A_INITIAL_PRICE': default_util_for_cli.STOCK_A_INITIAL_PRICE,
+        'STOCK_B_INITIAL_PRICE': default_util_for_cli.STOCK_B_INITIAL_PRICE,
+        'MAX_INITIAL_PROPERTY': default_util_for_cli.MAX_INITIAL_PROPERTY,
+        'MIN_INITIAL_PROPERTY': default_util_for_cli.MIN_INITIAL_PROPERTY,
+        'LOAN_TYPE': list(default_util_for_cli.LOAN_TYPE),
+        'LOAN_TYPE_DATE': list(default_util_for_cli.LOAN_TYPE_DATE),
+        'LOAN_RATE': list(default_util_for_cli.LOAN_RATE),
+        'REPAYMENT_DAYS': list(default_util_for_cli.REPAYMENT_DAYS),
+        'SEASONAL_DAYS': default_util_for_cli.SEASONAL_DAYS,
+        'SEASON_REPORT_DAYS': list(default_util_for_cli.SEASON_REPORT_DAYS),
+        'FINANCIAL_REPORT_A': list(default_util_for_cli.FINANCIAL_REPORT_A),
+        'FINANCIAL_REPORT_B': list(default_util_for_cli.FINANCIAL_REPORT_B),
+        'EVENT_1_DAY': default_util_for_cli.EVENT_1_DAY,
+        'EVENT_1_MESSAGE': default_util_for_cli.EVENT_1_MESSAGE,
+        'EVENT_1_LOAN_RATE': list(default_util_for_cli.EVENT_1_LOAN_RATE),
+        'EVENT_2_DAY': default_util_for_cli.EVENT_2_DAY,
+        'EVENT_2_MESSAGE': default_util_for_cli.EVENT_2_MESSAGE,
+        'EVENT_2_LOAN_RATE': list(default_util_for_cli.EVENT_2_LOAN_RATE),
+        'SESSION_MODE': default_util_for_cli.SESSION_MODE,
+        'RANDOM_SEED': default_util_for_cli.RANDOM_SEED,
+        'LLM_POOL_SIZE': default_util_for_cli.LLM_POOL_SIZE,
+        'LLM_TIMEOUT': default_util_for_cli.LLM_TIMEOUT,
+        'LLM_CONNECT_TIMEOUT': default_util_for_cli.LLM_CONNECT_TIMEOUT,
+        'LLM_MAX_CONCURRENCY': default_util_for_cli.LLM_MAX_CONCURRENCY,
+        'LLM_CASSETTE_MODE': default_util_for_cli.LLM_CASSETTE_MODE,
+        'LLM_CASSETTE_PATH': default_util_for_cli.LLM_CASSETTE_PATH,
+        'DECISION_BACKEND': default_util_for_cli.DECISION_BACKEND,
+        'LLM_BASE_URL': default_util_for_cli.LLM_BASE_URL,
+        'LLM_RATE_LIMIT_RPS': default_util_for_cli.LLM_RATE_LIMIT_RPS,
+        'LLM_MAX_RETRIES': default_util_for_cli.LLM_MAX_RETRIES,
+        'LLM_BACKOFF_BASE': default_util_for_cli.LLM_BACKOFF_BASE,
+        'LLM_BACKOFF_MAX': default_util_for_cli.LLM_BACKOFF_MAX,
+        'LLM_BREAKER_ERROR_RATE': default_util_for_cli.LLM_BREAKER_ERROR_RATE,
+        'LLM_BREAKER_COOLDOWN': default_util_for_cli.LLM_BREAKER_COOLDOWN,
+        'LLM_GENERATION_PROFILES': copy.deepcopy(default_util_for_cli.LLM_GENERATION_PROFILES),
+        'LLM_ROUTES': copy.deepcopy(default_util_for_cli.LLM_ROUTES),
+        'LLM_MODEL_PRICES': copy.deepcopy(default_util_for_cli.LLM_MODEL_PRICES),
+        'CONTEXT_MODE': default_util_for_cli.CONTEXT_MODE,
+        'CONTEXT_TOKEN_BUDGET': default_util_for_cli.CONTEXT_TOKEN_BUDGET,
+        'PROMPT_LAYOUT': default_util_for_cli.PROMPT_LAYOUT,
+        'LLM_TRACK_USAGE': default_util_for_cli.LLM_TRACK_USAGE,
+        'TRADE_BATCH_SIZE': default_util_for_cli.TRADE_BATCH_SIZE,
+        'DECISION_CACHE': dict(default_util_for_cli.DECISION_CACHE),
+        'TRADE_MEMO_POLICY': default_util_for_cli.TRADE_MEMO_POLICY,
+        'RECORD_FORMAT': default_util_for_cli.RECORD_FORMAT,
+        'RECORD_FLUSH_ROWS': default_util_for_cli.RECORD_FLUSH_ROWS,
+        'RECORD_QUEUE_SIZE': default_util_for_cli.RECORD_QUEUE_SIZE,
+        'RECORD_QUEUE_POLICY': default_util_for_cli.RECORD_QUEUE_POLICY,
+        'RECORD_STORE_PATH': default_util_for_cli.RECORD_STORE_PATH,
+        'RECORD_EXCEL_MAX_ROWS': default_util_for_cli.RECORD_EXCEL_MAX_ROWS,
+        'RUN_ID': None,
+        'RECORD_PARQUET_DIR': default_util_for_cli.RECORD_PARQUET_DIR,
+        'CHARGE_INTEREST': default_util_for_cli.CHARGE_INTEREST,
+        'LOG_LEVEL': default_util_for_cli.LOG_LEVEL,
+    }
+    if cli_args.base_url: default_config['LLM_BASE_URL'] = cli_args.base_url
+    dummy_results_accumulator = {"daily_agent_records": [], "error_message": "", "progress_message": ""}
+    try: simulation(cli_args, default_config, dummy_results_accumulator, None)
+    finally: close_record_writer("failed") # Rows recorded before an error or Ctrl-C still reach the files (no-op after a clean run)
\ No newline at end of file
@@ -0,0 +1,167 @@
+import threading
+from collections import deque
+from urllib.parse import urlparse
+
+from llm_gateway import DEEPSEEK_BASE_URL, cache_hit_tokens
+from log.custom_logger import log
+
+ROUTES = ("loan", "trade", "estimate", "forum", "retry")
+DEEPSEEK_FALLBACK = "deepseek-chat" # Fallback of the routes that name none, on DeepSeek's own endpoint only
+
+
+def route_name(call_type):
+    """Routing table entry for a call type; every "<type>_retry" re-ask goes through "retry"."""
+    if call_type.endswith("_retry"): return "retry"
+    return call_type if call_type in ROUTES else "default"
+
+
+def estimate_tokens(chars):
+    # Rough size of text the provider reported no usage for (streamed replies): about 4 characters a token
+    return max(1, chars // 4)
+
+
+class RouteStats:
+    def __init__(self, window=50):
+        self.calls = self.fallback_calls = self.over_budget = self.deadline_fallbacks = self.errors = self.expired = 0
+        self.prompt_tokens = self.completion_tokens = self.cache_hit_tokens = self.estimated_calls = 0
+        self.measured_prompt_tokens = 0 # Prompt tokens of the calls whose usage the provider reported
+        self.total_latency, self.cost = 0.0, 0.0
+        self.latencies = deque(maxlen=window) # Recent latencies, for p95
+        self.models = {} # model -> calls
+
+    def report(self):
+        recent = sorted(self.latencies)
+        measured = self.calls - self.estimated_calls - self.errors - self.expired
+        return {
+            "calls": self.calls, "fallback_calls": self.fallback_calls, "deadline_fallbacks": self.deadline_fallbacks,
+            "over_budget": self.over_budget, "errors": self.errors, "expired": self.expired,
+            "avg_latency": self.total_latency / self.calls if self.calls else 0.0,
+            "p95_latency": recent[int(0.95 * (len(recent) - 1))] if recent else 0.0,
+            "prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens,
+            # Streamed replies cut at the JSON object carry no usage: a route with no measured call is
+            # "unmeasured" rather than 0, and the ratio covers the measured calls only
+            "cache_hit_tokens": self.cache_hit_tokens if measured else "unmeasured",
+            "cache_hit_ratio": self.cache_hit_tokens / self.measured_prompt_tokens if self.measured_prompt_tokens else "unmeasured",
+            "estimated_calls": self.estimated_calls, "measured_calls": measured,
+            "cost": round(self.cost, 6), "models": dict(self.models),
+        }
+
+
+class ModelRouter:
+    """Maps call types to a model and a latency budget (LLM_ROUTES), with a faster fallback model.
+
+    A route is {"model", "latency_budget", "fallback"}; an empty model means the run's MODEL_NAME.
+    When the route's primary model has a fallback and its recent latency (EWMA) is over budget, calls
+    go to the fallback, with every probe_every-th call still sent to the primary to notice recovery.
+    A primary call that runs past the budget is abandoned and asked again of the fallback.
+    Latency, tokens and cost (LLM_MODEL_PRICES, per 1M tokens: input, output and optionally cache-hit
+    input) are reported per route.
+    """
+
+    def __init__(self, routes=None, default_model="", prices=None, probe_every=10, alpha=0.3):
+        self.routes = {name: dict(route or {}) for name, route in (routes or {}).items()}
+        self.default_model = default_model
+        self.prices = prices or {}
+        self.probe_every = max(int(probe_every), 1)
+        self.alpha = alpha
+        self._ewma = {} # (route, model) -> smoothed latency in seconds
+        self._degraded_calls = {} # route -> calls planned while its primary model was over budget
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _route(self, name):
+        return self.routes.get(name) or self.routes.get("default") or {}
+
+    def primary(self, call_type, model=None):
+        """Model a call type is routed to; model (the agent's MODEL_NAME) when its route names none."""
+        return self._route(route_name(call_type)).get("model") or model or self.default_model
+
+    def plan(self, call_type, model=None):
+        """(route, model, fallback, deadline) for a call. deadline is None unless a fallback can take over."""
+        name = route_name(call_type)
+        route = self._route(name)
+        primary = self.primary(call_type, model)
+        fallback = route.get("fallback") or None
+        if fallback == primary: fallback = None
+        budget = float(route.get("latency_budget") or 0)
+        if not budget or not fallback:
+            return name, primary, None, None
+        with self._lock:
+            slow = self._ewma.get((name, primary), 0.0) > budget
+            if slow:
+                self._degraded_calls[name] = self._degraded_calls.get(name, 0) + 1
+                if self._degraded_calls[name] % self.probe_every: # Not a probe: skip the slow model entirely
+                    return name, fallback, None, None
+        return name, primary, fallback, budget
+
+    def budget(self, name):
+        return float(self._route(name).get("latency_budget") or 0)
+
+    def record(self, name, model, latency, usage=None, prompt_chars=0, reply_text="", fallback=False,
+               deadline_fallback=False, error=False, expired=False):
+        """Accounts one finished call. usage is the response's usage (None for streamed replies).
+        expired marks a primary call abandoned at its latency budget: slow, but not a provider error."""
+        prompt_tokens = getattr(usage, "prompt_tokens", None)
+        completion_tokens = getattr(usage, "completion_tokens", None)
+        estimated = prompt_tokens is None
+        if estimated and not error and not expired:
+            prompt_tokens, completion_tokens = estimate_tokens(prompt_chars), estimate_tokens(len(reply_text or ""))
+        prompt_tokens, completion_tokens = prompt_tokens or 0, completion_tokens or 0
+        cached = min(cache_hit_tokens(usage), prompt_tokens)
+        price_in, price_out, price_cached = (list(self.prices.get(model) or ()) + [0.0, 0.0, None])[:3]
+        if price_cached is None: price_cached = price_in
+        budget = self.budget(name)
+        with self._lock:
+            stats = self._stats.setdefault(name, RouteStats())
+            stats.calls += 1
+            stats.models[model] = stats.models.get(model, 0) + 1
+            stats.total_latency += latency
+            stats.latencies.append(latency)
+            if fallback: stats.fallback_calls += 1
+            if deadline_fallback: stats.deadline_fallbacks += 1
+            if error: stats.errors += 1
+            if expired: stats.expired += 1
+            if budget and latency > budget: stats.over_budget += 1
+            if estimated and not error and not expired: stats.estimated_calls += 1
+            if not estimated: stats.measured_prompt_tokens += prompt_tokens
+            stats.prompt_tokens += prompt_tokens
+            stats.completion_tokens += completion_tokens
+            stats.cache_hit_tokens += cached
+            stats.cost += ((prompt_tokens - cached) * price_in + cached * price_cached + completion_tokens * price_out) / 1e6
+            key = (name, model)
+            previous = self._ewma.get(key)
+            self._ewma[key] = latency if previous is None else self.alpha * latency + (1 - self.alpha) * previous
+
+    def report(self):
+        with self._lock:
+            return {name: stats.report() for name, stats in self._stats.items()}
+
+
+_router = ModelRouter()
+
+
+def use_router(router):
+    """Replaces the process-wide router (a fresh one per simulation run)."""
+    global _router
+    _router = router
+
+
+def get_route_stats():
+    return _router.report()
+
+
+def is_deepseek(base_url):
+    return urlparse(base_url or "").hostname == urlparse(DEEPSEEK_BASE_URL).hostname
+
+
+def make_router(config):
+    routes = {name: dict(route or {}) for name, route in (config.get('LLM_ROUTES') or {}).items()}
+    if is_deepseek(config.get('LLM_BASE_URL', DEEPSEEK_BASE_URL)):
+        # Other endpoints may not serve deepseek-chat: there a route only falls back to the model it names
+        for route in routes.values(): route.setdefault("fallback", DEEPSEEK_FALLBACK)
+    router = ModelRouter(routes, config.get('MODEL_NAME', ""), config.get('LLM_MODEL_PRICES'))
+    for name, route in router.routes.items():
+        if name not in ROUTES and name != "default":
+            log.logger.warning(f"LLM_ROUTES: unknown route {name!r} is ignored (routes: {', '.join(ROUTES)}, default)")
+    use_router(router)
+    return router
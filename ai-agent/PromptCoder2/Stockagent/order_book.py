@@ -0,0 +1,120 @@
+import heapq
+import itertools
+from collections import deque
+
+
+class OrderBook:
+    """Price-level indexed limit order book for one stock.
+
+    Resting orders are grouped into FIFO queues keyed by exact price, so matching an
+    incoming order only touches the opposite queue at that price. Best bid/ask are kept
+    in heaps with lazy deletion of emptied levels (O(log n) insert / best-price lookup),
+    and fills at the front of a level are O(1).
+
+    Orders are the same action dicts produced by Agent.plan_stock
+    ({"action_type", "stock", "amount", "price", "agent", "date"}); partial fills mutate
+    "amount" in place exactly like the old list-based stock_deals did.
+    """
+
+    SIDES = ("buy", "sell")
+
+    def __init__(self):
+        self._levels = {"buy": {}, "sell": {}}   # side -> {price: deque[order]}
+        self._heaps = {"buy": [], "sell": []}    # buy: max-heap (negated), sell: min-heap
+        self._live = {"buy": {}, "sell": {}}     # side -> {seq: order}, arrival order
+        self._seq = itertools.count()
+        self._order_seq = {}                     # id(order) -> seq
+
+    def clear(self):
+        for side in self.SIDES:
+            self._levels[side].clear()
+            self._heaps[side].clear()
+            self._live[side].clear()
+        self._order_seq.clear()
+
+    def __len__(self):
+        return len(self._live["buy"]) + len(self._live["sell"])
+
+    def depth(self, side):
+        return len(self._live[side])
+
+    # --- Book maintenance ---
+    def add(self, order):
+        side = order["action_type"]
+        price = order["price"]
+        level = self._levels[side].get(price)
+        if level is None:
+            level = deque()
+            self._levels[side][price] = level
+            heapq.heappush(self._heaps[side], -price if side == "buy" else price)
+        level.append(order)
+        seq = next(self._seq)
+        self._order_seq[id(order)] = seq
+        self._live[side][seq] = order
+
+    def _pop_front(self, side, price):
+        level = self._levels[side][price]
+        order = level.popleft()
+        seq = self._order_seq.pop(id(order), None)
+        if seq is not None:
+            self._live[side].pop(seq, None)
+        if not level:
+            # Heap entry is dropped lazily by best_price()
+            del self._levels[side][price]
+        return order
+
+    def best_price(self, side):
+        heap = self._heaps[side]
+        levels = self._levels[side]
+        while heap:
+            price = -heap[0] if side == "buy" else heap[0]
+            if price in levels:
+                return price
+            heapq.heappop(heap)
+        return None
+
+    def best_bid(self):
+        return self.best_price("buy")
+
+    def best_ask(self):
+        return self.best_price("sell")
+
+    def level_amount(self, side, price):
+        return sum(o["amount"] for o in self._levels[side].get(price, ()))
+
+    def orders(self, side):
+        """Resting orders on one side in arrival order."""
+        return list(self._live[side].values())
+
+    def snapshot(self):
+        """Same shape as the old stock_deals dict ({"sell": [...], "buy": [...]}), used in prompts."""
+        return {"sell": self.orders("sell"), "buy": self.orders("buy")}
+
+    # --- Matching ---
+    def submit(self, order, on_fill=None):
+        """Match an incoming order against the opposite side at its exact price, then rest any remainder.
+
+        on_fill(incoming, resting, amount) is called once per fill, before amounts are updated.
+        Returns True if any remainder was added to the book.
+        """
+        side = order["action_type"]
+        opposite = "sell" if side == "buy" else "buy"
+        price = order["price"]
+        level = self._levels[opposite].get(price)
+
+        while level:
+            resting = level[0]
+            close_amount = min(order["amount"], resting["amount"])
+            if on_fill: on_fill(order, resting, close_amount)
+            if order["amount"] > close_amount:
+                self._pop_front(opposite, price); order["amount"] -= close_amount
+                level = self._levels[opposite].get(price)
+            else:
+                resting["amount"] -= close_amount
+                if resting["amount"] <= 0: self._pop_front(opposite, price)
+                return False
+
+        if order["amount"] > 0:
+            self.add(order)
+            return True
+        return False
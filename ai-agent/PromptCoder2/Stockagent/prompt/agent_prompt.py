@@ -289,4 +289,74 @@ NEXT_DAY_ESTIMATE_RETRY = NamedBlock(
     Return the result in json format, for example:
     {{"buy_A":"yes", "buy_B":"no", "sell_A":"yes", "sell_B": "no", "loan": "yes"}}
     """
-)
\ No newline at end of file
+)
+# Prefix-stable layout (PROMPT_LAYOUT = "prefix"): everything static goes into one system message that is
+# byte-identical for all agents of a character, the per-call numbers into a short trailing user message.
+
+TRADING_RULES_PROMPT = NamedBlock(
+    name="Trading Rules",
+    content="""
+    Each day you may be asked to decide on a loan, then to trade in several sessions, then to post on the forum
+    and to estimate your actions for the next day. Every request comes with your current situation.
+    Loans: the alternative types are 0. 22days, 1. 44days, 2. 66days, at the benchmark interest rates given
+    with each request. Use the number to select a loan type. The loan amount shall not exceed the maximum given.
+    Trading: decide whether to buy/sell shares of Company A or Company B, and how much to buy/sell and at what price.
+    You can refer to the current share price and the market to determine the price yourself, not the current share price.
+    The quantity must be an integer. We encourage you to buy and sell more. You can only answer one json action.
+    """
+)
+
+CHARACTER_PROMPT = NamedBlock(
+    name="Character",
+    content="""
+    Your character is {character}.
+    """
+)
+
+LOAN_STATE_PROMPT = NamedBlock(
+    name="Instruction",
+    content="""
+    It is the {date} day. You hold {stock_a} shares of Company A, {stock_b} shares of Company B,
+    Now you have {cash} dollars in cash and {debt} in your loan situation.
+    Benchmark interest rates of loan types 0, 1, 2: {loan_rate1}, {loan_rate2}, {loan_rate3}.
+    The loan amount shall not exceed {max_loan}.
+    Return the result as json, for example {{"loan": "yes", "loan_type": 2, "amount": 1000}}, or {{"loan" : "no"}}.
+    """
+)
+
+TRADE_STATE_PROMPT = NamedBlock(
+    name="Instruction",
+    content="""
+    It is the {time} trading session on the {date} day, and after the previous session,
+    the stock price of Company A is {stock_a_price} and the stock price of Company B is {stock_b_price}.
+    In the current session, the buy and sell order of stock A is {stock_a_deals},
+    and the buy and sell order of stock B is {stock_b_deals}
+    You currently hold {stock_a} shares of Company A, {stock_b} shares of Company B, and {cash} yuan in cash.
+    Return one json action, for example {{"action_type":"buy"|"sell", "stock":"A"|"B", amount: 100, price : 30.1}},
+    or {{"action_type" : "no"}}.
+    """
+)
+
+BATCH_TRADERS_PROMPT = NamedBlock(
+    name="Traders",
+    content="""
+    You are deciding for several independent traders at once. Each row of the table below is one trader:
+    agent_id | character | cash (yuan) | shares of Company A | shares of Company B
+    {agent_table}
+    """
+)
+
+BATCH_DECIDE_STOCK_PROMPT = NamedBlock(
+    name="Instruction",
+    content="""
+    It is the {time} trading session on the {date} day, and after the previous session,
+    the stock price of Company A is {stock_a_price} and the stock price of Company B is {stock_b_price}.
+    In the current session, the buy and sell order of stock A is {stock_a_deals},
+    and the buy and sell order of stock B is {stock_b_deals}
+    For every trader, decide in line with their character whether to buy/sell shares of Company A or Company B,
+    and how much to buy/sell and at what price. A trader can only buy with their own cash and sell shares they hold.
+    You can refer to the current share price and the market to determine the price yourself. The quantity must be an integer.
+    Return one json array with exactly one action per trader, keyed by agent_id, for example:
+    [{{"agent_id": 3, "action_type": "buy", "stock": "A", "amount": 100, "price": 30.1}}, {{"agent_id": 7, "action_type": "no"}}]
+    """
+)
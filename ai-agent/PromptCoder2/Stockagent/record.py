@@ -1,5 +1,380 @@
-import pandas as pd
+import array
+import csv
+import json
 import os
+import queue
+import threading
+import time
+from collections import deque
+
+import openpyxl
+import pandas as pd
+
+from run_store import new_run_id, open_store
+
+# Record tables: name -> (Excel file, [(column header, dtype)]). The headers are those of the old per-row Excel files.
+TABLES = {
+    "trades": ("res/trades.xlsx", [
+        ("Trading Day", "int64"), ("Trading Session", "int64"), ("Stock Symbol", "str"), ("Buyer ID", "int64"),
+        ("Seller ID", "int64"), ("Quantity", "int64"), ("Trade Price", "float64")]),
+    "stocks": ("res/stocks.xlsx", [
+        ("Trading Day", "int64"), ("Trading Session", "int64"),
+        ("Stock A Price (End of Session)", "float64"), ("Stock B Price (End of Session)", "float64")]),
+    "agent_day_record": ("res/agent_day_record.xlsx", [
+        ("Agent ID", "int64"), ("Trading Day", "int64"), ("Loan Taken?", "str"), ("Loan Type", "Int64"),
+        ("Loan Amount", "float64"), ("Next Day Est: Loan", "str"), ("Next Day Est: Buy A", "str"),
+        ("Next Day Est: Sell A", "str"), ("Next Day Est: Buy B", "str"), ("Next Day Est: Sell B", "str")]),
+    "agent_session_record": ("res/agent_session_record.xlsx", [
+        ("Agent ID", "int64"), ("Trading Day", "int64"), ("Trading Session", "int64"),
+        ("Total Assets (Before Trade)", "float64"), ("Cash (Before Trade)", "float64"),
+        ("Stock A Value (Before Trade)", "float64"), ("Stock B Value (Before Trade)", "float64"),
+        ("Order Type", "str"), ("Order Stock Symbol", "str"), ("Order Quantity", "int64"), ("Order Price", "float64")]),
+    "forum_posts": ("res/forum_posts.xlsx", [("Trading Day", "int64"), ("Agent ID", "int64"), ("Message", "str")]),
+}
+
+FORMATS = ("csv", "jsonl", "sqlite")
+_TYPECODES = {"int64": "q", "float64": "d"} # Numeric columns are buffered in arrays, the rest in lists
+
+
+def write_excel(frame, path):
+    """Writes a frame as an .xlsx file like frame.to_excel(path, index=False), streaming the rows.
+
+    openpyxl's write-only mode skips building a cell object per value, which made the end-of-run
+    export of a 1,000-agent run take longer than the simulation itself.
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Sheet1")
+    sheet.append(list(frame.columns))
+    for row in frame.astype(object).where(frame.notna(), None).itertuples(index=False, name=None):
+        sheet.append(row)
+    workbook.save(path)
+
+
+class RecordSink:
+    """Buffers record rows in typed columns and appends them in batches to one spill file per table.
+
+    Replaces the per-row read/concat/rewrite of the Excel files. Rows go to res/<run_id>/<table>.csv
+    (or .jsonl), with the Excel headers, every flush_rows rows per table and on flush(). Each run has
+    its own spill files, so they only ever hold that run's rows. export_excel() writes the .xlsx files
+    (res/<table>.xlsx) from them in one pass; close() does both at the end of a run, unless the run
+    recorded more than excel_max_rows rows (0: no limit), since writing .xlsx is slower than simulating
+    a large run. Nothing is read or written before the first flush.
+
+    With fmt "sqlite" the batches go to a RunStore instead, under run_id.
+    """
+
+    def __init__(self, fmt="csv", flush_rows=1000, tables=None, store=None, run_id=None, excel_max_rows=0):
+        self.fmt = fmt if fmt in FORMATS else "csv"
+        self.flush_rows = max(int(flush_rows), 1)
+        self.excel_max_rows = max(int(excel_max_rows or 0), 0)
+        self.tables = tables or TABLES
+        self.store = store if self.fmt == "sqlite" else None
+        self.run_id = run_id or new_run_id()
+        self._lock = threading.Lock()
+        self._buffers = {name: self._empty(columns) for name, (_, columns) in self.tables.items()}
+        self.stats = {"rows": 0, "flushes": 0, "exports": 0, "export_seconds": 0.0}
+        self.closed = False
+
+    @staticmethod
+    def _empty(columns):
+        return [array.array(_TYPECODES[dtype]) if dtype in _TYPECODES else [] for _, dtype in columns]
+
+    def spill_path(self, table):
+        excel = self.tables[table][0]
+        name = os.path.splitext(os.path.basename(excel))[0] + "." + self.fmt
+        return os.path.join(os.path.dirname(excel), self.run_id, name)
+
+    def append(self, table, row):
+        columns = self.tables[table][1]
+        if len(row) != len(columns): raise ValueError(f"{table}: expected {len(columns)} values, got {len(row)}")
+        # Convert every value first, so a bad one raises before any column grew and the columns stay aligned
+        values = [int(value) if dtype == "int64" else float(value) if dtype == "float64" else value
+                  for value, (_, dtype) in zip(row, columns)]
+        with self._lock:
+            buffers = self._buffers[table]
+            for buffer, value in zip(buffers, values):
+                buffer.append(value)
+            self.stats["rows"] += 1
+            if len(buffers[0]) >= self.flush_rows: self._flush(table)
+
+    def flush(self, table=None):
+        with self._lock:
+            for name in ([table] if table else self.tables):
+                self._flush(name)
+
+    def _flush(self, table):
+        buffers = self._buffers[table]
+        if not len(buffers[0]): return
+        rows = zip(*buffers)
+        if self.store is not None:
+            self.store.insert_many(table, self.run_id, rows) # One transaction per batch
+        else:
+            headers = [header for header, _ in self.tables[table][1]]
+            path = self.spill_path(table)
+            new = not os.path.isfile(path)
+            if new: os.makedirs(os.path.dirname(path), exist_ok=True)
+            if self.fmt == "csv":
+                with open(path, "a", newline="", encoding="utf-8") as f:
+                    writer = csv.writer(f)
+                    if new: writer.writerow(headers)
+                    writer.writerows(rows)
+            else:
+                with open(path, "a", encoding="utf-8") as f:
+                    f.writelines(json.dumps(dict(zip(headers, row))) + "\n" for row in rows)
+        self._buffers[table] = self._empty(self.tables[table][1])
+        self.stats["flushes"] += 1
+
+    def read(self, table):
+        """This run's spilled rows of the table (flush first for the buffered ones) as a DataFrame with its dtypes."""
+        if self.store is not None: return self.store.frame(table, self.run_id)
+        columns = self.tables[table][1]
+        headers = [header for header, _ in columns]
+        path = self.spill_path(table)
+        if not os.path.isfile(path) or not os.path.getsize(path):
+            frame = pd.DataFrame(columns=headers)
+        elif self.fmt == "csv":
+            frame = pd.read_csv(path, keep_default_na=False, na_values=[""])
+        else:
+            frame = pd.read_json(path, orient="records", lines=True, dtype=False)
+        frame = frame.reindex(columns=headers)
+        for header, dtype in columns:
+            if dtype == "int64": frame[header] = pd.to_numeric(frame[header]).astype("int64")
+            elif dtype == "float64": frame[header] = pd.to_numeric(frame[header]).astype("float64")
+            elif dtype == "Int64": frame[header] = pd.to_numeric(frame[header]).astype("Int64") # Nullable (no loan type)
+        return frame
+
+    def export_excel(self, tables=None):
+        """Flushes and writes each table's .xlsx in one pass. Returns the files written."""
+        written, start = [], time.perf_counter()
+        for table in tables or self.tables:
+            excel = self.tables[table][0]
+            with self._lock: # Safe during a run: rows appended meanwhile wait for the next flush
+                self._flush(table)
+                frame = self.read(table)
+            try:
+                if os.path.dirname(excel): os.makedirs(os.path.dirname(excel), exist_ok=True)
+                write_excel(frame, excel)
+                written.append(excel)
+            except Exception as e:
+                print(f"Error writing to Excel {excel}: {e}")
+        with self._lock:
+            self.stats["exports"] += 1
+            self.stats["export_seconds"] += time.perf_counter() - start
+        return written
+
+    def close(self, status="finished"):
+        """Exports the .xlsx files at the end of a run, once, and marks the run finished (or failed) in the store."""
+        if self.closed: return []
+        self.closed = True
+        if self.excel_max_rows and self.stats["rows"] > self.excel_max_rows:
+            self.flush()
+            print(f"Run {self.run_id} recorded {self.stats['rows']} rows (over {self.excel_max_rows}), .xlsx export skipped")
+            written = []
+        else:
+            written = self.export_excel()
+        if self.store is not None: self.store.finish_run(self.run_id, status)
+        return written
+
+    def report(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["buffered"] = {name: len(buffers[0]) for name, buffers in self._buffers.items()}
+        return stats
+
+
+_sink = RecordSink() # Touches no file until rows are flushed; each run replaces it (make_record_sink)
+
+
+def get_sink():
+    return _sink
+
+
+def use_sink(sink):
+    """Replaces the process-wide sink the record classes write to (a fresh one per simulation run)."""
+    global _sink
+    _sink = sink
+
+
+def make_record_sink(config, run_id=None):
+    fmt, store = config.get('RECORD_FORMAT', "csv"), None
+    run_id = run_id or new_run_id()
+    if fmt == "sqlite":
+        store = open_store(config.get('RECORD_STORE_PATH', "res/runs.sqlite"), TABLES)
+        store.start_run(run_id, config)
+    sink = RecordSink(fmt, config.get('RECORD_FLUSH_ROWS', 1000), store=store, run_id=run_id,
+                      excel_max_rows=config.get('RECORD_EXCEL_MAX_ROWS', 100000))
+    use_sink(sink)
+    return sink
+
+
+QUEUE_POLICIES = ("block", "spill")
+_BARRIER = object()
+
+
+class RecordWriter:
+    """Hands record rows to a background thread that appends them to the sink, off the simulation thread.
+
+    Rows go through a queue bounded to max_queue items. When it is full, policy "block" makes the
+    caller wait for room; "spill" keeps the row in an overflow list instead (memory is then unbounded,
+    the caller never waits), which the thread drains in order after the queue. barrier() returns once
+    every row handed over before it is in the spill files; close() also stops the thread and exports
+    the .xlsx files, and is safe to call more than once.
+    """
+
+    def __init__(self, sink, max_queue=10000, policy="block", batch_rows=500, window=200):
+        self.sink = sink
+        self.policy = policy if policy in QUEUE_POLICIES else "block"
+        self.batch_rows = max(int(batch_rows), 1)
+        self._queue = queue.Queue(maxsize=max(int(max_queue), 1))
+        self._overflow = [] # Rows that found the queue full (spill policy), or arrived while earlier ones wait here
+        self._overflow_lock = threading.Lock()
+        self._latencies = deque(maxlen=window) # Seconds per drained batch, for p95
+        self._stats_lock = threading.Lock()
+        self.stats = {"rows": 0, "batches": 0, "blocked_puts": 0, "blocked_seconds": 0.0, "spilled": 0,
+                      "peak_depth": 0, "barriers": 0, "errors": 0, "write_seconds": 0.0}
+        self.last_error = None
+        self.closed = False
+        self._thread = threading.Thread(target=self._run, name="record-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, table, row):
+        if self.closed: # Late rows (after close) are written on the caller's thread
+            self.sink.append(table, row)
+            return
+        self._put((table, row))
+
+    def _put(self, item, force_block=False):
+        with self._overflow_lock:
+            if self._overflow: # Keep order: nothing may overtake rows already spilled
+                self._overflow.append(item)
+                self._count(spilled=1)
+                return
+            try:
+                self._queue.put_nowait(item)
+                self._track_depth()
+                return
+            except queue.Full:
+                if self.policy == "spill" and not force_block:
+                    self._overflow.append(item)
+                    self._count(spilled=1)
+                    return
+        start = time.perf_counter()
+        self._queue.put(item)
+        self._track_depth()
+        self._count(blocked_puts=1, blocked_seconds=time.perf_counter() - start)
+
+    def _track_depth(self):
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            if depth > self.stats["peak_depth"]: self.stats["peak_depth"] = depth
+
+    def _count(self, **amounts):
+        with self._stats_lock:
+            for key, amount in amounts.items(): self.stats[key] += amount
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            with self._overflow_lock: # The queue is drained, so the overflow rows are next
+                if not self._queue.empty(): return []
+                batch, self._overflow = self._overflow, []
+            return batch
+        while len(batch) < self.batch_rows:
+            try: batch.append(self._queue.get_nowait())
+            except queue.Empty: break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if None in batch: # Stop marker from close(): write what came before it and what was spilled meanwhile
+                with self._overflow_lock:
+                    rest, self._overflow = self._overflow, []
+                self._handle(batch[:batch.index(None)] + rest)
+                return
+            self._handle(batch)
+
+    def _handle(self, batch):
+        start, rows = time.perf_counter(), 0
+        for item in batch:
+            if item[0] is _BARRIER:
+                self._write(self.sink.flush)
+                item[1].set()
+            elif self._write(self.sink.append, *item):
+                rows += 1
+        if rows:
+            elapsed = time.perf_counter() - start
+            self._latencies.append(elapsed)
+            self._count(rows=rows, batches=1, write_seconds=elapsed)
+
+    def _write(self, fn, *args):
+        try:
+            fn(*args)
+            return True
+        except Exception as e: # A bad row must not stop the writer; it is counted and reported
+            self.last_error = f"{type(e).__name__}: {e}"
+            self._count(errors=1)
+            print(f"Record writer error: {self.last_error}")
+            return False
+
+    def barrier(self, timeout=None):
+        """Waits until every row submitted so far is flushed to the spill files."""
+        if self.closed:
+            self.sink.flush()
+            return True
+        done = threading.Event()
+        self._put((_BARRIER, done), force_block=True)
+        self._count(barriers=1)
+        return done.wait(timeout)
+
+    def close(self, status="finished"):
+        """Drains the queue, stops the thread and exports the .xlsx files. Returns the files written."""
+        if not self.closed:
+            self.closed = True
+            self._put(None, force_block=True)
+            self._thread.join()
+        return self.sink.close(status)
+
+    def report(self):
+        recent = sorted(self._latencies)
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats.update(policy=self.policy, depth=self._queue.qsize(), max_queue=self._queue.maxsize,
+                     overflow=len(self._overflow), last_error=self.last_error,
+                     avg_write_latency=stats["write_seconds"] / stats["batches"] if stats["batches"] else 0.0,
+                     p95_write_latency=recent[int(0.95 * (len(recent) - 1))] if recent else 0.0)
+        return stats
+
+
+_writer = None
+
+
+def submit(table, row):
+    """Hands a row to the run's writer thread, or appends it to the sink directly when there is none."""
+    writer = _writer
+    if writer is not None: writer.submit(table, row)
+    else: get_sink().append(table, row)
+
+
+def get_writer_stats():
+    return _writer.report() if _writer is not None else {}
+
+
+def make_record_writer(config, run_id=None):
+    """The run's record sink behind a writer thread (RECORD_QUEUE_SIZE 0: written on the caller's thread)."""
+    global _writer
+    sink = make_record_sink(config, run_id)
+    size = int(config.get('RECORD_QUEUE_SIZE', 10000) or 0)
+    _writer = RecordWriter(sink, size, config.get('RECORD_QUEUE_POLICY', "block")) if size > 0 else None
+    return _writer
+
+
+def close_record_writer(status="finished"):
+    """Drains and closes the run's writer and exports its sink; returns [] if that already happened."""
+    writer = _writer
+    return writer.close(status) if writer is not None else get_sink().close(status)
+
 
 # Trade Record
 class TradeRecord:
@@ -12,34 +387,12 @@ class TradeRecord:
         self.quantity = quantity
         self.price = price
 
-    def write_to_excel(self, file_name="res/trades.xlsx"):
-        columns = ["Trading Day", "Trading Session", "Stock Symbol", "Buyer ID", "Seller ID", "Quantity", "Trade Price"]
-        if os.path.isfile(file_name):
-            try:
-                existing_df = pd.read_excel(file_name)
-                if not all(col in existing_df.columns for col in columns) or len(existing_df.columns) != len(columns):
-                    print(f"Columns mismatch in {file_name}, data structure might have changed. Overwriting with new structure.")
-                    existing_df = pd.DataFrame(columns=columns) # Reinitialize to ensure correct structure
-            except Exception as e:
-                print(f"Error reading existing Excel {file_name}: {e}. Creating new DataFrame.")
-                existing_df = pd.DataFrame(columns=columns)
-        else:
-            existing_df = pd.DataFrame(columns=columns)
-
-        new_records_data = [[self.date, self.session, self.stock_type, self.buyer, self.seller, self.quantity, self.price]]
-        
-        # Ensure new_df has the correct columns from the start
-        new_df = pd.DataFrame(new_records_data, columns=columns)
+    def row(self):
+        return [self.date, self.session, self.stock_type, self.buyer, self.seller, self.quantity, self.price]
 
-        if existing_df.empty:
-            all_records_df = new_df
-        else:
-            all_records_df = pd.concat([existing_df, new_df], ignore_index=True)
-        
-        try:
-            all_records_df.to_excel(file_name, index=False)
-        except Exception as e:
-            print(f"Error writing to Excel {file_name}: {e}")
+    def write_to_excel(self):
+        # Handed to the record writer; res/trades.xlsx is written when the sink is exported
+        submit("trades", self.row())
 
 
 def create_trade_record(date, stage, stock, buy_trader, sell_trader, amount, price):
@@ -55,32 +408,11 @@ class StockRecord:
         self.stock_a_price = stock_a_price
         self.stock_b_price = stock_b_price
 
-    def write_to_excel(self, file_name="res/stocks.xlsx"):
-        columns = ["Trading Day", "Trading Session", "Stock A Price (End of Session)", "Stock B Price (End of Session)"]
-        if os.path.isfile(file_name):
-            try:
-                existing_df = pd.read_excel(file_name)
-                if not all(col in existing_df.columns for col in columns) or len(existing_df.columns) != len(columns):
-                    print(f"Columns mismatch in {file_name}, data structure might have changed. Overwriting with new structure.")
-                    existing_df = pd.DataFrame(columns=columns)
-            except Exception as e:
-                print(f"Error reading existing Excel {file_name}: {e}. Creating new DataFrame.")
-                existing_df = pd.DataFrame(columns=columns)
-        else:
-            existing_df = pd.DataFrame(columns=columns)
-
-        new_records_data = [[self.date, self.session, self.stock_a_price, self.stock_b_price]]
-        new_df = pd.DataFrame(new_records_data, columns=columns)
+    def row(self):
+        return [self.date, self.session, self.stock_a_price, self.stock_b_price]
 
-        if existing_df.empty:
-            all_records_df = new_df
-        else:
-            all_records_df = pd.concat([existing_df, new_df], ignore_index=True)
-            
-        try:
-            all_records_df.to_excel(file_name, index=False)
-        except Exception as e:
-            print(f"Error writing to Excel {file_name}: {e}")
+    def write_to_excel(self):
+        submit("stocks", self.row())
 
 def create_stock_record(date, session, stock_a_price, stock_b_price):
     record = StockRecord(date, session, stock_a_price, stock_b_price)
@@ -96,7 +428,7 @@ class AgentRecordDaily:
         self.loan_type = None # Initialize to None
         self.loan_amount = 0
         if self.if_loan == "yes":
-            self.loan_type = loan_json.get("loan_type") 
+            self.loan_type = loan_json.get("loan_type")
             self.loan_amount = loan_json.get("amount", 0)
         self.will_loan = "no"
         self.will_buy_a = "no"
@@ -125,37 +457,12 @@ class AgentRecordDaily:
             "will_sell_b": self.will_sell_b
         }
 
-    def write_to_excel(self, file_name="res/agent_day_record.xlsx"):
-        columns = ["Agent ID", "Trading Day", "Loan Taken?", "Loan Type", "Loan Amount",
-                   "Next Day Est: Loan", "Next Day Est: Buy A", "Next Day Est: Sell A", "Next Day Est: Buy B", "Next Day Est: Sell B"]
-        if os.path.isfile(file_name):
-            try:
-                existing_df = pd.read_excel(file_name)
-                if not all(col in existing_df.columns for col in columns) or len(existing_df.columns) != len(columns):
-                    print(f"Columns mismatch in {file_name}, data structure might have changed. Overwriting with new structure.")
-                    existing_df = pd.DataFrame(columns=columns)
-            except Exception as e:
-                print(f"Error reading existing Excel {file_name}: {e}. Creating new DataFrame.")
-                existing_df = pd.DataFrame(columns=columns)
-        else:
-            existing_df = pd.DataFrame(columns=columns)
-
-        new_records_data = [self.agent, self.date, self.if_loan, self.loan_type, self.loan_amount,
-                            self.will_loan, self.will_buy_a, self.will_sell_a, self.will_buy_b, self.will_sell_b]
-        
-        new_df = pd.DataFrame([new_records_data], columns=columns)
-        
-        if existing_df.empty:
-            all_records_df = new_df
-        else:
-            # Ensure data types are compatible if possible, though concat usually handles it.
-            # For simplicity, direct concat is used. For robust production, you might want dtype checks/coercion.
-            all_records_df = pd.concat([existing_df, new_df], ignore_index=True)
-            
-        try:
-            all_records_df.to_excel(file_name, index=False)
-        except Exception as e:
-            print(f"Error writing to Excel {file_name}: {e}")
+    def row(self):
+        return [self.agent, self.date, self.if_loan, self.loan_type, self.loan_amount,
+                self.will_loan, self.will_buy_a, self.will_sell_a, self.will_buy_b, self.will_sell_b]
+
+    def write_to_excel(self):
+        submit("agent_day_record", self.row())
 
 
 class AgentRecordSession:
@@ -176,40 +483,20 @@ class AgentRecordSession:
             self.amount = action_json.get("amount", 0)
             self.price = action_json.get("price", 0)
 
-    def write_to_excel(self, file_name="res/agent_session_record.xlsx"):
-        columns = ["Agent ID", "Trading Day", "Trading Session", "Total Assets (Before Trade)",
-                   "Cash (Before Trade)", "Stock A Value (Before Trade)", "Stock B Value (Before Trade)",
-                   "Order Type", "Order Stock Symbol", "Order Quantity", "Order Price"]
-        if os.path.isfile(file_name):
-            try:
-                existing_df = pd.read_excel(file_name)
-                if not all(col in existing_df.columns for col in columns) or len(existing_df.columns) != len(columns):
-                    print(f"Columns mismatch in {file_name}, data structure might have changed. Overwriting with new structure.")
-                    existing_df = pd.DataFrame(columns=columns)
-            except Exception as e:
-                print(f"Error reading existing Excel {file_name}: {e}. Creating new DataFrame.")
-                existing_df = pd.DataFrame(columns=columns)
-        else:
-            existing_df = pd.DataFrame(columns=columns)
+    def row(self):
+        return [self.agent, self.date, self.session, self.proper, self.cash,
+                self.stock_a_value, self.stock_b_value, self.action_type, self.action_stock,
+                self.amount, self.price]
 
-        new_records_data = [self.agent, self.date, self.session, self.proper, self.cash,
-                            self.stock_a_value, self.stock_b_value, self.action_type, self.action_stock,
-                            self.amount, self.price]
-        
-        new_df = pd.DataFrame([new_records_data], columns=columns)
-
-        if existing_df.empty:
-            all_records_df = new_df
-        else:
-            all_records_df = pd.concat([existing_df, new_df], ignore_index=True)
-            
-        try:
-            all_records_df.to_excel(file_name, index=False)
-        except Exception as e:
-            print(f"Error writing to Excel {file_name}: {e}")
+    def write_to_excel(self):
+        submit("agent_session_record", self.row())
 
 
 def create_agentses_record(agent, date, session, proper, cash, stock_a_value, stock_b_value, action_json):
     record = AgentRecordSession(agent, date, session, proper, cash, stock_a_value, stock_b_value, action_json)
     record.write_to_excel()
     record = None # Optional
+
+
+def create_forum_record(date, agent, message):
+    submit("forum_posts", [date, agent, message if isinstance(message, str) else json.dumps(message)])
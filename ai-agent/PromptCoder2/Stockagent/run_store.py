@@ -0,0 +1,137 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import pandas as pd
+
+# SQL column names per record table, in the order of record.TABLES (the Excel headers)
+COLUMNS = {
+    "trades": ["day", "session", "stock", "buyer", "seller", "quantity", "price"],
+    "stocks": ["day", "session", "price_a", "price_b"],
+    "agent_day_record": ["agent", "day", "loan", "loan_type", "loan_amount",
+                         "est_loan", "est_buy_a", "est_sell_a", "est_buy_b", "est_sell_b"],
+    "agent_session_record": ["agent", "day", "session", "total_assets", "cash", "stock_a_value", "stock_b_value",
+                             "order_type", "order_stock", "order_quantity", "order_price"],
+    "forum_posts": ["day", "agent", "message"],
+}
+INDEXES = {
+    "trades": [("day", "session"), ("buyer",), ("seller",)],
+    "stocks": [("day", "session")],
+    "agent_day_record": [("day",), ("agent", "day")],
+    "agent_session_record": [("day", "session"), ("agent", "day", "session")],
+    "forum_posts": [("day",), ("agent",)],
+}
+_SQL_TYPES = {"int64": "INTEGER", "Int64": "INTEGER", "float64": "REAL"} # Anything else is TEXT
+
+
+def new_run_id():
+    return time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+
+
+class RunStore:
+    """SQLite store of every run's records, keyed by run id.
+
+    One table per record table (see record.TABLES) with a leading run_id column, indexed on
+    (run, day, session) and (run, agent), plus a runs table with each run's config and status.
+    The database is in WAL mode so the app can query it while a simulation writes; rows arrive
+    in batches, one transaction per insert_many().
+    """
+
+    def __init__(self, path, tables):
+        self.path = path
+        self.tables = tables
+        directory = os.path.dirname(path)
+        if directory: os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS runs (run_id TEXT PRIMARY KEY, started_at TEXT, "
+                               "finished_at TEXT, status TEXT, config TEXT)")
+            for table, (_, columns) in tables.items():
+                names = COLUMNS[table]
+                fields = ", ".join(f"{name} {_SQL_TYPES.get(dtype, 'TEXT')}" for name, (_, dtype) in zip(names, columns))
+                self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (run_id TEXT NOT NULL, {fields})")
+                for index in INDEXES.get(table, ()):
+                    self._conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_{'_'.join(index)} "
+                                       f"ON {table} (run_id, {', '.join(index)})")
+
+    def start_run(self, run_id, config=None):
+        config = {key: value for key, value in (config or {}).items() if "API_KEY" not in key} # No secrets on disk
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO runs VALUES (?, ?, NULL, 'running', ?)",
+                               (run_id, time.strftime("%Y-%m-%d %H:%M:%S"), json.dumps(config, default=str)))
+
+    def finish_run(self, run_id, status="finished"):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE runs SET finished_at = ?, status = ? WHERE run_id = ?",
+                               (time.strftime("%Y-%m-%d %H:%M:%S"), status, run_id))
+
+    def insert_many(self, table, run_id, rows):
+        """Inserts rows (tuples in COLUMNS order) in one transaction."""
+        names = COLUMNS[table]
+        sql = f"INSERT INTO {table} (run_id, {', '.join(names)}) VALUES ({', '.join('?' * (len(names) + 1))})"
+        with self._lock, self._conn:
+            self._conn.executemany(sql, ((run_id, *row) for row in rows))
+
+    def query(self, sql, params=()):
+        with self._lock:
+            return pd.read_sql_query(sql, self._conn, params=params)
+
+    def has_run(self, run_id):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM runs WHERE run_id = ?", (run_id,)).fetchone() is not None
+
+    def runs(self):
+        return self.query("SELECT run_id, started_at, finished_at, status FROM runs ORDER BY started_at")
+
+    def frame(self, table, run_id, headers=True):
+        """A run's rows of a record table, with the Excel headers (or the SQL names) and record dtypes."""
+        columns = self.tables[table][1]
+        frame = self.query(f"SELECT {', '.join(COLUMNS[table])} FROM {table} WHERE run_id = ? ORDER BY rowid", (run_id,))
+        for name, (_, dtype) in zip(COLUMNS[table], columns):
+            if dtype in _SQL_TYPES: frame[name] = pd.to_numeric(frame[name]).astype(dtype)
+        if headers: frame.columns = [header for header, _ in columns]
+        return frame
+
+    def agent_history(self, run_id, agent, first_day=None, last_day=None):
+        """An agent's assets before each trading session in a day range, with P&L against the first row."""
+        first_day = 1 if first_day is None else first_day
+        last_day = 2 ** 31 if last_day is None else last_day
+        frame = self.query(
+            "SELECT day, session, total_assets, cash, stock_a_value, stock_b_value, order_type, order_stock, "
+            "order_quantity, order_price FROM agent_session_record "
+            "WHERE run_id = ? AND agent = ? AND day BETWEEN ? AND ? ORDER BY day, session",
+            (run_id, agent, first_day, last_day))
+        frame["pnl"] = frame["total_assets"] - frame["total_assets"].iloc[0] if len(frame) else []
+        return frame
+
+    def export_excel(self, run_id, directory="res"):
+        """Writes a run's record tables as .xlsx files (the old file names and headers) under directory."""
+        os.makedirs(directory, exist_ok=True)
+        written = []
+        for table, (excel, _) in self.tables.items():
+            path = os.path.join(directory, os.path.basename(excel))
+            self.frame(table, run_id).to_excel(path, index=False)
+            written.append(path)
+        return written
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def open_store(path, tables):
+    """The process's RunStore for path (one connection shared by the writer thread and the app)."""
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None: store = _stores[path] = RunStore(path, tables)
+        return store
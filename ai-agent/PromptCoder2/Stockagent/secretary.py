@@ -1,36 +1,64 @@
 import json
+import math
 import os
+import threading
+from collections import Counter
 import openai # Keep for type hints if used, actual client created in methods
 from log.custom_logger import log
-
-# DEEPSEEK_BASE_URL can be a constant here
-DEEPSEEK_BASE_URL = "https://api.deepseek.com/v1"
+from json_repair import repair_json_object, as_number, as_yes_no
+import llm_gateway
+from llm_gateway import DEEPSEEK_BASE_URL # Shared with Agent through the gateway
 
 # run_api is now instance method or part of Agent, Secretary will use its own.
 # For Secretary's internal use (if any independent calls were made, though not apparent in original):
-def _secretary_run_api(model, prompt, api_key, temperature: float = 0):
-    if not api_key:
+def _secretary_run_api(model, prompt, api_key, temperature: float = 0, base_url=DEEPSEEK_BASE_URL):
+    if not api_key and not llm_gateway.replaying():
         log.logger.error("Secretary: DEEPSEEK_API_KEY not provided for API call.")
         return None
     try:
-        client = openai.OpenAI(api_key=api_key, base_url=DEEPSEEK_BASE_URL)
-        response = client.chat.completions.create(
-            model=model, messages=[{"role": "user", "content": prompt}], temperature=temperature,
+        response = llm_gateway.chat_completion(
+            api_key, base_url, model=model, messages=[{"role": "user", "content": prompt}], temperature=temperature,
         )
         return response.choices[0].message.content
     except Exception as e:
         log.logger.error(f"Secretary: DeepSeek API Error: {e}")
         return None
 
+# Local repair of rejected responses (see Secretary._repair): every response it rescues is one
+# *_RETRY_PROMPT round trip saved. Counted per rule that fired, process-wide like llm_gateway's stats.
+_repair_lock = threading.Lock()
+_repair_stats = {"saved": 0, "unrepairable": 0}
+_repair_rules = Counter()
+
+
+def get_repair_stats():
+    with _repair_lock:
+        stats = dict(_repair_stats)
+        stats["by_rule"] = dict(_repair_rules)
+    return stats
+
+
+def _match_keys(parsed, expected, rules):
+    # Maps keys case/space-insensitively onto the expected names; unknown keys are kept for the checks to judge
+    lookup = {k.lower().replace(" ", "_"): k for k in expected}
+    out = {}
+    for key, value in parsed.items():
+        name = lookup.get(str(key).strip().lower().replace(" ", "_"), key)
+        if name != key: rules.add("key_case")
+        out[name] = value
+    return out
+
+
 class Secretary:
-    def __init__(self, model: str, api_key: str): # Takes model and API key
+    def __init__(self, model: str, api_key: str, base_url: str = DEEPSEEK_BASE_URL): # Takes model and API key
         self.model = model
         self.api_key = api_key # Store API key
+        self.base_url = base_url or DEEPSEEK_BASE_URL # Any OpenAI-compatible endpoint
         log.logger.info(f"Secretary initialized with model: {self.model}")
 
     def get_response(self, prompt): # This could be used if Secretary makes its own calls
         log.logger.debug(f"Secretary sending prompt to model {self.model}: '{prompt[:100]}...'")
-        response = _secretary_run_api(self.model, prompt, self.api_key) # Use stored key and model
+        response = _secretary_run_api(self.model, prompt, self.api_key, base_url=self.base_url) # Use stored key and model
         if response is None:
             log.logger.warning(f"Secretary received no response from _secretary_run_api for model {self.model}.")
             return "{}"
@@ -38,7 +66,13 @@ class Secretary:
         return response
 
     # Added num_loan_types parameter for validation
-    def check_loan(self, resp, max_loan, num_loan_types) -> (bool, str, dict):
+    def check_loan(self, resp, max_loan, num_loan_types, repair=True) -> (bool, str, dict):
+        ok, fail_response, loan = self._strict_check_loan(resp, max_loan, num_loan_types)
+        if ok or not repair: return ok, fail_response, loan
+        return self._repair(resp, fail_response, lambda parsed, rules: self._fix_loan(parsed, rules, max_loan, num_loan_types),
+                            lambda fixed: self._strict_check_loan(fixed, max_loan, num_loan_types))
+
+    def _strict_check_loan(self, resp, max_loan, num_loan_types) -> (bool, str, dict):
         if not resp or not isinstance(resp, str):
             log.logger.debug(f"check_loan received invalid response: {resp}")
             return False, "Invalid or empty response from API.", {} # Return empty dict for loan
@@ -96,8 +130,15 @@ class Secretary:
             return False, f"Unexpected validation error: {e}", {}
 
 
-    def check_action(self, resp, cash, stock_a_amount, 
-                     stock_b_amount, stock_a_price, stock_b_price) -> (bool, str, dict):
+    def check_action(self, resp, cash, stock_a_amount,
+                     stock_b_amount, stock_a_price, stock_b_price, repair=True) -> (bool, str, dict):
+        ok, fail_response, action = self._strict_check_action(resp, cash, stock_a_amount, stock_b_amount, stock_a_price, stock_b_price)
+        if ok or not repair: return ok, fail_response, action
+        return self._repair(resp, fail_response, lambda parsed, rules: self._fix_action(parsed, rules, cash, stock_a_amount, stock_b_amount),
+                            lambda fixed: self._strict_check_action(fixed, cash, stock_a_amount, stock_b_amount, stock_a_price, stock_b_price))
+
+    def _strict_check_action(self, resp, cash, stock_a_amount,
+                             stock_b_amount, stock_a_price, stock_b_price) -> (bool, str, dict):
         if not resp or not isinstance(resp, str):
             return False, "Invalid or empty response from API.", {}
 
@@ -156,7 +197,12 @@ class Secretary:
             return False, f"Unexpected validation error: {e}", {}
 
 
-    def check_estimate(self, resp) -> (bool, str, dict):
+    def check_estimate(self, resp, repair=True) -> (bool, str, dict):
+        ok, fail_response, estimate = self._strict_check_estimate(resp)
+        if ok or not repair: return ok, fail_response, estimate
+        return self._repair(resp, fail_response, self._fix_estimate, self._strict_check_estimate)
+
+    def _strict_check_estimate(self, resp) -> (bool, str, dict):
         if not resp or not isinstance(resp, str):
             return False, "Invalid or empty response from API.", {}
 
@@ -187,3 +233,85 @@ class Secretary:
         except Exception as e:
             log.logger.error(f"Unexpected error during estimate content validation: {e}. JSON: {parsed_json}")
             return False, f"Unexpected validation error: {e}", {}
+
+
+    # --- Local repair before any re-prompt ---
+    def _repair(self, resp, fail_response, fix, strict_check):
+        """Recovers a rejected response without asking the model again.
+
+        Extracts the JSON object (json_repair.repair_json_object), normalizes and clamps it with
+        fix(parsed, rules), then runs the unchanged strict check on the result. Only if that still
+        fails does the caller re-prompt, with the original failure message.
+        """
+        parsed, parse_rules = repair_json_object(resp)
+        rules = set(parse_rules)
+        fixed = fix(parsed, rules) if parsed is not None else None
+        if fixed is not None:
+            ok, _, result = strict_check(json.dumps(fixed))
+            if ok:
+                with _repair_lock:
+                    _repair_stats["saved"] += 1
+                    _repair_rules.update(rules)
+                log.logger.info(f"Secretary repaired response locally ({', '.join(sorted(rules)) or 'no-op'}): {result}")
+                return True, "", result
+        with _repair_lock:
+            _repair_stats["unrepairable"] += 1
+        return False, fail_response, {}
+
+    def _fix_loan(self, parsed, rules, max_loan, num_loan_types):
+        loan = _match_keys(parsed, ("loan", "loan_type", "amount"), rules)
+        decision = as_yes_no(loan.get("loan"))
+        if decision is None: return None
+        if decision != loan.get("loan"): rules.add("coerce_type")
+        if decision == "no":
+            if len(loan) > 1: rules.add("dropped_extra_keys")
+            return {"loan": "no"}
+        loan_type, amount = as_number(loan.get("loan_type")), as_number(loan.get("amount"))
+        if loan_type is None or amount is None or amount <= 0 or num_loan_types <= 0 or max_loan <= 0: return None
+        if type(loan.get("loan_type")) is not int or type(loan.get("amount")) not in (int, float): rules.add("coerce_type")
+        # An unknown loan product goes back to the model; only the amount is clamped
+        if not float(loan_type).is_integer() or not 0 <= int(loan_type) < num_loan_types: return None
+        if amount > max_loan:
+            amount = max_loan
+            rules.add("clamp_amount")
+        if len(loan) > 3: rules.add("dropped_extra_keys")
+        return {"loan": "yes", "loan_type": int(loan_type), "amount": amount}
+
+    def _fix_action(self, parsed, rules, cash, stock_a_amount, stock_b_amount):
+        action = _match_keys(parsed, ("action_type", "stock", "amount", "price"), rules)
+        action_type = str(action.get("action_type", "")).strip().lower()
+        if action_type not in ("buy", "sell", "no"): return None
+        if action_type == "no":
+            if len(action) > 1: rules.add("dropped_extra_keys")
+            return {"action_type": "no"}
+        stock = str(action.get("stock", "")).strip().upper().replace("STOCK", "").strip()
+        amount, price = as_number(action.get("amount")), as_number(action.get("price"))
+        if stock not in ("A", "B") or amount is None or price is None or price <= 0: return None
+        if stock != action.get("stock") or type(action.get("amount")) is not int or type(action.get("price")) not in (int, float): rules.add("coerce_type")
+        if not isinstance(amount, int): amount = int(math.floor(amount))
+        # Clamp to what the agent can actually trade; an order that clamps to nothing is not repaired
+        if action_type == "buy":
+            affordable = int(cash // price) if cash > 0 else 0
+            while affordable > 0 and affordable * price > cash: affordable -= 1
+            limit = affordable
+        else:
+            limit = stock_a_amount if stock == "A" else stock_b_amount
+        if amount > limit:
+            amount = limit
+            rules.add("clamp_amount")
+        if amount <= 0: return None
+        if len(action) > 4: rules.add("dropped_extra_keys")
+        return {"action_type": action_type, "stock": stock, "amount": amount, "price": price}
+
+    def _fix_estimate(self, parsed, rules):
+        expected = ("buy_A", "buy_B", "sell_A", "sell_B", "loan")
+        estimate = _match_keys(parsed, expected, rules)
+        fixed = {}
+        for key in expected:
+            if key not in estimate: return None
+            value = as_yes_no(estimate[key])
+            if value is None: return None
+            if value != estimate[key]: rules.add("coerce_type")
+            fixed[key] = value
+        if len(estimate) > len(expected): rules.add("dropped_extra_keys")
+        return fixed
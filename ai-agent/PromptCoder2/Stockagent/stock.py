@@ -1,4 +1,6 @@
 # import util # No longer directly used for FINANCIAL_REPORTS
+from order_book import OrderBook
+from tick_store import TickStore
 
 class Stock:
     def __init__(self, name, initial_price, initial_stock, is_new=False, config=None): # Added config
@@ -6,8 +8,9 @@ class Stock:
         self.price = initial_price
         self.ideal_price = 0 # What is this used for?
         self.initial_stock = initial_stock # Is this used?
-        self.history = {}   # {date: session_deal}
-        self.session_deal = [] # [{"price", "amount"}]
+        self.ticks = TickStore() # Full trade tape with per-session/per-day OHLCV bars
+        self._session_start = 0 # Tape index where the current session's trades begin
+        self.order_book = OrderBook() # Resting buy/sell orders, cleared every day
         self.config = config # Store config
 
     def gen_financial_report(self, index):
@@ -27,17 +30,34 @@ class Stock:
         return f"Configuration not available for Stock {self.name} financial reports."
 
 
-    def add_session_deal(self, price_and_amount):
-        self.session_deal.append(price_and_amount)
+    def add_session_deal(self, price_and_amount, date=0, session=0):
+        self.ticks.append(date, session, price_and_amount["price"], price_and_amount["amount"])
 
-    def update_price(self, date):
-        if len(self.session_deal) == 0:
+    @property
+    def session_deal(self):
+        # [{"price", "amount"}] for trades since the last update_price, built from the tape
+        lo = self._session_start
+        return [{"price": p, "amount": a} for p, a in zip(self.ticks.price[lo:].tolist(), self.ticks.quantity[lo:].tolist())]
+
+    @property
+    def history(self):
+        # {date: [{"price", "amount"}]} covering every session of the day, built from the tape
+        history = {}
+        for day, price, amount in zip(self.ticks.day.tolist(), self.ticks.price.tolist(), self.ticks.quantity.tolist()):
+            history.setdefault(day, []).append({"price": price, "amount": amount})
+        return history
+
+    def update_price(self, date, clearing_price=None):
+        if clearing_price is not None:
+            # Call auction sessions settle every fill at one uniform price
+            self.price = clearing_price
+        last_price = self.ticks.last_price(since=self._session_start)
+        if last_price is None:
             # Optional: implement price decay or stability if no trades
             return
-        self.price = self.session_deal[-1]["price"]
-        # Storing a copy of session_deal for history
-        self.history[date] = list(self.session_deal) # Store a copy
-        self.session_deal.clear()
+        if clearing_price is None:
+            self.price = last_price
+        self._session_start = len(self.ticks)
 
     def get_price(self):
         return self.price
@@ -0,0 +1,358 @@
+"""Local OpenAI-compatible chat.completions server for load and fault testing.
+
+Point the simulation at it instead of DeepSeek with LLM_BASE_URL (or `python main.py --base-url`):
+
+    python stub_llm_server.py --port 8001 --latency lognormal:0.8:0.5 --rate-429 0.05 --rate-malformed 0.1
+    python main.py --base-url http://127.0.0.1:8001/v1
+
+Replies are plausible answers to the agent prompts (loan, trade, estimate, forum), parsed from the
+last user message, so Secretary accepts them unless a malformed reply is injected on purpose.
+Counters are served at GET /stats. From Python, StubLLMServer(...).start() returns the base URL.
+Usage includes prompt_cache_hit_tokens from a simulated prefix cache (whole 256-character blocks of the
+request already seen in an earlier request), to measure prompt layouts.
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from log.custom_logger import log
+
+MALFORMED_KINDS = ("trailing_comma", "truncated", "two_blocks", "single_quotes", "prose_only")
+CACHE_BLOCK_CHARS = 256 # Prefix cache granularity, about 64 tokens like DeepSeek's context cache
+
+
+def parse_latency(spec):
+    """Latency spec -> sampler(rng) returning seconds.
+
+    "fixed:S", "uniform:LO:HI", "normal:MEAN:SD", "lognormal:MEDIAN:SIGMA", "exponential:MEAN".
+    """
+    if spec is None or spec == "":
+        return lambda rng: 0.0
+    name, *args = str(spec).split(":")
+    args = [float(a) for a in args]
+    if name == "fixed" and len(args) == 1: return lambda rng: args[0]
+    if name == "uniform" and len(args) == 2: return lambda rng: rng.uniform(args[0], args[1])
+    if name == "normal" and len(args) == 2: return lambda rng: max(0.0, rng.gauss(args[0], args[1]))
+    if name == "lognormal" and len(args) == 2: return lambda rng: args[0] * rng.lognormvariate(0.0, args[1])
+    if name == "exponential" and len(args) == 1: return lambda rng: rng.expovariate(1.0 / args[0]) if args[0] > 0 else 0.0
+    raise ValueError(f"Unsupported latency spec: {spec}")
+
+
+def _number(pattern, text, default=None):
+    match = re.search(pattern, text)
+    if not match: return default
+    try: return float(match.group(1))
+    except ValueError: return default
+
+
+def classify(prompt):
+    """Which agent call a prompt belongs to: loan, trade, trade_batch, estimate, forum or retry."""
+    if "agent_id |" in prompt: return "trade_batch"
+    if "questions appeared in the" in prompt or "Please answer again" in prompt: return "retry"
+    if "action_type" in prompt: return "trade"
+    if "buy_A" in prompt: return "estimate"
+    if '"loan"' in prompt: return "loan"
+    return "forum"
+
+
+def reply_for(prompt, rng):
+    """A well-formed answer to one agent prompt, using the numbers in the prompt."""
+    kind = classify(prompt)
+    if kind == "loan":
+        max_loan = _number(r"shall not exceed (-?[\d.]+(?:e[+-]?\d+)?)", prompt, 0.0)
+        if max_loan <= 0 or rng.random() < 0.6: return json.dumps({"loan": "no"})
+        return json.dumps({"loan": "yes", "loan_type": rng.randrange(3), "amount": round(max_loan * rng.uniform(0.05, 0.3), 2)})
+    prices = {"A": _number(r"Company A is ([\d.]+)", prompt), "B": _number(r"Company B is ([\d.]+)", prompt)}
+    if kind == "trade":
+        holdings = {"A": _number(r"hold (\d+) shares of Company A", prompt, 0), "B": _number(r"(\d+) shares of Company B, and", prompt, 0)}
+        cash = _number(r"and ([\d.]+(?:e[+-]?\d+)?) yuan in cash", prompt, 0.0)
+        return json.dumps(_trade(prices, holdings, cash, rng))
+    if kind == "trade_batch": # One row per trader: agent_id | character | cash | A shares | B shares
+        rows = re.findall(r"^\s*(\d+) \| [\w-]+ \| ([\d.]+) \| (\d+) \| (\d+)\s*$", prompt, re.M)
+        return json.dumps([dict(agent_id=int(agent_id), **_trade(prices, {"A": float(a), "B": float(b)}, float(cash), rng))
+                           for agent_id, cash, a, b in rows])
+    if kind == "estimate":
+        return json.dumps({key: rng.choice(("yes", "no")) for key in ("buy_A", "buy_B", "sell_A", "sell_B", "loan")})
+    if kind == "retry":
+        if "action_type" in prompt: return json.dumps({"action_type": "no"})
+        if '"loan"' in prompt and "buy_A" not in prompt: return json.dumps({"loan": "no"})
+        return json.dumps({"buy_A": "no", "buy_B": "no", "sell_A": "no", "sell_B": "no", "loan": "no"})
+    return rng.choice(("I expect A to stay flat today.", "B looks strong after the report.", "Holding cash for now."))
+
+
+def _trade(prices, holdings, cash, rng):
+    stock = rng.choice("AB")
+    price = prices[stock]
+    if not price or rng.random() < 0.3: return {"action_type": "no"}
+    quote = round(price * (1 + 0.01 * rng.randint(-1, 1)), 2)
+    if rng.random() < 0.5 and holdings[stock] >= 1:
+        return {"action_type": "sell", "stock": stock, "amount": max(1, int(holdings[stock] * 0.1)), "price": quote}
+    amount = int(cash * 0.05 // quote) if quote > 0 else 0
+    if amount < 1: return {"action_type": "no"}
+    return {"action_type": "buy", "stock": stock, "amount": amount, "price": quote}
+
+
+def malform(content, rng):
+    """Breaks a reply in one of the ways real models do. Returns (content, kind)."""
+    kind = rng.choice(MALFORMED_KINDS)
+    if content.startswith("["): # Batch reply: spoil one trader's element
+        elements = json.loads(content)
+        if not elements: return content, None
+        i = rng.randrange(len(elements))
+        elements[i] = {"agent_id": elements[i].get("agent_id"), "action_type": "hold"}
+        return json.dumps(elements), "bad_element"
+    if not content.startswith("{"): return content, None # Forum posts are free text
+    if kind == "trailing_comma": return content[:-1] + ",}", kind
+    if kind == "truncated": return content[:max(1, len(content) * 2 // 3)], kind
+    if kind == "two_blocks": return f"Draft: {content}\nFinal answer: {content}", kind
+    if kind == "single_quotes": return content.replace('"', "'"), kind
+    return "I would rather wait and see how the market develops.", kind
+
+
+class StubLLMServer:
+    """Threaded HTTP server implementing POST /v1/chat/completions (plain and stream=true)."""
+
+    def __init__(self, host="127.0.0.1", port=0, latency="fixed:0", latency_by_kind=None, rate_429=0.0, rate_5xx=0.0,
+                 rate_malformed=0.0, max_rps=None, max_concurrency=None, retry_after=1.0, seed=None):
+        self.host, self.port = host, port
+        self.latency = parse_latency(latency)
+        self.latency_by_kind = {kind: parse_latency(spec) for kind, spec in (latency_by_kind or {}).items()}
+        self.rate_429, self.rate_5xx, self.rate_malformed = rate_429, rate_5xx, rate_malformed
+        self.max_rps, self.max_concurrency, self.retry_after = max_rps, max_concurrency, retry_after
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = float(max_rps) if max_rps else 0.0
+        self._refilled = time.monotonic()
+        self._in_flight = 0
+        self._stats = {"requests": 0, "ok": 0, "streamed": 0, "client_closed": 0, "injected_429": 0, "injected_5xx": 0, "throttled_rps": 0,
+                       "throttled_concurrency": 0, "malformed": 0, "peak_in_flight": 0, "total_latency": 0.0}
+        self._kinds = {}
+        self._prefixes = set() # Hashes of every message prefix seen, in whole cache blocks
+        self._httpd = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/v1"
+
+    def start(self):
+        self._httpd = ThreadingHTTPServer((self.host, self.port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self.port = self._httpd.server_address[1]
+        threading.Thread(target=self._httpd.serve_forever, name="stub-llm-server", daemon=True).start()
+        log.logger.info(f"Stub LLM server listening on {self.base_url}")
+        return self.base_url
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["by_kind"] = dict(self._kinds)
+            stats["in_flight"] = self._in_flight
+        stats["avg_latency"] = stats["total_latency"] / stats["ok"] if stats["ok"] else 0.0
+        return stats
+
+    # --- Admission and fault injection, decided under one lock so the RNG stream is reproducible ---
+    def _admit(self):
+        """Returns None to serve the call, or (status, message) to reject it."""
+        with self._lock:
+            self._stats["requests"] += 1
+            if self.max_rps:
+                now = time.monotonic()
+                self._tokens = min(float(self.max_rps), self._tokens + (now - self._refilled) * self.max_rps)
+                self._refilled = now
+                if self._tokens < 1:
+                    self._stats["throttled_rps"] += 1
+                    return 429, "Rate limit reached for requests"
+                self._tokens -= 1
+            if self.max_concurrency and self._in_flight >= self.max_concurrency:
+                self._stats["throttled_concurrency"] += 1
+                return 429, "Too many concurrent requests"
+            roll = self._rng.random()
+            if roll < self.rate_429:
+                self._stats["injected_429"] += 1
+                return 429, "Rate limit reached (injected)"
+            if roll < self.rate_429 + self.rate_5xx:
+                self._stats["injected_5xx"] += 1
+                return self._rng.choice((500, 502, 503)), "Upstream error (injected)"
+            self._in_flight += 1
+            self._stats["peak_in_flight"] = max(self._stats["peak_in_flight"], self._in_flight)
+            return None
+
+    def _complete(self, body):
+        """Builds the reply for an admitted call: (content, delay, malformed_kind)."""
+        messages = body.get("messages") or []
+        prompt = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+        kind = classify(prompt)
+        with self._lock:
+            self._kinds[kind] = self._kinds.get(kind, 0) + 1
+            content = reply_for(prompt, self._rng)
+            broken = None
+            if self._rng.random() < self.rate_malformed:
+                content, broken = malform(content, self._rng)
+                if broken: self._stats["malformed"] += 1
+            delay = self.latency_by_kind.get(kind, self.latency)(self._rng)
+        return content, delay, broken
+
+    def _cache_hit_chars(self, messages):
+        """Simulated prefix cache: how much of this request's leading text an earlier request already sent."""
+        text = "".join(f"{m.get('role')}\x00{m.get('content') or ''}\x01" for m in messages)
+        digest, hit, counting = hashlib.sha1(), 0, True
+        with self._lock:
+            if len(self._prefixes) > 1_000_000: self._prefixes.clear()
+            for end in range(CACHE_BLOCK_CHARS, len(text) + 1, CACHE_BLOCK_CHARS):
+                digest.update(text[end - CACHE_BLOCK_CHARS:end].encode("utf-8"))
+                key = digest.digest()
+                if counting and key in self._prefixes: hit = end
+                else: counting = False
+                self._prefixes.add(key)
+        return hit
+
+    def _finish(self, delay, ok):
+        with self._lock:
+            self._in_flight -= 1
+            if ok:
+                self._stats["ok"] += 1
+                self._stats["total_latency"] += delay
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # Keep-alive, like the real API
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, payload, headers=None):
+                out = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(out)))
+                for key, value in (headers or {}).items(): self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(out)
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/stats"): self._send_json(200, server.stats())
+                elif self.path.rstrip("/").endswith("/models"): self._send_json(200, {"object": "list", "data": [{"id": "stub", "object": "model", "owned_by": "stub"}]})
+                else: self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except json.JSONDecodeError:
+                    self._send_json(400, {"error": {"message": "Invalid JSON body", "type": "invalid_request_error"}}); return
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}}); return
+
+                rejected = server._admit()
+                if rejected is not None:
+                    status, message = rejected
+                    headers = {"Retry-After": str(server.retry_after)} if status == 429 else None
+                    self._send_json(status, {"error": {"message": message, "type": "rate_limit_error" if status == 429 else "server_error"}}, headers)
+                    return
+
+                ok = False
+                delay = 0.0
+                try:
+                    content, delay, _ = server._complete(body)
+                    completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+                    model = body.get("model", "stub")
+                    prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages") or []) // 4
+                    hit_tokens = min(server._cache_hit_chars(body.get("messages") or []) // 4, prompt_tokens)
+                    usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4 + 1,
+                             "total_tokens": prompt_tokens + len(content) // 4 + 1,
+                             "prompt_cache_hit_tokens": hit_tokens, "prompt_cache_miss_tokens": prompt_tokens - hit_tokens}
+                    if body.get("stream"):
+                        self._stream(completion_id, model, content, delay, usage if (body.get("stream_options") or {}).get("include_usage") else None)
+                    else:
+                        time.sleep(delay)
+                        self._send_json(200, {
+                            "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                            "usage": usage,
+                        })
+                    ok = True
+                finally:
+                    server._finish(delay, ok)
+
+            def _stream(self, completion_id, model, content, delay, usage):
+                # Server-sent events with chunked transfer; the delay is spread over the chunks
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                pieces = [content[i:i + 8] for i in range(0, len(content), 8)] or [""]
+                def chunk(delta, finish_reason=None, extra=None):
+                    event = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                             "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+                    if extra: event.update(extra)
+                    self._write_chunk(f"data: {json.dumps(event)}\n\n")
+                try:
+                    chunk({"role": "assistant", "content": ""})
+                    for piece in pieces:
+                        time.sleep(delay / len(pieces))
+                        chunk({"content": piece})
+                    chunk({}, "stop")
+                    if usage is not None:
+                        self._write_chunk(f"data: {json.dumps({'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model, 'choices': [], 'usage': usage})}\n\n")
+                    self._write_chunk("data: [DONE]\n\n")
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError): # Client stopped reading early (stop at JSON, latency budget)
+                    self.close_connection = True
+                    with server._lock: server._stats["client_closed"] += 1
+                    return
+                with server._lock: server._stats["streamed"] += 1
+
+            def _write_chunk(self, text):
+                data = text.encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stub server for load testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", default="fixed:0", help='e.g. "lognormal:0.8:0.5", "uniform:0.2:2", "exponential:1"')
+    parser.add_argument("--latency-for", action="append", default=[], metavar="KIND=SPEC",
+                        help="per call kind (loan, trade, estimate, forum, retry), e.g. trade=fixed:2")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="share of calls answered 429 with Retry-After")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="share of calls answered 500/502/503")
+    parser.add_argument("--rate-malformed", type=float, default=0.0, help="share of replies with broken JSON")
+    parser.add_argument("--max-rps", type=float, default=None, help="requests per second above which calls get 429")
+    parser.add_argument("--max-concurrency", type=int, default=None, help="calls in flight above which calls get 429")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server = StubLLMServer(
+        host=args.host, port=args.port, latency=args.latency,
+        latency_by_kind=dict(item.split("=", 1) for item in args.latency_for),
+        rate_429=args.rate_429, rate_5xx=args.rate_5xx, rate_malformed=args.rate_malformed,
+        max_rps=args.max_rps, max_concurrency=args.max_concurrency, retry_after=args.retry_after, seed=args.seed,
+    )
+    print(f"Stub LLM server on {server.start()} (stats at /stats), Ctrl+C to stop")
+    try:
+        while True: time.sleep(3600)
+    except KeyboardInterrupt:
+        print(json.dumps(server.stats(), indent=2))
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import random
+
+from call_auction import clear_call_auction
+
+
+def reference_clearing(orders, reference_price=None):
+    """Straightforward clear_call_auction: every submitted price tried in turn, then a price-time queue fill."""
+    buys = [(i, o) for i, o in enumerate(orders) if o["action_type"] == "buy"]
+    sells = [(i, o) for i, o in enumerate(orders) if o["action_type"] != "buy"]
+    if not buys or not sells: return None, []
+    best = None
+    for price in sorted({o["price"] for o in orders}):
+        demand = sum(o["amount"] for _, o in buys if o["price"] >= price)
+        supply = sum(o["amount"] for _, o in sells if o["price"] <= price)
+        key = (-min(demand, supply), abs(demand - supply),
+               abs(price - reference_price) if reference_price is not None else 0.0, price)
+        if best is None or key < best[0]: best = (key, price)
+    volume, price = -best[0][0], best[1]
+    if volume <= 0: return None, []
+
+    def queue(side, eligible, priority):
+        ranked = sorted((priority(o["price"]), i, o["amount"]) for i, o in side if eligible(o["price"]))
+        left, out = volume, []
+        for _, i, amount in ranked:
+            if left <= 0: break
+            out.append([i, min(amount, left)]); left -= out[-1][1]
+        return out
+
+    bids = queue(buys, lambda p: p >= price, lambda p: -p)
+    asks = queue(sells, lambda p: p <= price, lambda p: p)
+    fills = []
+    while bids and asks:
+        amount = min(bids[0][1], asks[0][1])
+        fills.append((bids[0][0], asks[0][0], amount))
+        bids[0][1] -= amount; asks[0][1] -= amount
+        if not bids[0][1]: bids.pop(0)
+        if not asks[0][1]: asks.pop(0)
+    return float(price), fills
+
+
+def test_clearing_price_and_allocation_match_reference():
+    rng = random.Random(4321)
+    for _ in range(3000):
+        prices = [round(30 + 0.5 * i, 2) for i in range(rng.randint(1, 8))]
+        orders = [{"action_type": rng.choice(("buy", "sell")), "amount": rng.randint(1, 50),
+                   "price": rng.choice(prices), "agent": i} for i in range(rng.randint(0, 40))]
+        reference_price = rng.choice(prices + [None])
+        assert clear_call_auction(orders, reference_price) == reference_clearing(orders, reference_price)
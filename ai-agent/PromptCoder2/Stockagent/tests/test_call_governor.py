@@ -0,0 +1,78 @@
+import httpx
+import openai
+import pytest
+
+import call_governor
+from call_governor import CallGovernor, CircuitBreaker, CircuitOpenError
+
+
+def rate_limited(retry_after="0"):
+    request = httpx.Request("POST", "http://test/v1/chat/completions")
+    response = httpx.Response(429, headers={"retry-after": retry_after}, request=request)
+    return openai.RateLimitError("slow down", response=response, body=None)
+
+
+def test_backoff_is_capped_and_honours_retry_after():
+    governor = CallGovernor(backoff_base=0.5, backoff_max=4.0)
+    assert all(0 <= governor.backoff(attempt) <= 4.0 for attempt in range(10) for _ in range(20))
+    assert governor.backoff(0, retry_after=3.0) >= 3.0
+    assert governor.backoff(0, retry_after=60.0) == 4.0 # Never longer than backoff_max
+
+
+def test_429s_are_retried_and_cut_the_concurrency_limit(monkeypatch):
+    monkeypatch.setattr(call_governor.time, "sleep", lambda seconds: None)
+    governor = CallGovernor(max_concurrency=8, max_retries=2)
+    replies = [rate_limited(), rate_limited(), "ok"]
+
+    def call():
+        reply = replies.pop(0)
+        if isinstance(reply, Exception): raise reply
+        return reply
+
+    assert governor.call("m", call) == "ok"
+    state = governor.state()
+    assert (state["attempts"], state["retries"], state["throttled"]) == (3, 2, 2)
+    assert state["concurrency_limit"] < 8 and state["in_flight"] == 0
+
+
+def test_breaker_opens_fails_fast_and_closes_after_a_successful_probe(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(call_governor.time, "monotonic", lambda: clock[0])
+    breaker = CircuitBreaker(error_rate=0.5, window=4, min_calls=4, cooldown=30.0)
+    transitions = [breaker.record(ok) for ok in (True, False, True, False)]
+    assert transitions[-1] == "open" and breaker.allow() == (False, None)
+    clock[0] = 31.0
+    assert breaker.allow() == (True, "half_open")
+    assert breaker.allow() == (False, None) # One probe at a time
+    assert breaker.record(False) == "open"
+    clock[0] = 62.0
+    assert breaker.allow() == (True, "half_open")
+    assert breaker.record(True) == "closed" and breaker.allow() == (True, None)
+
+
+def test_open_breaker_raises_without_calling():
+    governor = CallGovernor(max_retries=0, breaker_window=2) # Opens on the first failure (min_calls 1)
+
+    def unreachable():
+        raise openai.APIConnectionError(request=httpx.Request("POST", "http://test/v1/chat/completions"))
+
+    with pytest.raises(openai.APIConnectionError):
+        governor.call("m", unreachable)
+    calls = []
+    with pytest.raises(CircuitOpenError):
+        governor.call("m", lambda: calls.append(1))
+    assert calls == [] and governor.state()["fast_failed"] == 1
+
+
+def test_a_call_abandoned_at_its_deadline_counts_as_neither_success_nor_failure():
+    governor = CallGovernor(max_concurrency=4, breaker_window=2)
+
+    def slow():
+        raise httpx.ReadTimeout("over budget")
+
+    for _ in range(5):
+        with pytest.raises(httpx.ReadTimeout):
+            governor.call("m", slow, deadline=5)
+    state = governor.state()
+    assert (state["breaker_state"], state["failures"], state["deadline_expired"]) == ("closed", 0, 5)
+    assert (state["concurrency_limit"], state["in_flight"]) == (4, 0)
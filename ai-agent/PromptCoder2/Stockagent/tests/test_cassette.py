@@ -0,0 +1,16 @@
+from cassette import Cassette
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+def test_rerecording_a_key_drops_the_older_longer_sequence(tmp_path):
+    path = str(tmp_path / "cassette.sqlite")
+    cassette = Cassette(path, "record")
+    for response in ("a", "b", "c"): cassette.store("m", 1, MESSAGES, response)
+    cassette.close()
+    cassette = Cassette(path, "record")
+    cassette.store("m", 1, MESSAGES, "z")
+    cassette.close()
+
+    cassette = Cassette(path, "replay")
+    assert [cassette.lookup("m", 1, MESSAGES) for _ in range(3)] == ["z", "z", "z"]
@@ -0,0 +1,27 @@
+import os
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+import columnar_export
+from record import RecordSink
+
+
+def test_export_partitions_by_run_and_day_and_loads_only_what_is_asked(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    root = str(tmp_path / "parquet")
+    for run_id, price in (("run-1", 10.0), ("run-2", 20.0)):
+        sink = RecordSink(flush_rows=100, run_id=run_id)
+        for day in (1, 2, 3):
+            sink.append("stocks", (day, 1, price + day, price))
+        columnar_export.export_run(root, run_id, sink=sink)
+        sink.close()
+
+    assert columnar_export.runs(root) == ["run-1", "run-2"]
+    assert os.path.isfile(os.path.join(root, "stocks", "run_id=run-2", "day=3", "part-0.parquet"))
+    frame = columnar_export.load(root, "stocks", runs=["run-2"], columns=["day", "price_a"], first_day=2, as_pandas=True)
+    assert sorted(zip(frame["day"], frame["price_a"])) == [(2, 22.0), (3, 23.0)]
+    assert columnar_export.load(root, "stocks").schema.field("price_a").type == "double"
+    with pytest.raises(FileNotFoundError):
+        columnar_export.load(root, "trades_missing")
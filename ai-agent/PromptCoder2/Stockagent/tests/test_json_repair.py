@@ -0,0 +1,47 @@
+import pytest
+
+from json_repair import JsonObjectWatcher, as_number, as_yes_no, repair_json_object
+from secretary import Secretary
+
+
+def test_watcher_skips_objects_without_the_expected_keys():
+    watcher = JsonObjectWatcher(("action_type",))
+    assert not watcher.feed('Draft: {"stock": "A"}, and in prose a } brace. Answer: {"action_type": "buy", ')
+    assert watcher.feed('"stock": "A", "extra": {"nested": 1}} trailing text')
+
+
+def test_watcher_without_keys_stops_at_the_first_object_and_ignores_braces_in_strings():
+    watcher = JsonObjectWatcher()
+    assert not watcher.feed('{"note": "a } inside"')
+    assert watcher.feed(', "loan": "no"}')
+
+
+@pytest.mark.parametrize("reply, expected, rules", [
+    ('{"loan": "no"}', {"loan": "no"}, []),
+    ('```json\n{"loan": "no"}\n```', {"loan": "no"}, ["code_fence"]),
+    ('Draft {"loan": "yes"} final {"loan": "no"}', {"loan": "no"}, ["last_object"]),
+    ('{"loan": "no",}', {"loan": "no"}, ["trailing_comma"]),
+    ("{'loan': 'no'}", {"loan": "no"}, ["single_quotes"]),
+    ('{loan: "yes", amount: 5}', {"loan": "yes", "amount": 5}, ["unquoted_keys"]),
+    ('{"buy_A": True, "loan": None}', {"buy_A": True, "loan": None}, ["python_literals"]),
+])
+def test_repair_json_object_names_the_rules_it_applied(reply, expected, rules):
+    assert repair_json_object(reply) == (expected, rules)
+
+
+def test_repair_json_object_gives_up_without_an_object():
+    assert repair_json_object("I would not take a loan.")[0] is None
+    assert repair_json_object('{"loan": "no"')[0] is None # Never closed
+    assert repair_json_object(None) == (None, [])
+
+
+def test_number_and_yes_no_coercion():
+    assert [as_number(v) for v in ("1,000", "$30.5", 7, True, "ten")] == [1000, 30.5, 7, None, None]
+    assert [as_yes_no(v) for v in (True, "Y", "false", "None", "maybe")] == ["yes", "yes", "no", "no", None]
+
+
+def test_secretary_repairs_and_clamps_an_order_instead_of_re_prompting():
+    secretary = Secretary("test-model", api_key="")
+    ok, _, action = secretary.check_action("{'Action_Type': 'BUY', 'stock': 'Stock A', 'amount': '50', 'price': 10,}",
+                                           cash=200.0, stock_a_amount=0, stock_b_amount=0, stock_a_price=10.0, stock_b_price=10.0)
+    assert ok and action == {"action_type": "buy", "stock": "A", "amount": 20, "price": 10}
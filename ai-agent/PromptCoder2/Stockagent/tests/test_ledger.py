@@ -0,0 +1,20 @@
+from ledger import AgentLedger
+
+
+def test_charge_skips_quit_rows_and_flags_negative_cash():
+    ledger = AgentLedger()
+    rows = [ledger.add_row(cash=cash, holdings={"A": 10, "B": 0}) for cash in (100.0, 5.0, 50.0)]
+    ledger.quit[rows[2]] = True
+    ledger.charge([10.0, 10.0, 10.0])
+    assert ledger.cash[:3].tolist() == [90.0, -5.0, 50.0]
+    assert ledger.is_bankrupt[:3].tolist() == [False, True, False]
+    assert ledger.bankruptcy_candidates().tolist() == [rows[1]]
+
+
+def test_portfolio_values_and_growth_keep_rows():
+    ledger = AgentLedger(capacity=1)
+    for i in range(5): ledger.add_row(cash=float(i), holdings={"A": i, "B": 2 * i})
+    total, cash, values = ledger.portfolio_values({"A": 3.0, "B": 1.0})
+    assert len(ledger) == 5
+    assert values[:, 0].tolist() == [0.0, 3.0, 6.0, 9.0, 12.0]
+    assert total.tolist() == [0.0, 6.0, 12.0, 18.0, 24.0]
@@ -0,0 +1,47 @@
+import pytest
+
+from ledger import AgentLedger
+from loan_book import LoanBook
+
+RATES = [0.12, 0.24]
+
+
+def make_book(cash=(1000.0, 1000.0)):
+    ledger = AgentLedger()
+    for amount in cash: ledger.add_row(cash=amount)
+    return ledger, LoanBook(ledger)
+
+
+def test_settle_due_repays_only_that_days_loans_with_interest():
+    ledger, book = make_book()
+    book.add(0, {"amount": 100.0, "loan_type": 0, "repayment_date": 5})
+    later = {"amount": 200.0, "loan_type": 1, "repayment_date": 9}
+    book.add(1, later)
+    settled = book.settle_due(5, RATES)
+    assert [(row, repayment) for row, _, repayment in settled] == [(0, pytest.approx(112.0))]
+    assert ledger.cash[:2].tolist() == [pytest.approx(888.0), 1000.0]
+    assert book.loans_of(0) == [] and book.loans_of(1) == [later]
+    assert book.total_for(0) == 0.0 and book.total_for(1) == 200.0
+    assert book.settle_due(5, RATES) == [] # Already repaid
+
+
+def test_settle_due_leaves_quit_rows_and_other_rows_untouched():
+    ledger, book = make_book()
+    book.add(0, {"amount": 100.0, "loan_type": 0, "repayment_date": 5})
+    book.add(1, {"amount": 100.0, "loan_type": 0, "repayment_date": 5})
+    assert [row for row, _, _ in book.settle_due(5, RATES, rows=[1])] == [1]
+    ledger.quit[0] = True
+    assert book.settle_due(5, RATES) == []
+    assert len(book) == 1 and len(book.loans_of(0)) == 1
+
+
+def test_accrue_interest_charges_a_month_of_every_open_loan_per_row():
+    ledger, book = make_book(cash=(1000.0, 10.0))
+    book.add(0, {"amount": 100.0, "loan_type": 0, "repayment_date": 5})
+    book.add(0, {"amount": 100.0, "loan_type": 1, "repayment_date": 9})
+    book.add(1, {"amount": 1200.0, "loan_type": 1, "repayment_date": 9})
+    book.add(1, {"amount": 500.0, "loan_type": 7, "repayment_date": 9}) # Unpriceable type: never charged
+    per_row = book.accrue_interest(RATES)
+    assert per_row.tolist() == pytest.approx([3.0, 24.0])
+    assert ledger.cash[:2].tolist() == pytest.approx([997.0, -14.0])
+    assert ledger.is_bankrupt[:2].tolist() == [False, True]
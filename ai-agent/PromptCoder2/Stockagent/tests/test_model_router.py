@@ -0,0 +1,41 @@
+from model_router import ModelRouter, make_router
+
+ROUTES = {"trade": {"model": "", "latency_budget": 10, "fallback": "fast"},
+          "forum": {"model": "chatty", "latency_budget": 0, "fallback": ""}}
+
+
+def test_plan_routes_by_call_type_and_gives_a_deadline_only_with_a_fallback():
+    router = ModelRouter(ROUTES, default_model="main")
+    assert router.plan("trade") == ("trade", "main", "fast", 10.0)
+    assert router.plan("trade_retry", "agent-model") == ("retry", "agent-model", None, None)
+    assert router.plan("forum") == ("forum", "chatty", None, None)
+
+
+def test_slow_primary_moves_calls_to_the_fallback_and_still_probes_it():
+    router = ModelRouter(ROUTES, default_model="main", probe_every=3)
+    router.record("trade", "main", 30.0)
+    plans = [router.plan("trade")[1:] for _ in range(3)]
+    assert plans == [("fast", None, None), ("fast", None, None), ("main", "fast", 10.0)] # Third is a probe
+    for _ in range(5): router.record("trade", "main", 1.0)
+    assert router.plan("trade")[1] == "main"
+    stats = router.report()["trade"]
+    assert stats["over_budget"] == 1 and stats["calls"] == 6
+
+
+def test_expired_and_fallback_calls_are_reported_apart_from_errors():
+    router = ModelRouter(ROUTES, default_model="main")
+    router.record("trade", "main", 10.5, expired=True)
+    router.record("trade", "fast", 1.0, reply_text='{"action_type": "no"}', fallback=True, deadline_fallback=True)
+    stats = router.report()["trade"]
+    assert (stats["errors"], stats["expired"], stats["fallback_calls"], stats["deadline_fallbacks"]) == (0, 1, 1, 1)
+    assert stats["models"] == {"main": 1, "fast": 1} and stats["estimated_calls"] == 1
+
+
+def test_deepseek_chat_fallback_is_added_on_deepseek_only():
+    routes = {"trade": {"model": "", "latency_budget": 90}, "forum": {"model": "", "latency_budget": 90, "fallback": ""}}
+    config = {"LLM_ROUTES": routes, "MODEL_NAME": "deepseek-reasoner", "LLM_BASE_URL": "https://api.deepseek.com/v1"}
+    router = make_router(config)
+    assert router.plan("trade")[2] == "deepseek-chat" and router.plan("forum")[2] is None
+    local = make_router(dict(config, LLM_BASE_URL="http://127.0.0.1:8001/v1"))
+    assert local.plan("trade")[2] is None
+    assert "fallback" not in routes["trade"] # The config is not modified
@@ -0,0 +1,52 @@
+import copy
+import random
+
+from order_book import OrderBook
+
+
+def list_scan_match(order, stock_deals, fills):
+    """The matcher handle_action used before OrderBook: a scan of the opposite side's list."""
+    side = order["action_type"]
+    opposite = "sell" if side == "buy" else "buy"
+    for resting in stock_deals[opposite][:]:
+        if order["price"] == resting["price"]:
+            close_amount = min(order["amount"], resting["amount"])
+            buyer, seller = (order, resting) if side == "buy" else (resting, order)
+            fills.append((buyer["agent"], seller["agent"], close_amount, order["price"]))
+            if order["amount"] > close_amount:
+                stock_deals[opposite].remove(resting); order["amount"] -= close_amount
+            else:
+                resting["amount"] -= close_amount
+                if resting["amount"] <= 0: stock_deals[opposite].remove(resting)
+                return
+    if order["amount"] > 0: stock_deals[side].append(order)
+
+
+def random_stream(rng, length):
+    prices = [round(30 + 0.5 * i, 2) for i in range(rng.randint(1, 6))]
+    return [{"action_type": rng.choice(("buy", "sell")), "stock": "A", "amount": rng.randint(1, 50),
+             "price": rng.choice(prices), "agent": rng.randint(0, 20), "date": 1} for _ in range(length)]
+
+
+def book_rows(orders):
+    return [(o["agent"], o["price"], o["amount"]) for o in orders]
+
+
+def test_order_book_reproduces_list_scan_fills():
+    rng = random.Random(1234)
+    for _ in range(3000):
+        stream = random_stream(rng, rng.randint(1, 60))
+        expected_fills, deals = [], {"buy": [], "sell": []}
+        for order in copy.deepcopy(stream):
+            list_scan_match(order, deals, expected_fills)
+
+        fills, book = [], OrderBook()
+        record = lambda incoming, resting, amount: fills.append(
+            ((incoming if incoming["action_type"] == "buy" else resting)["agent"],
+             (resting if incoming["action_type"] == "buy" else incoming)["agent"], amount, incoming["price"]))
+        for order in copy.deepcopy(stream):
+            book.submit(order, record)
+
+        assert fills == expected_fills
+        for side in OrderBook.SIDES:
+            assert book_rows(book.orders(side)) == book_rows(deals[side])
@@ -0,0 +1,28 @@
+import numpy as np
+
+from agent import endowment_at, random_init_bulk
+
+CONFIG = {"MIN_INITIAL_PROPERTY": 100000.0, "MAX_INITIAL_PROPERTY": 5000000.0,
+          "LOAN_TYPE": ["one-month", "two-month", "three-month"], "REPAYMENT_DAYS": [22, 44, 66]}
+
+
+def test_bulk_endowments_stay_inside_the_feasible_region():
+    draws = random_init_bulk(20000, 30.0, 40.0, CONFIG, np.random.default_rng(7))
+    wealth = draws["stock_a"] * 30.0 + draws["stock_b"] * 40.0 + draws["cash"]
+    assert (draws["stock_a"] >= 0).all() and (draws["stock_b"] >= 0).all() and (draws["cash"] >= 0).all()
+    assert (wealth >= CONFIG["MIN_INITIAL_PROPERTY"] - 1e-6).all()
+    assert (wealth <= CONFIG["MAX_INITIAL_PROPERTY"] + 1e-6).all()
+    assert (draws["debt_amount"] >= 0).all() and (draws["debt_amount"] <= wealth).all()
+    assert set(draws["loan_type"].tolist()) == {0, 1, 2}
+    assert set(draws["repayment_date"].tolist()) == set(CONFIG["REPAYMENT_DAYS"])
+    # Density ~ W^3 puts most agents in the top half of the band
+    assert np.median(wealth) > (CONFIG["MIN_INITIAL_PROPERTY"] + CONFIG["MAX_INITIAL_PROPERTY"]) / 2
+
+
+def test_same_seed_gives_the_same_endowments_as_plain_values():
+    first = endowment_at(random_init_bulk(3, 30.0, 40.0, CONFIG, np.random.default_rng(1)), 2)
+    second = endowment_at(random_init_bulk(3, 30.0, 40.0, CONFIG, np.random.default_rng(1)), 2)
+    assert first == second
+    stock_a, stock_b, cash, debt = first
+    assert type(stock_a) is int and type(cash) is float
+    assert debt["loan"] == "yes" and debt["repayment_date"] in CONFIG["REPAYMENT_DAYS"]
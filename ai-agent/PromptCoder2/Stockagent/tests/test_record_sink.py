@@ -0,0 +1,32 @@
+import os
+
+import pandas as pd
+import pytest
+
+from record import RecordSink
+
+
+def test_each_run_spills_to_its_own_files_and_exports_only_its_rows(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for run_id, price in (("run-1", 1.0), ("run-2", 2.0)):
+        sink = RecordSink(flush_rows=2, run_id=run_id)
+        assert not os.path.exists(os.path.join("res", run_id)) # Nothing is written before the first flush
+        for day in range(3): sink.append("stocks", (day, 1, price, price))
+        sink.close()
+        assert sink.spill_path("stocks") == os.path.join("res", run_id, "stocks.csv")
+        assert sink.read("stocks")["Stock A Price (End of Session)"].tolist() == [price] * 3
+    assert pd.read_excel("res/stocks.xlsx")["Stock A Price (End of Session)"].tolist() == [2.0] * 3
+
+
+def test_a_row_with_a_bad_value_leaves_the_columns_aligned(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    sink = RecordSink(flush_rows=10, run_id="run-1")
+    sink.append("stocks", (1, 1, 10.0, 20.0))
+    with pytest.raises(ValueError):
+        sink.append("stocks", (2, 1, 11.0, "not a price")) # Fails on the last column
+    sink.append("stocks", (3, 1, 12.0, 22.0))
+    sink.close()
+    frame = sink.read("stocks")
+    assert frame["Trading Day"].tolist() == [1, 3]
+    assert frame["Stock B Price (End of Session)"].tolist() == [20.0, 22.0]
+    assert sink.stats["rows"] == 2
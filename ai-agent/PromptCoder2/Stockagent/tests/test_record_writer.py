@@ -0,0 +1,43 @@
+import threading
+
+from record import RecordSink, RecordWriter
+
+
+class GatedSink(RecordSink):
+    """A sink whose appends wait for the test to open the gate, so the writer's queue fills up."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.gate = threading.Event()
+
+    def append(self, table, row):
+        self.gate.wait(5)
+        super().append(table, row)
+
+
+def test_spill_policy_never_blocks_and_keeps_row_order(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    sink = GatedSink(flush_rows=1000, run_id="run-1")
+    writer = RecordWriter(sink, max_queue=2, policy="spill", batch_rows=1)
+    for day in range(20): writer.submit("stocks", (day, 1, float(day), 1.0))
+    stats = writer.report()
+    assert stats["spilled"] > 0 and stats["blocked_puts"] == 0
+    sink.gate.set()
+    assert writer.barrier(timeout=5)
+    assert sink.read("stocks")["Trading Day"].tolist() == list(range(20)) # Flushed by the barrier, in order
+    writer.close()
+    assert writer.report()["rows"] == 20
+
+
+def test_bad_rows_are_counted_and_rows_after_close_are_still_written(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    sink = RecordSink(flush_rows=1000, run_id="run-1")
+    writer = RecordWriter(sink, max_queue=10, policy="block")
+    writer.submit("stocks", (1, 1, 10.0, 20.0))
+    writer.submit("stocks", (2, 1)) # Wrong number of values
+    writer.close()
+    writer.submit("stocks", (3, 1, 12.0, 22.0))
+    writer.barrier()
+    report = writer.report()
+    assert (report["rows"], report["errors"]) == (1, 1) and "ValueError" in report["last_error"]
+    assert sink.read("stocks")["Trading Day"].tolist() == [1, 3]
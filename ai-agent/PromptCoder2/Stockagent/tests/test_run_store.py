@@ -0,0 +1,30 @@
+import json
+
+from record import TABLES, RecordSink
+from run_store import RunStore
+
+
+def test_runs_are_kept_apart_and_queried_by_agent_and_day(tmp_path):
+    store = RunStore(str(tmp_path / "runs.sqlite"), TABLES)
+    for run_id, cash in (("run-1", 100.0), ("run-2", 500.0)):
+        store.start_run(run_id, {"AGENTS_NUM": 2, "DEEPSEEK_API_KEY": "sk-secret"})
+        sink = RecordSink(fmt="sqlite", flush_rows=2, store=store, run_id=run_id)
+        for day in (1, 2, 3):
+            for agent in (0, 1):
+                sink.append("agent_session_record", (agent, day, 1, cash + 10 * day, cash, 0.0, 10.0 * day, "no", "", 0, 0.0))
+        sink.flush()
+        store.finish_run(run_id)
+
+    assert sorted(store.runs()[["run_id", "status"]].values.tolist()) == [["run-1", "finished"], ["run-2", "finished"]]
+    config = json.loads(store.query("SELECT config FROM runs WHERE run_id = 'run-1'")["config"][0])
+    assert config == {"AGENTS_NUM": 2} # API keys are not stored
+    assert store.has_run("run-2") and not store.has_run("run-3")
+
+    history = store.agent_history("run-2", 1, first_day=2, last_day=3)
+    assert history["day"].tolist() == [2, 3]
+    assert history["pnl"].tolist() == [0.0, 10.0]
+
+    frame = store.frame("agent_session_record", "run-1")
+    assert len(frame) == 6 and str(frame["Agent ID"].dtype) == "int64"
+    assert list(frame.columns) == [header for header, _ in TABLES["agent_session_record"][1]]
+    store.close()
@@ -0,0 +1,121 @@
+import numpy as np
+
+
+class Bar:
+    """OHLCV bar updated one trade at a time; VWAP is derived from volume and notional."""
+    __slots__ = ("open", "high", "low", "close", "volume", "notional", "trades")
+
+    def __init__(self, price, quantity):
+        self.open = self.high = self.low = self.close = price
+        self.volume = quantity
+        self.notional = price * quantity
+        self.trades = 1
+
+    def update(self, price, quantity):
+        if price > self.high: self.high = price
+        if price < self.low: self.low = price
+        self.close = price
+        self.volume += quantity
+        self.notional += price * quantity
+        self.trades += 1
+
+    @property
+    def vwap(self):
+        return self.notional / self.volume if self.volume else self.close
+
+    def to_dict(self):
+        return {"open": self.open, "high": self.high, "low": self.low, "close": self.close,
+                "volume": self.volume, "vwap": self.vwap, "trades": self.trades}
+
+
+class TickStore:
+    """Append-only trade tape for one stock.
+
+    Parallel NumPy columns (day, session, price, quantity) grow geometrically, so a long run keeps
+    its whole tape in four contiguous buffers. Per-session and per-day bars are updated on every
+    append. Days are appended in non-decreasing order, which lets slice_days() return views
+    (no copy) located by binary search.
+    """
+
+    def __init__(self, capacity=1024):
+        capacity = max(int(capacity), 1)
+        self.size = 0
+        self._day = np.zeros(capacity, dtype=np.int32)
+        self._session = np.zeros(capacity, dtype=np.int16)
+        self._price = np.zeros(capacity, dtype=np.float64)
+        self._quantity = np.zeros(capacity, dtype=np.int64)
+        self.session_bars = {} # (day, session) -> Bar
+        self.day_bars = {}     # day -> Bar
+
+    def __len__(self):
+        return self.size
+
+    def _grow(self):
+        capacity = len(self._price) * 2
+        for name in ("_day", "_session", "_price", "_quantity"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def append(self, day, session, price, quantity):
+        if self.size >= len(self._price):
+            self._grow()
+        i = self.size
+        self._day[i] = day
+        self._session[i] = session
+        self._price[i] = price
+        self._quantity[i] = quantity
+        self.size += 1
+
+        bar = self.session_bars.get((day, session))
+        if bar is None: self.session_bars[(day, session)] = Bar(price, quantity)
+        else: bar.update(price, quantity)
+        bar = self.day_bars.get(day)
+        if bar is None: self.day_bars[day] = Bar(price, quantity)
+        else: bar.update(price, quantity)
+
+    # --- Zero-copy views of the live tape ---
+    @property
+    def day(self):
+        return self._day[:self.size]
+
+    @property
+    def session(self):
+        return self._session[:self.size]
+
+    @property
+    def price(self):
+        return self._price[:self.size]
+
+    @property
+    def quantity(self):
+        return self._quantity[:self.size]
+
+    def last_price(self, since=0):
+        """Price of the latest trade at index >= since, or None."""
+        return float(self._price[self.size - 1]) if self.size > since else None
+
+    def day_range(self, start_day, end_day=None):
+        """Index range [lo, hi) of trades with start_day <= day <= end_day."""
+        days = self.day
+        lo = int(np.searchsorted(days, start_day, side="left"))
+        hi = int(np.searchsorted(days, end_day if end_day is not None else start_day, side="right"))
+        return lo, hi
+
+    def slice_days(self, start_day, end_day=None):
+        """Views (day, session, price, quantity) for days in [start_day, end_day]."""
+        lo, hi = self.day_range(start_day, end_day)
+        return self._day[lo:hi], self._session[lo:hi], self._price[lo:hi], self._quantity[lo:hi]
+
+    def session_bar(self, day, session):
+        return self.session_bars.get((day, session))
+
+    def day_bar(self, day):
+        return self.day_bars.get(day)
+
+    def bars(self, level="session"):
+        """All bars as dicts in time order; level is "session" or "day"."""
+        if level == "day":
+            return [dict(day=day, **bar.to_dict()) for day, bar in sorted(self.day_bars.items())]
+        return [dict(day=day, session=session, **bar.to_dict()) for (day, session), bar in sorted(self.session_bars.items())]
@@ -11,11 +11,95 @@ load_dotenv()
 # Get API key from environment variable
 DEEPSEEK_API_KEY = os.getenv('DEEPSEEK_API_KEY')
 
+# 决策后端: "deepseek" 调用 OpenAI 兼容接口, "rule_based" 进程内规则策略 (不联网, 用于压测和大规模模拟)
+DECISION_BACKEND = "deepseek"
+LLM_BASE_URL = "https://api.deepseek.com/v1"  # OpenAI 兼容接口地址, 可指向本地或其他服务
+
+# LLM 连接池 (所有 Agent 和 Secretary 共享)
+LLM_POOL_SIZE = 20        # 每个 (base_url, api_key) 的最大连接数
+LLM_TIMEOUT = 120.0       # 请求超时 (秒)
+LLM_CONNECT_TIMEOUT = 10.0
+LLM_MAX_CONCURRENCY = 1  # 贷款/预测/论坛阶段同时进行的请求数, 1 为逐个调用
+# 各类调用的生成参数: max_tokens 上限 (推理模型不设), stop 停止词, temperature (None 沿用调用方),
+# stream 流式返回并在 JSON 对象闭合后立即停止; retry 用于所有重新提问
+LLM_GENERATION_PROFILES = {
+    "loan": {"max_tokens": 200, "stop": [], "temperature": None, "stream": True},
+    "trade": {"max_tokens": 200, "stop": [], "temperature": None, "stream": True},
+    "estimate": {"max_tokens": 120, "stop": [], "temperature": None, "stream": True},
+    "retry": {"max_tokens": 200, "stop": [], "temperature": None, "stream": True},
+    "forum": {"max_tokens": 400, "stop": [], "temperature": None, "stream": False},
+}
+# 各类调用的模型路由: model 为空时用 MODEL_NAME; latency_budget 为延迟预算 (秒, 0 不限);
+# 超出预算或近期平均延迟超预算时改用更快的 fallback 模型 (为空则不切换);
+# 未给出 fallback 的路由仅在 LLM_BASE_URL 为 DeepSeek 官方接口时回退到 deepseek-chat
+LLM_ROUTES = {
+    "loan": {"model": "", "latency_budget": 90},
+    "trade": {"model": "", "latency_budget": 90},
+    "estimate": {"model": "", "latency_budget": 0, "fallback": ""},
+    "forum": {"model": "", "latency_budget": 0, "fallback": ""},
+    "retry": {"model": "", "latency_budget": 60},
+}
+# 每百万 token 的价格 [输入, 输出, 缓存命中的输入] (美元), 用于按路由统计成本; 请按服务商当前价格调整
+LLM_MODEL_PRICES = {
+    "deepseek-chat": [0.28, 0.42, 0.028],
+    "deepseek-reasoner": [0.28, 0.42, 0.028],
+}
+
+# LLM 调用治理 (限流, 429 时自适应并发, 指数退避, 熔断)
+LLM_RATE_LIMIT_RPS = 0         # 每个模型每秒最多请求数, 0 表示不限
+LLM_MAX_RETRIES = 2            # 429/5xx/超时的重试次数 (带抖动的指数退避, 遵守 Retry-After)
+LLM_BACKOFF_BASE = 0.5         # 退避基数 (秒)
+LLM_BACKOFF_MAX = 30.0         # 单次退避上限 (秒)
+LLM_BREAKER_ERROR_RATE = 0.5   # 最近 20 次调用的错误率达到此值时熔断, 直接按"不操作"处理
+LLM_BREAKER_COOLDOWN = 30.0    # 熔断后多久放行一次试探请求 (秒)
+# LLM 录制/回放: "off" 关闭, "record" 录制, "replay" 仅回放 (不联网), "auto" 命中回放、未命中录制
+LLM_CASSETTE_MODE = "off"
+LLM_CASSETTE_PATH = "res/llm_cassette.sqlite"
+# Agent 对话上下文: "managed" 有界上下文 (去掉失败的重试往返, 早先时段压缩为摘要, 背景保持为固定前缀),
+# "legacy" (默认, 即原来的 "full") 每次重发当天全部对话; CONTEXT_TOKEN_BUDGET 为每次调用的输入 token 上限 (估算, 0 不限)
+CONTEXT_MODE = "legacy"
+CONTEXT_TOKEN_BUDGET = 6000
+# 提示词布局: "legacy" 原有拼接方式; "prefix" 所有静态内容 (背景, 财报, 规则) 放在逐字节相同的 system 消息中
+# (按性格分四种), 变化的数值放在最后的 user 消息里, 以提高服务商前缀缓存命中率
+PROMPT_LAYOUT = "legacy"
+# 统计 token 用量与缓存命中: 开启后 (或 PROMPT_LAYOUT 为 "prefix" 时) 不再流式读取回复, 以拿到服务商返回的 usage
+LLM_TRACK_USAGE = False
+
 # 基础设置
 AGENTS_NUM = 20  # 交易员数量
 TOTAL_DATE = 180   # 模拟时长
 TOTAL_SESSION = 3   # 每日交易次数
 
+# 交易时段撮合方式: "continuous" 逐笔撮合, "call_auction" 每个时段集合竞价,
+# "snapshot" 基于时段开始时的快照并发决策, 再按随机顺序逐笔校验并撮合
+SESSION_MODE = "continuous"
+# 批量决策: 每次请求为多少个交易员同时做交易决策 (返回按 agent_id 的 JSON 数组, 逐个校验, 不合格者单独重问);
+# 0 或 1 表示不批量. 仅用于 "snapshot" 和 "call_auction" 模式 (所有人基于同一快照决策)
+TRADE_BATCH_SIZE = 0
+# 近似决策缓存: 性格、财富档位、持仓比例、价格档位和盘口相近的交易员复用同一交易/贷款决策 (按各自现金/持仓缩放后再校验).
+# ttl_sessions 有效时段数, max_entries LRU 容量, wealth_step 财富档位 (log10), ratio_step 持仓比例档位,
+# price_step / book_step 价格和盘口的相对档位
+DECISION_CACHE = {"enabled": False, "ttl_sessions": 3, "max_entries": 10000,
+                  "wealth_step": 0.25, "ratio_step": 0.1, "price_step": 0.02, "book_step": 0.02}
+# 交易决策备忘: 持仓、现金、价格和盘口与当天上一时段完全相同时不再询问模型.
+# "off" 关闭, "reissue" 重新提交上一时段的决策, "skip" 本时段不操作
+TRADE_MEMO_POLICY = "off"
+
+# 记录输出: 行先缓存在内存中, 每 RECORD_FLUSH_ROWS 行追加到 res/<运行 id>/ 下的 "csv" 或 "jsonl" 文件,
+# 或按运行 id 批量写入 SQLite 数据库 RECORD_STORE_PATH ("sqlite"); 运行结束时一次性导出为 .xlsx
+RECORD_FORMAT = "csv"
+RECORD_FLUSH_ROWS = 1000
+RECORD_STORE_PATH = "res/runs.sqlite"
+# 记录总行数超过该值的运行结束时不再导出 .xlsx (导出比模拟本身更慢), 0 表示总是导出; 可用 POST /export_records 手动导出
+RECORD_EXCEL_MAX_ROWS = 100000
+# 运行结束后把全部记录表和成交明细导出为 Parquet (按运行 id 和交易日分区) 的目录, 为空则不导出 (需要 pyarrow)
+RECORD_PARQUET_DIR = ""
+# 记录写入线程的队列长度 (0 表示在模拟线程上直接写入); 队列满时 "block" 等待, "spill" 放入不设上限的溢出列表
+RECORD_QUEUE_SIZE = 10000
+RECORD_QUEUE_POLICY = "block"
+# 模拟运行时的日志级别: "INFO" 只记录每日事件和统计, "DEBUG" 另外记录每个 Agent 的每笔决策、成交和论坛发言
+LOG_LEVEL = "INFO"
+
 # 股票初始价格
 STOCK_A_INITIAL_PRICE = 30
 STOCK_B_INITIAL_PRICE = 40
@@ -24,6 +108,7 @@ STOCK_B_INITIAL_PRICE = 40
 # agent初始财产
 MAX_INITIAL_PROPERTY = 5000000.0
 MIN_INITIAL_PROPERTY = 100000.0
+RANDOM_SEED = None  # 随机种子, None 表示每次运行不同
 
 
 # 贷款
@@ -32,6 +117,8 @@ LOAN_TYPE_DATE = [22, 44, 66]  # 贷款时长
 LOAN_RATE = [0.027, 0.03, 0.033] # 贷款利率
 
 REPAYMENT_DAYS = [22, 44, 66, 88, 110, 132, 154, 176, 198, 220, 242, 264]  # 付息日
+# 付息日是否真正收取利息. 原版本的 interest_payment() 从未执行 (写在 continue 之后), 默认 False 以复现原有结果
+CHARGE_INTEREST = False
 
 # 财报
 SEASONAL_DAYS = 66 # 一季度的时间